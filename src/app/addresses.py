@@ -1,11 +1,130 @@
-import uuid
-from typing import Optional
+"""Client withdrawal address whitelist.
 
-from .db import db, now_iso
+``get_approved_address`` is on every release request, and the whitelist
+rarely changes, so approved addresses are cached per process by
+(client_id, chain). ``add_address`` and ``set_address_status`` bump the
+``addresses`` row of ``cache_versions`` in their own transaction and, once
+it commits, drop the affected key locally. Other processes notice the new
+version on their next lookup and drop their whole cache.
+
+The version row is only re-read when ``PRAGMA data_version`` says another
+connection has committed since the last check, so a hit usually costs no
+table read at all. Inside a transaction that changed a key, that key is read
+from the table until the transaction ends. Without the ``cache_versions`` table (migrations not
+applied) lookups go straight to ``addresses``.
+"""
+
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+from .db import db, in_transaction, now_iso, on_commit, pool
+from .ids import new_id
+
+Key = Tuple[str, str]
+
+
+class WhitelistCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[Key, Dict[str, str]] = {}
+        self._version: Optional[int] = None
+        # per thread (= per pooled connection): (connection, data_version, counter value)
+        self._local = threading.local()
+        self.metrics = {"hits": 0, "misses": 0, "bypassed": 0, "invalidations": 0, "flushes": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.metrics[name] += 1
+
+    def _current_version(self, conn: sqlite3.Connection) -> Optional[int]:
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        seen = getattr(self._local, "seen", None)
+        if seen and seen[0] is conn and seen[1] == data_version:
+            return seen[2]
+        try:
+            row = conn.execute("SELECT version FROM cache_versions WHERE name='addresses'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        version = row[0] if row else None
+        self._local.seen = (conn, data_version, version)
+        return version
+
+    def approved(self, conn: sqlite3.Connection, client_id: str, chain: str) -> Dict[str, str]:
+        """address -> address id of the approved addresses of (client_id, chain)."""
+        key = (client_id, chain)
+        dirty = getattr(self._local, "dirty", None)
+        if dirty and not in_transaction():
+            dirty.clear()
+        # a key written in the still-open transaction must read that transaction's view
+        version = None if dirty and key in dirty else self._current_version(conn)
+        if version is not None:
+            with self._lock:
+                if version != self._version:
+                    if self._entries:
+                        self.metrics["flushes"] += 1
+                    self._entries, self._version = {}, version
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.metrics["hits"] += 1
+                    return entry
+        entry = {
+            r["address"]: r["id"]
+            for r in conn.execute(
+                "SELECT id, address FROM addresses WHERE client_id=? AND chain=? AND status='approved'",
+                (client_id, chain),
+            )
+        }
+        if version is None:
+            self._count("bypassed")
+            return entry
+        with self._lock:
+            self.metrics["misses"] += 1
+            if version == self._version:
+                self._entries[key] = entry
+        return entry
+
+    def written(self, conn: sqlite3.Connection, client_id: str, chain: str) -> None:
+        """Bump the version in the caller's transaction; drop the key locally once it commits."""
+        try:
+            row = conn.execute(
+                "UPDATE cache_versions SET version=version+1 WHERE name='addresses' RETURNING version"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        version = row[0] if row else None
+        self._local.__dict__.setdefault("dirty", set()).add((client_id, chain))
+
+        def invalidate() -> None:
+            with self._lock:
+                self._entries.pop((client_id, chain), None)
+                self.metrics["invalidations"] += 1
+                # our own bump needs no flush; anything else in between does
+                if version is not None and self._version == version - 1:
+                    self._version = version
+            self._local.seen = None
+
+        on_commit(invalidate)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries, self._version = {}, None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out: Dict[str, float] = dict(self.metrics)
+            out["keys"] = len(self._entries)
+            out["version"] = self._version
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+
+whitelist = WhitelistCache()
 
 
 def add_address(client_id: str, chain: str, address: str, label: Optional[str] = None) -> str:
-    addr_id = f"addr_{uuid.uuid4()}"
+    addr_id = new_id("addr")
     with db() as conn:
         c = conn.cursor()
         c.execute(
@@ -13,6 +132,8 @@ def add_address(client_id: str, chain: str, address: str, label: Optional[str] =
             " VALUES(?,?,?,?,?,?,?, ?, ?)",
             (addr_id, client_id, chain, address, label, None, "pending", now_iso(), now_iso()),
         )
+        if c.rowcount:
+            whitelist.written(conn, client_id, chain)
         # fetch id (unique constraint might have ignored insert)
         c.execute(
             "SELECT id FROM addresses WHERE client_id=? AND chain=? AND address=?",
@@ -27,18 +148,16 @@ def set_address_status(addr_id: str, status: str, risk_score: Optional[int] = No
     with db() as conn:
         c = conn.cursor()
         c.execute(
-            "UPDATE addresses SET status=?, risk_score=COALESCE(?, risk_score), updated_at=? WHERE id=?",
+            "UPDATE addresses SET status=?, risk_score=COALESCE(?, risk_score), updated_at=? WHERE id=?"
+            " RETURNING client_id, chain",
             (status, risk_score, now_iso(), addr_id),
         )
+        row = c.fetchone()
+        if row:
+            whitelist.written(conn, row["client_id"], row["chain"])
 
 
 def get_approved_address(client_id: str, chain: str, address: str) -> Optional[str]:
-    with db() as conn:
-        c = conn.cursor()
-        c.execute(
-            "SELECT id FROM addresses WHERE client_id=? AND chain=? AND address=? AND status='approved'",
-            (client_id, chain, address),
-        )
-        row = c.fetchone()
-        return row["id"] if row else None
-
+    # no BEGIN/COMMIT needed: a hit is one PRAGMA, a miss two single-statement reads
+    # (inside a caller's transaction the pooled connection simply joins it)
+    return whitelist.approved(pool.acquire(), client_id, chain).get(address)
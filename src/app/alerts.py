@@ -1,11 +1,10 @@
-import uuid
-
 from .db import db, now_iso
+from .ids import new_id
 from .i18n import t
 
 
 def raise_alert(severity: str, kind: str, message: str, metadata: dict | None = None) -> str:
-    alert_id = f"al_{uuid.uuid4()}"
+    alert_id = new_id("al")
     with db() as conn:
         c = conn.cursor()
         c.execute(
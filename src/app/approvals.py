@@ -1,16 +1,18 @@
-import uuid
+import sqlite3
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from .audit import append as audit
 from .config import (
     SIM_FX_JPY_PER_USDT,
     SINGLE_APPROVAL_THRESHOLD_USDT,
 )
-from .db import db, now_iso
+from .db import db, now_iso, transactional
+from .ids import new_id
 from .addresses import get_approved_address
 
 
+@transactional
 def create_release_request(
     client_id: str,
     amount_usdt: float,
@@ -21,7 +23,7 @@ def create_release_request(
     # Enforce approved address exists
     if not get_approved_address(client_id, chain, address):
         raise ValueError("address not approved for this client/chain")
-    req_id = f"req_{uuid.uuid4()}"
+    req_id = new_id("req")
     required = 1 if amount_usdt <= SINGLE_APPROVAL_THRESHOLD_USDT else 2
     now = now_iso()
     with db() as conn:
@@ -43,46 +45,138 @@ def create_release_request(
                 now,
             ),
         )
-    audit("release_request", req_id, {
-        "client_id": client_id,
-        "amount_usdt": amount_usdt,
-        "chain": chain,
-        "address": address,
-        "required": required,
-        "max_slippage_bps": max_slippage_bps,
-    })
+        audit("release_request", req_id, {
+            "client_id": client_id,
+            "amount_usdt": amount_usdt,
+            "chain": chain,
+            "address": address,
+            "required": required,
+            "max_slippage_bps": max_slippage_bps,
+        })
     return req_id
 
 
+_APPROVE_SQL = (
+    "INSERT OR IGNORE INTO release_approvals(request_id, approver_id, approved_at) "
+    "SELECT id, ?, ? FROM release_requests WHERE id=? AND status='pending'"
+)
+
+# count and pending -> approved transition in one statement; only pending requests match,
+# so a returned 'approved' status means this statement made the transition
+_COUNT_SQL = (
+    "UPDATE release_requests SET approvals_count=n.cnt, "
+    "status=CASE WHEN n.cnt >= required_approvals THEN 'approved' ELSE status END, updated_at=? "
+    "FROM (SELECT COUNT(*) AS cnt FROM release_approvals WHERE request_id=?) AS n "
+    "WHERE id=? AND status='pending' "
+    "RETURNING approvals_count, required_approvals, status"
+)
+
+
+def _approve(conn: sqlite3.Connection, request_id: str, approver_id: str, now: str) -> Dict:
+    new = conn.execute(_APPROVE_SQL, (approver_id, now, request_id)).rowcount == 1
+    row = conn.execute(_COUNT_SQL, (now, request_id, request_id)).fetchone() if new else None
+    if row is None:
+        # nothing changed: tell a duplicate from a request that is gone or no longer pending
+        row = conn.execute(
+            "SELECT approvals_count, required_approvals, status, "
+            "EXISTS(SELECT 1 FROM release_approvals WHERE request_id=id AND approver_id=?) AS mine "
+            "FROM release_requests WHERE id=?",
+            (approver_id, request_id),
+        ).fetchone()
+        if row is None:
+            return {"request_id": request_id, "outcome": "not_found"}
+        outcome = "already_approved" if row["mine"] else "not_pending"
+    else:
+        outcome = "approved" if row["status"] == "approved" else "pending"
+    result = {
+        "request_id": request_id,
+        "outcome": outcome,
+        "status": row["status"],
+        "approvals_count": int(row["approvals_count"]),
+        "required_approvals": int(row["required_approvals"]),
+    }
+    if new:
+        audit("release_approved", request_id, {"approver": approver_id, "count": result["approvals_count"]})
+    return result
+
+
+@transactional
+def approve_one(request_id: str, approver_id: str) -> Dict:
+    """Approve one request; the outcome is as in ``approve_many``.
+
+    Only the approval that completes the request gets ``approved``, so the
+    caller can decide on the payout from it without re-reading the count.
+    A request still in ``approved`` status (its payout did not go out) is
+    returned rather than refused, so approving it again retries the payout.
+    """
+    with db() as conn:
+        result = _approve(conn, request_id, approver_id, now_iso())
+    if result["outcome"] == "not_found":
+        raise ValueError(f"release request {request_id} not found")
+    if result["outcome"] == "not_pending" and result["status"] != "approved":
+        raise ValueError(f"release request {request_id} is {result['status']}, not pending")
+    return result
+
+
 def approve_release(request_id: str, approver_id: str) -> int:
+    return approve_one(request_id, approver_id)["approvals_count"]
+
+
+@transactional
+def approve_many(request_ids: List[str], approver_id: str) -> List[Dict]:
+    """Approve a queue of requests in one transaction; one outcome per distinct request id.
+
+    Outcomes: ``approved`` (this approval completed it), ``pending`` (more
+    approvals needed), ``already_approved`` (this approver had approved it),
+    ``not_pending`` or ``not_found``.
+    """
     now = now_iso()
     with db() as conn:
-        c = conn.cursor()
-        # upsert approval actor
-        c.execute(
-            "INSERT OR IGNORE INTO release_approvals(request_id, approver_id, approved_at) VALUES(?,?,?)",
-            (request_id, approver_id, now),
-        )
-        # recalc approvals_count
-        c.execute(
-            "SELECT COUNT(*) as cnt FROM release_approvals WHERE request_id=?",
-            (request_id,),
-        )
-        cnt = int(c.fetchone()["cnt"])
-        c.execute(
-            "UPDATE release_requests SET approvals_count=?, updated_at=? WHERE id=?",
-            (cnt, now, request_id),
-        )
-        # if met required, move to approved
-        c.execute(
-            "SELECT required_approvals, status FROM release_requests WHERE id=?",
-            (request_id,),
-        )
-        row = c.fetchone()
-        if row and cnt >= int(row["required_approvals"]) and row["status"] == "pending":
-            c.execute(
-                "UPDATE release_requests SET status='approved', updated_at=? WHERE id=?",
-                (now, request_id),
-            )
-    audit("release_approved", request_id, {"approver": approver_id, "count": cnt})
-    return cnt
+        return [_approve(conn, rid, approver_id, now) for rid in dict.fromkeys(request_ids)]
+
+
+PENDING_PAGE_SIZE = 200
+
+# one indexed range read on (status, created_at, id) plus a covering lookup per row for the approvers
+_PENDING_SQL = (
+    "SELECT r.id, r.client_id, r.amount_usdt, r.chain, r.address, r.status, r.required_approvals,"
+    " r.approvals_count, r.created_at, group_concat(a.approver_id) AS approvers"
+    " FROM release_requests r LEFT JOIN release_approvals a ON a.request_id = r.id"
+    " WHERE r.status = 'pending'{after}"
+    " GROUP BY r.created_at, r.id ORDER BY r.created_at DESC, r.id DESC LIMIT ?"
+)
+
+
+def pending_approvals(limit: int = PENDING_PAGE_SIZE, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """One page of pending requests, newest first, each with its approver list.
+
+    ``after`` is the cursor returned with the previous page; the second item
+    is the cursor for the next page (None on the last one).
+    """
+    params: list = []
+    where = ""
+    if after:
+        created_at, sep, last_id = after.partition("|")
+        if not sep:
+            raise ValueError("invalid cursor")
+        where = " AND (r.created_at, r.id) < (?, ?)"
+        params += [created_at, last_id]
+    with db(readonly=True) as conn:
+        rows = conn.execute(_PENDING_SQL.format(after=where), params + [limit + 1]).fetchall()
+    items = [
+        {
+            "id": r["id"],
+            "client_id": r["client_id"],
+            "amount_usdt": r["amount_usdt"],
+            "chain": r["chain"],
+            "address": r["address"],
+            "status": r["status"],
+            "required_approvals": r["required_approvals"],
+            "approvals_count": r["approvals_count"],
+            "created_at": r["created_at"],
+            "approvers": sorted(r["approvers"].split(",")) if r["approvers"] else [],
+        }
+        for r in rows[:limit]
+    ]
+    cursor = f"{items[-1]['created_at']}|{items[-1]['id']}" if len(rows) > limit else None
+    return items, cursor
@@ -0,0 +1,230 @@
+"""Hot/cold archival of closed history into monthly SQLite files.
+
+Rows older than a cutoff move from the hot database into
+``ARCHIVE_DIR/fintech-YYYY-MM.db`` (by the row's timestamp month). Each
+month is copied with INSERT OR IGNORE and committed before the hot rows are
+deleted, so an interrupted run only leaves duplicates that the next run
+cleans up; nothing is lost.
+
+``history()`` yields a read-only connection with up to ``ATTACH_WINDOW``
+archives ATTACHed and TEMP views ``all_<table>`` that UNION ALL the hot
+table with its archived rows. SQLite caps the number of attached files, so
+queries over the full history go through ``history_windows()`` (successive
+windows, hot rows in the last one) or ``each_archive()`` (one archive file
+at a time).
+
+    python -m src.app.archive run --older-than-days 90
+    python -m src.app.archive list
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import ARCHIVE_AFTER_DAYS, ARCHIVE_DIR, DB_BUSY_TIMEOUT_MS, DB_PATH
+from .db import _connect
+
+# terminal transaction states; pending and processing rows stay hot
+CLOSED_STATUSES = ("completed", "failed", "cancelled")
+_CLOSED = "(" + ", ".join(f"'{s}'" for s in CLOSED_STATUSES) + ")"
+
+# (table, timestamp column, extra condition a row must meet to count as closed)
+ARCHIVE_TABLES = [
+    ("ledger_entries", "created_at",
+     f"tx_id NOT IN (SELECT id FROM main.transactions WHERE status NOT IN {_CLOSED})"),
+    ("transactions", "created_at", f"status IN {_CLOSED}"),
+    ("idempotency", "processed_at", "1"),
+    ("mcp_integrations", "created_at", "1"),
+    ("alerts", "created_at", "1"),
+]
+
+_MONTH_FILE = re.compile(r"^fintech-(\d{4}-\d{2})\.db$")
+
+# archives attached per history() connection (SQLite's default SQLITE_MAX_ATTACHED)
+ATTACH_WINDOW = 10
+
+
+def archive_path(month: str, archive_dir: Optional[str] = None) -> str:
+    return os.path.join(archive_dir or ARCHIVE_DIR, f"fintech-{month}.db")
+
+
+def list_archives(archive_dir: Optional[str] = None) -> List[str]:
+    archive_dir = archive_dir or ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(m.group(1) for m in map(_MONTH_FILE.match, os.listdir(archive_dir)) if m)
+
+
+def _ensure_archive_tables(conn: sqlite3.Connection) -> None:
+    for table, _, _ in ARCHIVE_TABLES:
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        ddl = re.sub(
+            rf"CREATE TABLE(?: IF NOT EXISTS)?\s+{table}\b",
+            f"CREATE TABLE IF NOT EXISTS arc.{table}",
+            row[0],
+            count=1,
+        )
+        conn.execute(ddl)
+
+
+def run(cutoff: str, archive_dir: Optional[str] = None, db_path: Optional[str] = None) -> Dict[str, int]:
+    """Move closed rows with a timestamp before ``cutoff`` (ISO string) to monthly files.
+
+    Returns the number of hot rows removed per table.
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    os.makedirs(archive_dir, exist_ok=True)
+    if db_path is None:
+        # balance_at for any time >= cutoff must not need the archived entries
+        from .checkpoints import write_checkpoints
+
+        write_checkpoints(cutoff)
+    moved = {table: 0 for table, _, _ in ARCHIVE_TABLES}
+    # a private connection: ATTACH/DETACH cannot run inside the pool's transactions
+    conn = _connect(db_path)
+    try:
+        # archive files hold no clients/release_requests, so FKs cannot be checked there
+        conn.execute("PRAGMA foreign_keys = OFF")
+        months = set()
+        for table, ts_col, closed in ARCHIVE_TABLES:
+            months.update(
+                r[0] for r in conn.execute(
+                    f"SELECT DISTINCT substr({ts_col}, 1, 7) FROM main.{table} WHERE {ts_col} < ? AND {closed}",
+                    (cutoff,),
+                )
+            )
+        for month in sorted(months):
+            conn.execute("ATTACH DATABASE ? AS arc", (archive_path(month, archive_dir),))
+            try:
+                conn.execute("BEGIN")
+                _ensure_archive_tables(conn)
+                for table, ts_col, closed in ARCHIVE_TABLES:
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO arc.{table} SELECT * FROM main.{table}"
+                        f" WHERE {ts_col} < ? AND substr({ts_col}, 1, 7) = ? AND {closed}",
+                        (cutoff, month),
+                    )
+                conn.execute("COMMIT")
+                # second transaction: the archive copy is durable before hot rows go away
+                conn.execute("BEGIN")
+                for table, ts_col, closed in ARCHIVE_TABLES:
+                    cur = conn.execute(
+                        f"DELETE FROM main.{table} WHERE {ts_col} < ? AND substr({ts_col}, 1, 7) = ? AND {closed}"
+                        f" AND rowid IN (SELECT m.rowid FROM main.{table} m JOIN arc.{table} a USING ({_pk(conn, table)}))",
+                        (cutoff, month),
+                    )
+                    moved[table] += cur.rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.execute("DETACH DATABASE arc")
+    finally:
+        conn.close()
+    return moved
+
+
+def _pk(conn: sqlite3.Connection, table: str) -> str:
+    cols = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})") if r[5]]
+    return ", ".join(cols)
+
+
+def _connect_ro(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None,
+                           timeout=DB_BUSY_TIMEOUT_MS / 1000.0)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def each_archive(archive_dir: Optional[str] = None,
+                 since_month: Optional[str] = None) -> Iterator[Tuple[str, sqlite3.Connection]]:
+    """(month, read-only connection) per archive file, oldest first; only one is open at a time."""
+    for month in list_archives(archive_dir):
+        if since_month is not None and month < since_month:
+            continue
+        conn = _connect_ro(archive_path(month, archive_dir))
+        try:
+            yield month, conn
+        finally:
+            conn.close()
+
+
+@contextmanager
+def history(archive_dir: Optional[str] = None, db_path: Optional[str] = None,
+            since_month: Optional[str] = None, months: Optional[List[str]] = None,
+            hot: bool = True) -> Iterator[sqlite3.Connection]:
+    """Read-only connection whose ``all_<table>`` views span hot and archived rows.
+
+    The archives are ``months`` if given, else every month from
+    ``since_month`` ('YYYY-MM') on; at most ``ATTACH_WINDOW`` of them. With
+    ``hot=False`` the views hold archived rows only.
+    """
+    if months is None:
+        months = [m for m in list_archives(archive_dir) if since_month is None or m >= since_month]
+    if len(months) > ATTACH_WINDOW:
+        raise ValueError(f"{len(months)} archive months exceed the ATTACH limit; use history_windows()")
+    conn = _connect_ro(db_path or DB_PATH)
+    try:
+        aliases = []
+        for month in months:
+            alias = f"arc_{month.replace('-', '_')}"
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (f"file:{archive_path(month, archive_dir)}?mode=ro",))
+            aliases.append(alias)
+        for table, _, _ in ARCHIVE_TABLES:
+            parts = [f"SELECT * FROM main.{table}" + ("" if hot else " WHERE 0")]
+            for alias in aliases:
+                if conn.execute(f"SELECT 1 FROM {alias}.sqlite_master WHERE name=?", (table,)).fetchone():
+                    parts.append(f"SELECT * FROM {alias}.{table}")
+            conn.execute(f"CREATE TEMP VIEW all_{table} AS " + " UNION ALL ".join(parts))
+        yield conn
+    finally:
+        conn.close()
+
+
+def history_windows(archive_dir: Optional[str] = None, db_path: Optional[str] = None,
+                    since_month: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """``history()`` connections over successive windows of archive months, oldest first.
+
+    Only the last window includes the hot rows, so per-window results add up
+    to the full history without counting anything twice.
+    """
+    months = [m for m in list_archives(archive_dir) if since_month is None or m >= since_month]
+    chunks = [months[i:i + ATTACH_WINDOW] for i in range(0, len(months), ATTACH_WINDOW)] or [[]]
+    for n, chunk in enumerate(chunks, 1):
+        with history(archive_dir, db_path, months=chunk, hot=n == len(chunks)) as h:
+            yield h
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed ledger history into monthly files")
+    sub = parser.add_subparsers(dest="cmd")
+    pr = sub.add_parser("run")
+    pr.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    pr.add_argument("--vacuum", action="store_true", help="VACUUM the hot database afterwards")
+    sub.add_parser("list")
+    args = parser.parse_args()
+    if args.cmd == "run":
+        cutoff = (datetime.utcnow() - timedelta(days=args.older_than_days)).replace(microsecond=0).isoformat() + "Z"
+        moved = run(cutoff)
+        print(f"cutoff={cutoff} moved={moved}")
+        if args.vacuum:
+            conn = _connect()
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+    elif args.cmd == "list":
+        for month in list_archives():
+            print(archive_path(month))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
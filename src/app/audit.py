@@ -1,12 +1,83 @@
+"""Tamper-evident audit log.
+
+Every record carries the SHA-256 of its canonical JSON and the hash of the
+record before it. Records are appended to the active file (``AUDIT_PATH``);
+once it reaches ``AUDIT_SEGMENT_BYTES`` or ``AUDIT_SEGMENT_SECONDS`` of age
+it is renamed to a numbered segment (``audit.log.000001``, ...) and a new
+active file continues the same chain.
+
+Each closed segment gets a sidecar ``.idx``: a JSON header line (record
+count, first/last hash and timestamp) followed by ``key<TAB>offsets`` lines
+sorted by key, where a key is an ``entity_id`` or ``kind`` and the offsets
+are byte positions of matching records. Lookups binary-search the sidecar,
+so they read a few pages per segment regardless of its size.
+
+Closed segments are then compressed (``AUDIT_COMPRESSION``) into
+``audit.log.000001.zlib`` (``.xz``, ``.bz2``): a run of independently
+decompressible blocks of whole lines, about ``AUDIT_BLOCK_BYTES`` each
+before compression. Index offsets stay uncompressed positions and the index
+header carries the block table, so a lookup decompresses only the blocks
+it needs. ``iter_lines`` reads plain and compressed files alike.
+
+Records appended inside a database transaction are first written to the
+``audit_intents`` table in that transaction, so the intent commits (or rolls
+back) with the data. Once it commits they are appended to the log and
+deleted from the table. ``recover_intents`` appends whatever a crash left
+behind after the commit, skipping records that already reached the log.
+
+    python -m src.app.audit find --entity req_... [--kind release_approved]
+    python -m src.app.audit segments
+    python -m src.app.audit rotate
+    python -m src.app.audit index [--rebuild]
+    python -m src.app.audit compress
+    python -m src.app.audit bench [--procs 8] [--records 2000]
+    python -m src.app.audit recover
+"""
+
+import argparse
+import bisect
+import bz2
+import fcntl
 import hashlib
+import io
 import json
+import lzma
+import mmap
+import multiprocessing
 import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import (
+    AUDIT_BLOCK_BYTES,
+    AUDIT_COMPRESSION,
+    AUDIT_DURABILITY,
+    AUDIT_LOG_PATH,
+    AUDIT_MERKLE_EVERY,
+    AUDIT_SEGMENT_BYTES,
+    AUDIT_SEGMENT_SECONDS,
+)
+from .db import current_transaction, db, on_commit, pool
+from .merkle import CHECKPOINT_ENTITY, CHECKPOINT_KIND, MAX_WINDOW, merkle_root
+
 
+AUDIT_PATH = AUDIT_LOG_PATH
 
-AUDIT_PATH = os.path.abspath("./audit.log")
+# codec name -> (file suffix, block compressor, streaming decompressor factory)
+CODECS = {
+    "zlib": (".zlib", zlib.compress, zlib.decompressobj),
+    "lzma": (".xz", lzma.compress, lzma.LZMADecompressor),
+    "bz2": (".bz2", bz2.compress, bz2.BZ2Decompressor),
+}
+_SUFFIXES = {suffix: name for name, (suffix, _, _) in CODECS.items()}
 
 
 @dataclass
@@ -22,40 +93,863 @@ def _line_hash(line: str) -> str:
     return hashlib.sha256(line.encode("utf-8")).hexdigest()
 
 
-def append(kind: str, entity_id: str, data: dict) -> str:
-    os.makedirs(os.path.dirname(AUDIT_PATH) or ".", exist_ok=True)
-    prev_hash = None
-    if os.path.exists(AUDIT_PATH):
-        with open(AUDIT_PATH, "rb") as f:
+def _read_tail(path: str, size: int) -> Optional[Dict]:
+    """The last complete record in the first ``size`` bytes of ``path``."""
+    window = 4096
+    with open(path, "rb") as f:
+        while True:
+            start = max(0, size - window)
+            f.seek(start)
+            lines = f.read(size - start).splitlines()
+            # the first line may be cut off by the window; widen it until a whole record is seen
+            for line in reversed(lines[1:] if start else lines):
+                try:
+                    rec = json.loads(line)
+                    rec["hash"]
+                    return rec
+                except Exception:
+                    continue
+            if start == 0:
+                return None
+            window *= 4
+
+
+def _read_head(path: str, size: int) -> Optional[str]:
+    """Hash of the last complete record in the first ``size`` bytes of ``path``."""
+    rec = _read_tail(path, size)
+    return rec["hash"] if rec else None
+
+
+def _ts_epoch(ts: str) -> float:
+    return (datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ") - datetime(1970, 1, 1)).total_seconds()
+
+
+def segment_path(number: int, path: Optional[str] = None) -> str:
+    return f"{path or AUDIT_PATH}.{number:06d}"
+
+
+def codec_of(path: str) -> Optional[str]:
+    """Codec name of a compressed segment, None for a plain file."""
+    return _SUFFIXES.get(os.path.splitext(path)[1])
+
+
+def _plain(segment: str) -> str:
+    return segment[: -len(CODECS[codec_of(segment)][0])] if codec_of(segment) else segment
+
+
+def segment_number(segment: str) -> int:
+    return int(_plain(segment).rsplit(".", 1)[1])
+
+
+def index_path(segment: str) -> str:
+    return _plain(segment) + ".idx"
+
+
+def segments(path: Optional[str] = None) -> List[str]:
+    """Closed segments of ``path`` in chain order (the active file is not included)."""
+    path = path or AUDIT_PATH
+    directory, base = os.path.split(path)
+    pattern = re.compile(re.escape(base) + r"\.(\d{6})(" + "|".join(map(re.escape, _SUFFIXES)) + r")?$")
+    if not os.path.isdir(directory or "."):
+        return []
+    found: Dict[int, str] = {}
+    for name in os.listdir(directory or "."):
+        m = pattern.match(name)
+        # while a segment is being compressed both files exist; the plain one wins until it is removed
+        if m and (int(m.group(1)) not in found or not m.group(2)):
+            found[int(m.group(1))] = os.path.join(directory, name)
+    return [found[n] for n in sorted(found)]
+
+
+def _resolve(path: str) -> str:
+    """``path``, or its compressed form if it was compressed after being listed."""
+    if os.path.exists(path) or codec_of(path):
+        return path
+    for suffix in _SUFFIXES:
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return path
+
+
+def _iter_blocks(path: str, c_off: int = 0, u_off: int = 0) -> Iterator[Tuple[int, int, bytes]]:
+    """(uncompressed offset, compressed offset, data) for each block of a compressed segment."""
+    new = CODECS[codec_of(path)][2]
+    with open(path, "rb") as f:
+        f.seek(c_off)
+        d, parts, used, buf = new(), [], 0, b""
+        while True:
+            if not buf:
+                buf = f.read(1 << 16)
+                if not buf:
+                    return
+            parts.append(d.decompress(buf))
+            if not d.eof:
+                used += len(buf)
+                buf = b""
+                continue
+            rest = d.unused_data
+            block = b"".join(parts)
+            yield u_off, c_off, block
+            u_off += len(block)
+            c_off += used + len(buf) - len(rest)
+            d, parts, used, buf = new(), [], 0, rest
+
+
+def block_table(segment: str) -> List[Tuple[int, int]]:
+    """(uncompressed offset, compressed offset) of every block; empty for a plain segment."""
+    if not codec_of(segment):
+        return []
+    return [tuple(b) for b in index_header(segment).get("blocks", [])]
+
+
+def segment_size(segment: str) -> int:
+    """Uncompressed size in bytes."""
+    segment = _resolve(segment)
+    return index_header(segment)["bytes"] if codec_of(segment) else os.path.getsize(segment)
+
+
+def iter_lines(path: str, start: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """(byte offset, raw line) for every record line of one segment or the active file.
+
+    Offsets are uncompressed positions for compressed segments too; ``start``
+    seeks to the block holding it.
+    """
+    path = _resolve(path)
+    if not os.path.exists(path):
+        return
+    if codec_of(path):
+        u_off = c_off = 0
+        if start:
+            table = block_table(path)
+            i = bisect.bisect_right([u for u, _ in table], start) - 1
+            if i >= 0:
+                u_off, c_off = table[i]
+        for u, _, block in _iter_blocks(path, c_off, u_off):
+            if u + len(block) <= start:
+                continue
+            offset = u
+            for line in io.BytesIO(block):
+                if offset >= start:
+                    yield offset, line
+                offset += len(line)
+        return
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            yield offset, line
+            offset += len(line)
+
+
+def head_at(path: str, size: int) -> Optional[str]:
+    """Hash of the last complete record within the first ``size`` (uncompressed) bytes."""
+    path = _resolve(path)
+    if not codec_of(path):
+        return _read_head(path, size)
+    starts = [u for u, _ in block_table(path)]
+    start = starts[max(0, bisect.bisect_left(starts, size) - 1)] if starts else 0
+    head = None
+    for offset, line in iter_lines(path, start):
+        if offset + len(line) > size:
+            break
+        try:
+            head = json.loads(line)["hash"]
+        except ValueError:
+            continue
+    return head
+
+
+def build_index(segment: str, blocks: Optional[List[Tuple[int, int]]] = None) -> Dict:
+    """Write the sidecar index of a closed segment; returns its header."""
+    keys: Dict[str, List[int]] = {}
+    header = {"records": 0, "bytes": 0, "first_hash": None, "last_hash": None, "first_prev": None,
+              "first_ts": None, "last_ts": None, "last_seq": None}
+    if blocks is None and codec_of(segment):
+        blocks = [(u, c) for u, c, _ in _iter_blocks(segment)]
+    if blocks is not None:
+        header["blocks"] = blocks
+    for offset, line in iter_lines(segment):
+        header["bytes"] = offset + len(line)
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if header["first_hash"] is None:
+            header.update(first_hash=rec["hash"], first_prev=rec["prev"], first_ts=rec["ts"])
+        header.update(last_hash=rec["hash"], last_ts=rec["ts"], last_seq=rec.get("seq"))
+        header["records"] += 1
+        keys.setdefault("e:" + str(rec["entity_id"]), []).append(offset)
+        keys.setdefault("k:" + str(rec["kind"]), []).append(offset)
+    rows = sorted((json.dumps(k).encode("utf-8"), v) for k, v in keys.items())
+    tmp = f"{index_path(segment)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n")
+        for key, offsets in rows:
+            f.write(key + b"\t" + ",".join(map(str, offsets)).encode("ascii") + b"\n")
+    os.replace(tmp, index_path(segment))
+    return header
+
+
+def compress_segment(segment: str, codec: str = AUDIT_COMPRESSION,
+                     block_bytes: int = AUDIT_BLOCK_BYTES) -> str:
+    """Replace a plain closed segment by its block-compressed form; returns the new path."""
+    suffix, compress, _ = CODECS[codec]
+    target = segment + suffix
+    tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    blocks: List[Tuple[int, int]] = []
+    u_off = c_off = 0
+    with open(tmp, "wb") as out:
+        pending: List[bytes] = []
+        size = 0
+        for offset, line in iter_lines(segment):
+            if not pending:
+                u_off = offset
+            pending.append(line)
+            size += len(line)
+            if size >= block_bytes:
+                data = compress(b"".join(pending))
+                out.write(data)
+                blocks.append((u_off, c_off))
+                c_off += len(data)
+                pending, size = [], 0
+        if pending:
+            data = compress(b"".join(pending))
+            out.write(data)
+            blocks.append((u_off, c_off))
+        out.flush()
+        os.fsync(out.fileno())
+    # the index (same offsets, now with the block table) goes first, then the data swaps over
+    build_index(segment, blocks)
+    os.replace(tmp, target)
+    os.remove(segment)
+    return target
+
+
+def decompress_segment(segment: str, target: str) -> None:
+    """Write the plain content of a (possibly compressed) segment to ``target``."""
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as out:
+        for _, line in iter_lines(segment):
+            out.write(line)
+    os.replace(tmp, target)
+
+
+def _seal(segment: str, compression: str = AUDIT_COMPRESSION) -> None:
+    build_index(segment)
+    if compression != "none":
+        compress_segment(segment, compression)
+
+
+def index_header(segment: str) -> Dict:
+    if not os.path.exists(index_path(segment)):
+        return build_index(segment)
+    with open(index_path(segment), "rb") as f:
+        return json.loads(f.readline())
+
+
+def _lookup(idx: str, key: str) -> List[int]:
+    """Offsets stored under ``key``, by binary search over the sorted sidecar lines."""
+    target = json.dumps(key).encode("utf-8")
+    with open(idx, "rb") as f:
+        f.readline()
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+
+        def line_at(pos: int) -> bytes:
+            # the first full line starting at or after pos
+            if pos > start:
+                f.seek(pos - 1)
+                f.readline()
+            else:
+                f.seek(start)
+            return f.readline()
+
+        lo, hi = start, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line = line_at(mid)
+            if line and line.split(b"\t", 1)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        line = line_at(lo)
+        k, _, offsets = line.rstrip(b"\n").partition(b"\t")
+        if k != target:
+            return []
+        return [int(o) for o in offsets.split(b",")]
+
+
+def _read_at(segment: str, offsets: List[int]) -> Iterator[Tuple[int, Dict]]:
+    segment = _resolve(segment)
+    if codec_of(segment):
+        table = block_table(segment)
+        starts = [u for u, _ in table]
+        new = CODECS[codec_of(segment)][2]
+        cached, block = -1, b""
+        with open(segment, "rb") as f:
+            for off in offsets:
+                i = bisect.bisect_right(starts, off) - 1
+                if i != cached:
+                    f.seek(table[i][1])
+                    length = table[i + 1][1] - table[i][1] if i + 1 < len(table) else -1
+                    block, cached = new().decompress(f.read(length)), i
+                pos = off - starts[i]
+                yield off, json.loads(block[pos:block.index(b"\n", pos) + 1])
+        return
+    with open(segment, "rb") as f:
+        for off in offsets:
+            f.seek(off)
+            yield off, json.loads(f.readline())
+
+
+def locate(entity_id: Optional[str] = None, kind: Optional[str] = None,
+           path: Optional[str] = None) -> Iterator[Tuple[str, int, Dict]]:
+    """(file, byte offset, record) for ``entity_id`` and/or ``kind``, oldest first."""
+    if entity_id is None and kind is None:
+        raise ValueError("entity_id or kind is required")
+    path = path or AUDIT_PATH
+    key = "e:" + entity_id if entity_id is not None else "k:" + kind
+    for segment in segments(path):
+        if not os.path.exists(index_path(segment)):
+            build_index(segment)
+        for offset, rec in _read_at(segment, _lookup(index_path(segment), key)):
+            if kind is None or rec["kind"] == kind:
+                yield segment, offset, rec
+    # the active file is bounded by the rotation size; scan it
+    for offset, line in iter_lines(path):
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if (entity_id is None or rec["entity_id"] == entity_id) and (kind is None or rec["kind"] == kind):
+            yield path, offset, rec
+
+
+def find(entity_id: Optional[str] = None, kind: Optional[str] = None,
+         path: Optional[str] = None) -> Iterator[Dict]:
+    """Records for ``entity_id`` and/or ``kind`` across all segments, oldest first."""
+    for _, _, rec in locate(entity_id, kind, path):
+        yield rec
+
+
+def _last_checkpoint(path: str, closed: bool) -> Optional[int]:
+    """Offset of the last Merkle checkpoint record in one file, if any."""
+    if closed:
+        index_header(path)
+        offsets = _lookup(index_path(path), "k:" + CHECKPOINT_KIND)
+        return offsets[-1] if offsets else None
+    if not os.path.getsize(path):
+        return None
+    marker = json.dumps({"kind": CHECKPOINT_KIND}, separators=(",", ":"))[1:-1].encode("utf-8")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = len(mm)
+        while True:
+            pos = mm.rfind(marker, 0, end)
+            if pos < 0:
+                return None
+            start = mm.rfind(b"\n", 0, pos) + 1
             try:
-                f.seek(-4096, os.SEEK_END)
-            except OSError:
-                f.seek(0)
-            tail = f.read().decode("utf-8", errors="ignore").splitlines()
-            if tail:
-                last = tail[-1]
+                # the marker could also sit inside some record's data
+                if json.loads(mm[start:mm.find(b"\n", pos)])["kind"] == CHECKPOINT_KIND:
+                    return start
+            except (ValueError, KeyError):
+                pass
+            end = pos
+
+
+class _Pending:
+    __slots__ = ("event", "hash", "error")
+
+    def __init__(self, event: AuditEvent) -> None:
+        self.event = event
+        self.hash: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class AuditWriter:
+    """Appends records to the hash chain with group commit.
+
+    The chain head and an append handle are kept open. Concurrent callers
+    queue their records; whichever caller finds no commit in progress
+    becomes the leader, chains everything queued so far, writes it with one
+    ``write`` and (in ``fsync`` mode) one ``fsync``, then wakes the others.
+
+    Several processes may append to the same log: each group is chained and
+    written under an exclusive ``flock`` on ``<path>.lock``. If another
+    process appended since, only the new tail is read to catch up with its
+    head; if the file was replaced (rotated, restored, truncated) the state
+    is reloaded. Every record gets ``seq``, its position in the whole log,
+    so the order is global across processes.
+
+    Every ``merkle_every`` records a ``merkle_checkpoint`` record with the
+    Merkle root of those records is chained in after them (see merkle.py).
+    """
+
+    def __init__(self, path: str, durability: str = AUDIT_DURABILITY,
+                 segment_bytes: int = AUDIT_SEGMENT_BYTES, segment_seconds: int = AUDIT_SEGMENT_SECONDS,
+                 merkle_every: int = AUDIT_MERKLE_EVERY, compression: str = AUDIT_COMPRESSION) -> None:
+        if durability not in ("fsync", "flush"):
+            raise ValueError("durability must be 'fsync' or 'flush'")
+        if compression != "none" and compression not in CODECS:
+            raise ValueError(f"compression must be 'none' or one of {', '.join(sorted(CODECS))}")
+        if not 0 <= merkle_every <= MAX_WINDOW:
+            raise ValueError(f"merkle_every must be between 0 and {MAX_WINDOW}")
+        self.path = path
+        self.durability = durability
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.merkle_every = merkle_every
+        self.compression = compression
+        self._cond = threading.Condition()
+        self._queue: List[_Pending] = []
+        self._leader = False
+        self._io = threading.Lock()
+        self._fh = None
+        self._lock_fh = None
+        self._ino: Optional[int] = None
+        self._size = 0
+        self._head: Optional[str] = None
+        self._seq = -1
+        self._started: Optional[float] = None
+        self._window: List[str] = []
+        self._checkpoint: Optional[str] = None
+        self.metrics = {"records": 0, "groups": 0, "fsyncs": 0, "max_group": 0, "head_reloads": 0,
+                        "catch_ups": 0, "lock_wait_ms": 0.0, "rotations": 0, "checkpoints": 0}
+
+    def append(self, event: AuditEvent) -> str:
+        item = _Pending(event)
+        with self._cond:
+            self._queue.append(item)
+            while item.hash is None and item.error is None:
+                if self._leader:
+                    self._cond.wait()
+                    continue
+                self._leader = True
+                group, self._queue = self._queue, []
+                self._cond.release()
+                try:
+                    self._commit(group)
+                except BaseException as e:
+                    for it in group:
+                        if it.hash is None:
+                            it.error = e
+                finally:
+                    self._cond.acquire()
+                    self._leader = False
+                    self._cond.notify_all()
+        if item.error is not None:
+            raise item.error
+        return item.hash
+
+    def _open(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fh = open(self.path, "ab")
+        st = os.fstat(self._fh.fileno())
+        self._ino, self._size = st.st_ino, st.st_size
+        self._started = None
+        closed = segments(self.path)
+        if self._size:
+            tail = _read_tail(self.path, self._size)
+            self._head, seq = (tail["hash"], tail.get("seq")) if tail else (None, None)
+            with open(self.path, "rb") as f:
                 try:
-                    prev_hash = json.loads(last)["hash"]
+                    self._started = _ts_epoch(json.loads(f.readline())["ts"])
                 except Exception:
-                    prev_hash = None
-    evt = AuditEvent(
-        ts=datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
-        kind=kind,
-        entity_id=entity_id,
-        data=data,
-        prev_hash=prev_hash,
-    )
-    payload = {
-        "ts": evt.ts,
-        "kind": evt.kind,
-        "entity_id": evt.entity_id,
-        "data": evt.data,
-        "prev": evt.prev_hash,
+                    self._started = time.time()
+        else:
+            # a fresh active file continues the chain of the last closed segment
+            header = index_header(closed[-1]) if closed else {}
+            self._head, seq = header.get("last_hash"), header.get("last_seq")
+        if seq is None and self._head is not None:
+            # the log predates sequence numbers: continue from the record count
+            seq = sum(index_header(c)["records"] for c in closed) - 1
+            seq += sum(1 for _, line in iter_lines(self.path) if line.endswith(b"\n"))
+        self._seq = -1 if seq is None else seq
+        if self.merkle_every:
+            self._load_window()
+        self.metrics["head_reloads"] += 1
+
+    def _load_window(self) -> None:
+        """Record hashes since the last checkpoint, walking back from the active file."""
+        window: List[str] = []
+        overflow = False
+        self._checkpoint = None
+        files = segments(self.path) + [self.path]
+        for number, f in reversed(list(enumerate(files))):
+            offset = _last_checkpoint(f, number < len(files) - 1)
+            if not overflow:
+                hashes = []
+                for off, line in iter_lines(f, offset or 0):
+                    if off != offset and line.endswith(b"\n"):
+                        hashes.append(json.loads(line)["hash"])
+                window = hashes + window
+                # more than a window without a checkpoint: those records predate checkpoints
+                overflow = len(window) > MAX_WINDOW
+            if offset is not None:
+                self._checkpoint = next(_read_at(f, [offset]))[1]["hash"]
+                break
+        self._window = [] if overflow else window
+
+    def _catch_up(self, size: int) -> bool:
+        """Fold in records another process appended; False if the tail is not whole records."""
+        with open(self.path, "rb") as f:
+            f.seek(self._size)
+            data = f.read(size - self._size)
+        if not data.endswith(b"\n"):
+            return False
+        window = self._window
+        for line in io.BytesIO(data):
+            rec = json.loads(line)
+            self._head, self._seq = rec["hash"], rec.get("seq", self._seq + 1)
+            if rec["kind"] == CHECKPOINT_KIND:
+                self._checkpoint, window = rec["hash"], []
+            elif self.merkle_every:
+                window.append(rec["hash"])
+        self._window = window
+        self._size = size
+        self.metrics["catch_ups"] += 1
+        return True
+
+    def _sync(self) -> None:
+        """Bring head, sequence and Merkle window up to date with the file (lock held)."""
+        if self._fh is not None:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                st = None
+            if st is not None and st.st_ino == self._ino:
+                if st.st_size == self._size:
+                    return
+                if st.st_size > self._size and self._catch_up(st.st_size):
+                    return
+        self._open()
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the writer across threads and processes, e.g. while the log files are moved."""
+        with self._io:
+            if self._lock_fh is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._lock_fh = open(self.path + ".lock", "ab")
+            started = time.perf_counter()
+            fcntl.flock(self._lock_fh.fileno(), fcntl.LOCK_EX)
+            self.metrics["lock_wait_ms"] += (time.perf_counter() - started) * 1000
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fh.fileno(), fcntl.LOCK_UN)
+
+    def _due(self) -> bool:
+        if not self._size:
+            return False
+        if self.segment_bytes and self._size >= self.segment_bytes:
+            return True
+        return bool(self.segment_seconds and self._started and time.time() - self._started >= self.segment_seconds)
+
+    def _rotate(self) -> str:
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        closed = segments(self.path)
+        number = segment_number(closed[-1]) + 1 if closed else 1
+        target = segment_path(number, self.path)
+        os.rename(self.path, target)
+        self._fh = open(self.path, "ab")
+        st = os.fstat(self._fh.fileno())
+        self._ino, self._size, self._started = st.st_ino, 0, None
+        self.metrics["rotations"] += 1
+        # the segment is immutable now; readers build a missing index on demand
+        threading.Thread(target=_seal, args=(target, self.compression), name="audit-seal", daemon=True).start()
+        return target
+
+    def _chain(self, group: List[_Pending]) -> Tuple[bytes, Optional[str], int, List[str], Optional[str]]:
+        out = []
+        head, seq = self._head, self._seq
+        window, checkpoint = list(self._window), self._checkpoint
+        for it in group:
+            e = it.event
+            e.prev_hash = head
+            payload = {"ts": e.ts, "kind": e.kind, "entity_id": e.entity_id, "data": e.data, "prev": e.prev_hash,
+                       "seq": seq + 1}
+            try:
+                line = json.dumps(payload, sort_keys=True)
+            except (TypeError, ValueError) as err:
+                # an unserialisable record fails alone and does not enter the chain
+                it.error = err
+                continue
+            h = _line_hash(line)
+            out.append(json.dumps({"hash": h, **payload}, separators=(",", ":")).encode("utf-8") + b"\n")
+            it.hash = head = h
+            seq += 1
+            if not self.merkle_every:
+                continue
+            window.append(h)
+            if len(window) >= self.merkle_every:
+                payload = {"ts": e.ts, "kind": CHECKPOINT_KIND, "entity_id": CHECKPOINT_ENTITY,
+                           "data": {"root": merkle_root(window), "size": len(window),
+                                    "prev_checkpoint": checkpoint},
+                           "prev": head, "seq": seq + 1}
+                h = _line_hash(json.dumps(payload, sort_keys=True))
+                out.append(json.dumps({"hash": h, **payload}, separators=(",", ":")).encode("utf-8") + b"\n")
+                head = checkpoint = h
+                seq += 1
+                window = []
+        return b"".join(out), head, seq, window, checkpoint
+
+    def _commit(self, group: List[_Pending]) -> None:
+        with self.locked():
+            self._sync()
+            if self._due():
+                self._rotate()
+            data, head, seq, window, checkpoint = self._chain(group)
+            if not data:
+                return
+            try:
+                self._fh.write(data)
+                self._fh.flush()
+                if self.durability == "fsync":
+                    os.fsync(self._fh.fileno())
+                    self.metrics["fsyncs"] += 1
+            except BaseException:
+                for it in group:
+                    it.hash = None
+                # the file may hold part of the group; re-read the head before the next one
+                self._fh.close()
+                self._fh = None
+                raise
+            if not self._size:
+                self._started = time.time()
+            self._size += len(data)
+            self._head, self._seq = head, seq
+            if checkpoint != self._checkpoint:
+                self.metrics["checkpoints"] += 1
+            self._window, self._checkpoint = window, checkpoint
+            written = sum(1 for it in group if it.hash is not None)
+            self.metrics["records"] += written
+            self.metrics["groups"] += 1
+            self.metrics["max_group"] = max(self.metrics["max_group"], written)
+
+    def rotate(self) -> Optional[str]:
+        """Close the active file as a segment now; None if it is empty."""
+        with self.locked():
+            if not os.path.exists(self.path):
+                return None
+            self._sync()
+            return self._rotate() if self._size else None
+
+    def position(self, at: Optional[Callable[[], None]] = None) -> Tuple[int, int, Optional[str]]:
+        """(closed segments, active file size, head hash) between group commits.
+
+        ``at`` runs while the writer is held, so whatever it captures (e.g. a
+        database snapshot) lines up with the returned position.
+        """
+        with self.locked():
+            if at is not None:
+                at()
+            if not os.path.exists(self.path):
+                return len(segments(self.path)), 0, None
+            self._sync()
+            return len(segments(self.path)), self._size, self._head
+
+    def reset(self) -> None:
+        """Drop the cached handle and head, e.g. after the file was restored."""
+        with self._io:
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = None
+
+    def stats(self) -> Dict[str, float]:
+        out: Dict[str, float] = dict(self.metrics)
+        out["avg_group"] = out["records"] / out["groups"] if out["groups"] else 0.0
+        return out
+
+
+_writer: Optional[AuditWriter] = None
+_writer_lock = threading.Lock()
+
+
+def writer() -> AuditWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.path != AUDIT_PATH:
+            _writer = AuditWriter(AUDIT_PATH)
+        return _writer
+
+
+def append(kind: str, entity_id: str, data: dict) -> Optional[str]:
+    """Append an event to the hash chain.
+
+    Inside an open ``db()``/``unit_of_work()`` transaction the record is
+    queued and written once the transaction commits (and dropped if it rolls
+    back); the hash is only returned for immediate writes.
+    """
+    ts = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    txn = current_transaction()
+    if txn is None:
+        return _write(ts, kind, entity_id, data)
+    try:
+        pool.acquire().execute(
+            "INSERT INTO audit_intents(txn, ts, kind, entity_id, data) VALUES(?,?,?,?,?)",
+            (txn, ts, kind, entity_id, json.dumps(data)),
+        )
+    except sqlite3.OperationalError:
+        # audit_intents not migrated yet: keep the record in memory until the commit
+        on_commit(lambda: _write(ts, kind, entity_id, data))
+        return None
+    # one hook per record: a savepoint rollback may drop some of them, the first that runs flushes all
+    on_commit(lambda: _flush_intents(txn))
+    return None
+
+
+_flushed = threading.local()
+
+
+def _flush_intents(txn: str) -> None:
+    """Append the committed intents of transaction ``txn`` to the log, then delete them."""
+    if getattr(_flushed, "txn", None) == txn:
+        return
+    _flushed.txn = txn
+    rows = pool.acquire().execute(
+        "SELECT ts, kind, entity_id, data FROM audit_intents WHERE txn=? ORDER BY seq", (txn,)
+    ).fetchall()
+    for r in rows:
+        _write(r["ts"], r["kind"], r["entity_id"], json.loads(r["data"]))
+    with db() as conn:
+        conn.execute("DELETE FROM audit_intents WHERE txn=?", (txn,))
+
+
+def recover_intents(grace_s: int = 60) -> int:
+    """Append intents left behind by a crash after COMMIT; returns how many were appended.
+
+    Only intents older than ``grace_s`` are taken, so a live process can still
+    flush its own. One that reached the log before the crash (same ts, kind,
+    entity and data) is not written again.
+    """
+    cutoff = (datetime.utcfromtimestamp(time.time() - grace_s)).replace(microsecond=0).isoformat() + "Z"
+    try:
+        with db(readonly=True) as conn:
+            rows = conn.execute(
+                "SELECT seq, ts, kind, entity_id, data FROM audit_intents WHERE ts <= ? ORDER BY seq", (cutoff,)
+            ).fetchall()
+    except sqlite3.OperationalError:
+        return 0
+    appended = 0
+    for r in rows:
+        data = json.loads(r["data"])
+        done = any(rec["ts"] == r["ts"] and rec["data"] == data
+                   for rec in find(r["entity_id"], r["kind"]))
+        if not done:
+            _write(r["ts"], r["kind"], r["entity_id"], data)
+            appended += 1
+        with db() as conn:
+            conn.execute("DELETE FROM audit_intents WHERE seq=?", (r["seq"],))
+    return appended
+
+
+def _write(ts: str, kind: str, entity_id: str, data: dict) -> str:
+    evt = AuditEvent(ts=ts, kind=kind, entity_id=entity_id, data=data, prev_hash=None)
+    return writer().append(evt)
+
+
+def _bench_producer(path: str, records: int, threads: int, durability: str) -> Dict[str, float]:
+    w = AuditWriter(path, durability=durability)
+
+    def run(t: int) -> None:
+        for i in range(records // threads):
+            ts = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+            w.append(AuditEvent(ts=ts, kind="bench", entity_id=f"p{os.getpid()}t{t}", data={"i": i}, prev_hash=None))
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return w.stats()
+
+
+def bench(procs: int = 8, records: int = 2000, threads: int = 4, durability: str = AUDIT_DURABILITY,
+          directory: Optional[str] = None) -> Dict:
+    """Append from ``procs`` processes into one scratch log, then verify the chain."""
+    from .audit_verify import verify
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, "audit.log")
+        with multiprocessing.Pool(procs) as pool:
+            started = time.perf_counter()
+            stats = pool.starmap(_bench_producer, [(path, records, threads, durability)] * procs)
+            seconds = time.perf_counter() - started
+        report = verify(path, workers=1)
+    written = sum(s["records"] for s in stats)
+    groups = sum(s["groups"] for s in stats)
+    return {
+        "procs": procs,
+        "threads_per_proc": threads,
+        "durability": durability,
+        "records": written,
+        "seconds": round(seconds, 3),
+        "records_per_sec": round(written / seconds),
+        "avg_group": round(written / groups, 2) if groups else 0.0,
+        "catch_ups": sum(s["catch_ups"] for s in stats),
+        "lock_wait_ms": round(sum(s["lock_wait_ms"] for s in stats), 1),
+        "chain_ok": report["ok"],
+        "chain_records": report["records"],
     }
-    line = json.dumps(payload, sort_keys=True)
-    h = _line_hash(line)
-    rec = json.dumps({"hash": h, **payload}, separators=(",", ":"))
-    with open(AUDIT_PATH, "a", encoding="utf-8") as f:
-        f.write(rec + "\n")
-    return h
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit log tools")
+    sub = parser.add_subparsers(dest="cmd")
+    pf = sub.add_parser("find")
+    pf.add_argument("--entity", default=None)
+    pf.add_argument("--kind", default=None)
+    sub.add_parser("segments")
+    sub.add_parser("rotate")
+    pi = sub.add_parser("index", help="build missing segment indexes")
+    pi.add_argument("--rebuild", action="store_true")
+    pc = sub.add_parser("compress", help="compress closed plain segments")
+    pc.add_argument("--codec", choices=sorted(CODECS), default=None)
+    pb = sub.add_parser("bench", help="append from several processes into a scratch log")
+    pb.add_argument("--procs", type=int, default=8)
+    pb.add_argument("--records", type=int, default=2000, help="records per process")
+    pb.add_argument("--threads", type=int, default=4, help="appending threads per process")
+    pb.add_argument("--durability", choices=("fsync", "flush"), default=AUDIT_DURABILITY)
+    pb.add_argument("--dir", default=None, help="scratch directory (default: system temp)")
+    sub.add_parser("recover", help="append audit intents a crash left in the database")
+    args = parser.parse_args()
+    if args.cmd == "find":
+        if args.entity is None and args.kind is None:
+            parser.error("--entity or --kind is required")
+        for rec in find(args.entity, args.kind):
+            print(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+    elif args.cmd == "segments":
+        for segment in segments():
+            h = index_header(segment)
+            print(f"{segment}  records={h['records']}  {h['first_ts']} .. {h['last_ts']}  "
+                  f"{os.path.getsize(segment)} bytes on disk, {segment_size(segment)} plain")
+        _, size, head = writer().position()
+        print(f"{AUDIT_PATH}  (active)  {size} bytes  head={head}")
+    elif args.cmd == "rotate":
+        print(writer().rotate() or "active file is empty")
+    elif args.cmd == "index":
+        for segment in segments():
+            if args.rebuild or not os.path.exists(index_path(segment)):
+                print(f"{segment}: {build_index(segment)['records']} records")
+    elif args.cmd == "compress":
+        codec = args.codec or (AUDIT_COMPRESSION if AUDIT_COMPRESSION != "none" else "zlib")
+        for segment in segments():
+            if not codec_of(segment):
+                before = os.path.getsize(segment)
+                target = compress_segment(segment, codec)
+                print(f"{target}: {before} -> {os.path.getsize(target)} bytes")
+    elif args.cmd == "bench":
+        print(json.dumps(bench(args.procs, args.records, args.threads, args.durability, args.dir), indent=2))
+    elif args.cmd == "recover":
+        print(f"recovered {recover_intents()} records")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Parallel verification of the audit hash chain.
+
+Every segment (and the active file) is cut into chunks at line boundaries:
+plain files are memory-mapped, compressed segments are cut at their block
+boundaries and streamed through ``audit.iter_lines``. Worker processes recompute each record's hash and check
+the ``prev`` links inside their chunk; the parent then stitches the chunks
+together, checking that each chunk's first ``prev`` is the previous chunk's
+last hash and that sequence numbers run on without gaps. The report names the first break in chain order and the
+throughput in MB/s.
+
+    python -m src.app.audit_verify [--workers 4] [--chunk-mb 16]
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import audit
+
+CHUNK_BYTES = 16 * 1024 * 1024
+
+Task = Tuple[str, int, int]
+
+
+def _chunks(path: str, chunk_bytes: int) -> List[Task]:
+    size = audit.segment_size(path)
+    if not size:
+        return []
+    tasks = []
+    if audit.codec_of(path):
+        start = 0
+        for u, _ in audit.block_table(path)[1:]:
+            if u - start >= chunk_bytes:
+                tasks.append((path, start, u))
+                start = u
+        tasks.append((path, start, size))
+        return tasks
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            cut = mm.find(b"\n", min(start + chunk_bytes, size) - 1)
+            end = size if cut < 0 else cut + 1
+            tasks.append((path, start, end))
+            start = end
+    return tasks
+
+
+def _lines(path: str, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    try:
+        f = None if audit.codec_of(path) else open(path, "rb")
+    except FileNotFoundError:
+        # compressed since it was listed; the uncompressed offsets are the same
+        f = None
+    if f is None:
+        for pos, line in audit.iter_lines(path, start):
+            if pos >= end:
+                return
+            yield pos, line
+        return
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            nl = mm.find(b"\n", pos, end)
+            yield pos, mm[pos:end if nl < 0 else nl + 1]
+            if nl < 0:
+                return
+            pos = nl + 1
+
+
+def verify_chunk(task: Task) -> Dict:
+    """Hashes and internal links of one chunk; stops at the first break in it."""
+    path, start, end = task
+    out: Dict = {"path": path, "start": start, "bytes": end - start, "records": 0,
+                 "first_prev": None, "last_hash": None, "first_seq": None, "last_seq": None, "error": None}
+    prev: Optional[str] = None
+    for pos, line in _lines(path, start, end):
+        if not line.endswith(b"\n"):
+            # a record still being written at the end of the active file
+            out["bytes"] = pos - start
+            break
+        try:
+            rec = json.loads(line)
+            claimed = rec.pop("hash")
+        except (ValueError, KeyError):
+            out["error"] = {"path": path, "offset": pos, "reason": "unparseable record"}
+            return out
+        if hashlib.sha256(json.dumps(rec, sort_keys=True).encode("utf-8")).hexdigest() != claimed:
+            out["error"] = {"path": path, "offset": pos, "reason": "hash mismatch", "hash": claimed}
+            return out
+        if out["records"] == 0:
+            out["first_prev"], out["first_seq"] = rec.get("prev"), rec.get("seq")
+        elif rec.get("prev") != prev:
+            out["error"] = {"path": path, "offset": pos, "reason": "prev link broken", "hash": claimed}
+            return out
+        elif None not in (rec.get("seq"), out["last_seq"]) and rec["seq"] != out["last_seq"] + 1:
+            out["error"] = {"path": path, "offset": pos, "reason": "sequence gap", "hash": claimed}
+            return out
+        prev = claimed
+        out["records"] += 1
+        out["last_hash"], out["last_seq"] = claimed, rec.get("seq")
+    return out
+
+
+def verify(path: Optional[str] = None, workers: Optional[int] = None, chunk_bytes: int = CHUNK_BYTES) -> Dict:
+    """Verify every segment and the active file of ``path``; returns a report."""
+    path = path or audit.AUDIT_PATH
+    started = time.perf_counter()
+    files = audit.segments(path) + ([path] if os.path.exists(path) else [])
+    tasks = [t for p in files for t in _chunks(p, chunk_bytes)]
+    report: Dict = {"files": len(files), "chunks": len(tasks), "records": 0, "bytes": 0,
+                    "ok": True, "first_break": None, "head": None}
+    prev: Optional[str] = None
+    seq: Optional[int] = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() yields in chain order, so stitching can run while later chunks are hashed
+        for result in pool.map(verify_chunk, tasks):
+            if result["records"] and result["first_prev"] != prev:
+                report["first_break"] = {"path": result["path"], "offset": result["start"],
+                                         "reason": "prev link broken between chunks"}
+            elif result["records"] and None not in (seq, result["first_seq"]) and result["first_seq"] != seq + 1:
+                report["first_break"] = {"path": result["path"], "offset": result["start"],
+                                         "reason": "sequence gap between chunks"}
+            elif result["error"]:
+                report["first_break"] = result["error"]
+            report["records"] += result["records"]
+            report["bytes"] += result["bytes"]
+            if report["first_break"]:
+                report["ok"] = False
+                pool.shutdown(cancel_futures=True)
+                break
+            if result["records"]:
+                prev, seq = result["last_hash"], result["last_seq"]
+    report["head"] = prev
+    seconds = time.perf_counter() - started
+    report["seconds"] = round(seconds, 3)
+    report["mb_per_s"] = round(report["bytes"] / 1e6 / seconds, 1) if seconds else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify the audit hash chain in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / 1024 / 1024)
+    args = parser.parse_args()
+    report = verify(workers=args.workers, chunk_bytes=int(args.chunk_mb * 1024 * 1024))
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
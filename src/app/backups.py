@@ -0,0 +1,310 @@
+"""Online SQLite backups and point-in-time restore.
+
+Backups copy the live database with ``sqlite3.Connection.backup`` a few
+pages at a time, sleeping between steps so writers are never blocked for
+long. The copy is read from one WAL snapshot, pinned by a read transaction
+on the source connection, so concurrent writes do not restart it; a copy
+that restarts more than ``BACKUP_MAX_RESTARTS`` times anyway is abandoned.
+
+Each backup gets a JSON manifest with the file's SHA-256 and the
+``audit.log`` position (byte size and head hash) at the snapshot point:
+the snapshot is taken while the audit writer is held, so every audit
+record of a transaction in the backup is either in the log before that
+position or still in the backup's ``audit_intents``, which ``restore``
+appends after cutting the log.
+
+    python -m src.app.backups backup
+    python -m src.app.backups list
+    python -m src.app.backups verify  [--backup PATH]
+    python -m src.app.backups restore --backup PATH
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from . import audit
+from .config import (
+    BACKUP_DIR,
+    BACKUP_KEEP,
+    BACKUP_MAX_RESTARTS,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_S,
+    DB_PATH,
+)
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _manifest_path(backup_path: str) -> str:
+    return backup_path + ".json"
+
+
+def _restart_guard(max_restarts: int):
+    """Backup progress callback that aborts the copy after ``max_restarts`` restarts."""
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise RuntimeError(f"backup restarted {state['restarts']} times; giving up")
+        state["remaining"] = remaining
+
+    return progress
+
+
+def backup(dest_dir: Optional[str] = None, db_path: Optional[str] = None,
+           pages: int = BACKUP_PAGES_PER_STEP, sleep: float = BACKUP_STEP_SLEEP_S,
+           keep: int = BACKUP_KEEP, max_restarts: int = BACKUP_MAX_RESTARTS) -> str:
+    dest_dir = dest_dir or BACKUP_DIR
+    db_path = db_path or DB_PATH
+    os.makedirs(dest_dir, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+    final = os.path.join(dest_dir, f"fintech-{stamp}.db")
+    tmp = final + ".partial"
+    started = time.time()
+    src = sqlite3.connect(db_path, isolation_level=None)
+    dst = sqlite3.connect(tmp)
+
+    def snapshot():
+        # the first read fixes the WAL snapshot the whole copy is taken from
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+    done = False
+    try:
+        audit_segments, audit_size, audit_head = audit.writer().position(at=snapshot)
+        src.backup(dst, pages=pages, sleep=sleep, progress=_restart_guard(max_restarts))
+        src.execute("COMMIT")
+        dst.execute("PRAGMA journal_mode = DELETE")
+        done = True
+    finally:
+        dst.close()
+        src.close()
+        if not done and os.path.exists(tmp):
+            os.remove(tmp)
+    os.replace(tmp, final)
+    manifest = {
+        "file": os.path.basename(final),
+        "sha256": _sha256_file(final),
+        "bytes": os.path.getsize(final),
+        "source": db_path,
+        "created_at": stamp,
+        "seconds": round(time.time() - started, 3),
+        "audit_path": audit.AUDIT_PATH,
+        "audit_segments": audit_segments,
+        "audit_size": audit_size,
+        "audit_head": audit_head,
+    }
+    with open(_manifest_path(final), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    rotate(dest_dir, keep)
+    return final
+
+
+def list_backups(dest_dir: Optional[str] = None) -> List[Dict]:
+    dest_dir = dest_dir or BACKUP_DIR
+    if not os.path.isdir(dest_dir):
+        return []
+    out = []
+    for name in sorted(os.listdir(dest_dir)):
+        if name.startswith("fintech-") and name.endswith(".db.json"):
+            with open(os.path.join(dest_dir, name), encoding="utf-8") as f:
+                m = json.load(f)
+            m["path"] = os.path.join(dest_dir, m["file"])
+            out.append(m)
+    return out
+
+
+def rotate(dest_dir: Optional[str] = None, keep: int = BACKUP_KEEP) -> List[str]:
+    removed = []
+    for m in list_backups(dest_dir)[:-keep] if keep > 0 else []:
+        for p in (m["path"], _manifest_path(m["path"])):
+            if os.path.exists(p):
+                os.remove(p)
+        removed.append(m["path"])
+    return removed
+
+
+def _audit_file_at_backup(m: Dict, audit_path: str) -> str:
+    """The file holding what was the active audit file when the backup was taken."""
+    closed = audit.segments(audit_path)
+    then = m.get("audit_segments", 0)
+    # if the log rotated since, that file is now the next closed segment
+    return closed[then] if len(closed) > then else audit_path
+
+
+def _load_manifest(backup_path: str) -> Dict:
+    with open(_manifest_path(backup_path), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def verify(backup_path: str) -> Dict:
+    """Check the checksum, SQLite integrity and recorded audit head of a backup."""
+    m = _load_manifest(backup_path)
+    if _sha256_file(backup_path) != m["sha256"]:
+        raise ValueError(f"checksum mismatch for {backup_path}")
+    conn = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise ValueError(f"integrity_check failed: {result}")
+    audit_path = m.get("audit_path")
+    if audit_path and os.path.exists(audit_path):
+        _check_audit(m, audit_path)
+    return m
+
+
+def _check_audit(m: Dict, audit_path: str) -> None:
+    """Raise unless ``audit_path`` still holds the chain up to the backup's recorded head."""
+    if not m.get("audit_head"):
+        return
+    at_backup = _audit_file_at_backup(m, audit_path)
+    if not os.path.exists(at_backup) or audit.segment_size(at_backup) < m["audit_size"]:
+        raise ValueError("audit log is shorter than at backup time")
+    if audit.head_at(at_backup, m["audit_size"]) != m["audit_head"]:
+        raise ValueError("audit log no longer matches the backup's chain head")
+
+
+def restore(backup_path: str, db_path: Optional[str] = None, audit_path: Optional[str] = None) -> Dict:
+    """Restore a backup over ``db_path`` and cut the audit log back to match it.
+
+    Audit records written after the backup are moved to
+    ``<audit>.after-<backup stamp>`` rather than discarded; segments closed
+    since then go to ``<audit>.after-<backup stamp>.segments/``.
+    """
+    m = verify(backup_path)
+    db_path = db_path or DB_PATH
+    audit_path = audit_path or m.get("audit_path") or audit.AUDIT_PATH
+    with audit.writer().locked():
+        # every check runs before the database or the log is touched
+        _check_audit(m, audit_path)
+        src = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+        dst = sqlite3.connect(db_path)
+        try:
+            # backup API into the live path keeps WAL/readers consistent, unlike a file copy
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        _cut_audit(m, audit_path)
+    audit.writer().reset()
+    if db_path == DB_PATH and audit_path == audit.AUDIT_PATH:
+        # records of transactions in the snapshot that had not reached the log yet
+        m["audit_recovered"] = audit.recover_intents(grace_s=0)
+    return m
+
+
+def _cut_audit(m: Dict, audit_path: str) -> None:
+    """Move audit records written after the backup aside; the caller holds the writer lock."""
+    closed = audit.segments(audit_path)
+    then = m.get("audit_segments", 0)
+    if len(closed) > then:
+        moved = f"{audit_path}.after-{m['created_at']}.segments"
+        os.makedirs(moved, exist_ok=True)
+        for p in closed[then + 1:] + [audit_path]:
+            for f in (p, audit.index_path(p)):
+                if os.path.exists(f):
+                    os.replace(f, os.path.join(moved, os.path.basename(f)))
+        if os.path.exists(audit.index_path(closed[then])):
+            os.remove(audit.index_path(closed[then]))
+        # the file that was active at backup time becomes the active file again
+        if audit.codec_of(closed[then]):
+            audit.decompress_segment(closed[then], audit_path)
+            os.remove(closed[then])
+        else:
+            os.replace(closed[then], audit_path)
+    if os.path.exists(audit_path) and os.path.getsize(audit_path) > m["audit_size"]:
+        with open(audit_path, "rb") as f:
+            f.seek(m["audit_size"])
+            with open(f"{audit_path}.after-{m['created_at']}", "wb") as out:
+                shutil.copyfileobj(f, out)
+        with open(audit_path, "r+b") as f:
+            f.truncate(m["audit_size"])
+
+
+def restore_drill(backup_path: str) -> Dict:
+    """Restore into a scratch file and check the tables open; the live DB is untouched."""
+    m = verify(backup_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, "restore.db")
+        src = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+        dst = sqlite3.connect(target)
+        try:
+            src.backup(dst)
+            counts = {
+                name: dst.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                for (name,) in dst.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            }
+        finally:
+            dst.close()
+            src.close()
+    m["tables"] = counts
+    return m
+
+
+def start_background(interval_s: float, dest_dir: Optional[str] = None) -> threading.Thread:
+    """Take a backup every ``interval_s`` seconds on a daemon thread."""
+
+    def loop():
+        while True:
+            time.sleep(interval_s)
+            try:
+                backup(dest_dir)
+            except Exception as e:
+                audit.append("backup_error", "system", {"error": str(e)})
+
+    t = threading.Thread(target=loop, name="sqlite-backup", daemon=True)
+    t.start()
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online SQLite backups")
+    sub = parser.add_subparsers(dest="cmd")
+    pb = sub.add_parser("backup")
+    pb.add_argument("--dir", default=None)
+    sub.add_parser("list")
+    pv = sub.add_parser("verify", help="checksum + integrity + scratch restore (latest by default)")
+    pv.add_argument("--backup", default=None)
+    pr = sub.add_parser("restore")
+    pr.add_argument("--backup", required=True)
+    args = parser.parse_args()
+    if args.cmd == "backup":
+        print(backup(args.dir))
+    elif args.cmd == "list":
+        for m in list_backups():
+            print(f"{m['path']}  {m['bytes']} bytes  sha256={m['sha256'][:16]}  audit_size={m['audit_size']}")
+    elif args.cmd == "verify":
+        path = args.backup
+        if path is None:
+            backups = list_backups()
+            if not backups:
+                raise SystemExit("no backups found")
+            path = backups[-1]["path"]
+        print(json.dumps(restore_drill(path), indent=2))
+    elif args.cmd == "restore":
+        print(json.dumps(restore(args.backup), indent=2))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
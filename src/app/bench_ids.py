@@ -0,0 +1,124 @@
+"""Insert benchmark: random uuid4 keys vs time-ordered ``ids.new_id`` keys.
+
+Builds ``transactions`` and ``ledger_entries`` in a scratch SQLite file with
+each key scheme and reports insert throughput (overall and over the final
+10% of rows, where B-tree depth matters most) plus primary-key index size.
+
+    python -m src.app.bench_ids --rows 10000000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict
+
+from .ids import new_id
+
+_SCHEMA = [
+    """
+    CREATE TABLE transactions (
+        id TEXT PRIMARY KEY,
+        client_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        metadata TEXT
+    )
+    """,
+    """
+    CREATE TABLE ledger_entries (
+        id TEXT PRIMARY KEY,
+        tx_id TEXT NOT NULL,
+        client_id TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """,
+]
+
+SCHEMES: Dict[str, Callable[[str], str]] = {
+    "uuid4": lambda kind: f"{kind}_{uuid.uuid4()}",
+    "ulid": new_id,
+}
+
+
+def _index_bytes(conn: sqlite3.Connection, table: str) -> int:
+    try:
+        row = conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name = ?",
+            (f"sqlite_autoindex_{table}_1",),
+        ).fetchone()
+        return int(row[0] or 0)
+    except sqlite3.OperationalError:
+        # SQLite built without DBSTAT
+        return -1
+
+
+def run_scheme(path: str, make_id: Callable[[str], str], rows: int, batch: int) -> Dict[str, float]:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -65536")
+    for ddl in _SCHEMA:
+        conn.execute(ddl)
+    now = "2025-01-01T00:00:00Z"
+    tail_from = rows - max(rows // 10, 1)
+    started = time.perf_counter()
+    tail_started = started
+    done = 0
+    while done < rows:
+        n = min(batch, rows - done)
+        if done <= tail_from < done + n:
+            tail_started = time.perf_counter()
+        txs = []
+        les = []
+        for i in range(n):
+            tx_id = make_id("tx")
+            client = f"C{(done + i) % 1000:04d}"
+            txs.append((tx_id, client, "deposit", "completed", 1000, "JPY", now, now, None))
+            les.append((make_id("le"), tx_id, client, "credit", 1000, "JPY", now))
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO transactions VALUES(?,?,?,?,?,?,?,?,?)", txs)
+        conn.executemany("INSERT INTO ledger_entries VALUES(?,?,?,?,?,?,?)", les)
+        conn.execute("COMMIT")
+        done += n
+    finished = time.perf_counter()
+    result = {
+        "rows_per_sec": rows * 2 / (finished - started),
+        "tail_rows_per_sec": (rows - tail_from) * 2 / max(finished - tail_started, 1e-9),
+        "tx_pk_index_mb": _index_bytes(conn, "transactions") / 1e6,
+        "le_pk_index_mb": _index_bytes(conn, "ledger_entries") / 1e6,
+    }
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    result["file_mb"] = os.path.getsize(path) / 1e6
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Primary-key scheme insert benchmark")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="rows per table")
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--dir", default=None, help="scratch directory (default: system temp)")
+    parser.add_argument("--scheme", choices=sorted(SCHEMES), action="append")
+    args = parser.parse_args()
+    for name in args.scheme or ["uuid4", "ulid"]:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            res = run_scheme(os.path.join(tmp, "bench.db"), SCHEMES[name], args.rows, args.batch)
+        print(
+            f"{name:6s} rows={args.rows} "
+            f"insert={res['rows_per_sec']:.0f}/s last10%={res['tail_rows_per_sec']:.0f}/s "
+            f"tx_pk={res['tx_pk_index_mb']:.1f}MB le_pk={res['le_pk_index_mb']:.1f}MB file={res['file_mb']:.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Per-(client, currency) balance checkpoints for point-in-time balances.
+
+A checkpoint stores the net ledger balance including every entry with
+``created_at <= as_of``. ``balance_at`` starts from the nearest checkpoint
+at or before the requested time and sums only the entries after it, so the
+cost depends on activity since the last checkpoint rather than on the
+length of the history.
+
+Checkpoints are only written for instants at least ``_SETTLE_SECONDS`` in
+the past: entries are stamped before their transaction commits, so a
+checkpoint of "now" could miss a row that is about to land.
+
+``write_due`` writes one at the end of every UTC day, and earlier once
+``CHECKPOINT_EVERY_ROWS`` entries have landed after the latest checkpoint;
+the web server runs it every ``CHECKPOINT_INTERVAL_S`` (``start_background``).
+
+    python -m src.app.checkpoints write [--as-of 2025-01-31T23:59:59Z]
+    python -m src.app.checkpoints due
+    python -m src.app.checkpoints balance --client A --currency JPY --at 2025-01-31T23:59:59Z
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from .audit import append as audit
+from .config import CHECKPOINT_EVERY_ROWS
+from .db import db, now_iso
+
+_SETTLE_SECONDS = 60
+
+_NET = "COALESCE(SUM(CASE direction WHEN 'credit' THEN amount ELSE -amount END), 0)"
+
+
+def end_of_day(d: date) -> str:
+    return f"{d.isoformat()}T23:59:59Z"
+
+
+def _nearest(conn: sqlite3.Connection, client_id: str, currency: str, ts: str) -> Tuple[Optional[str], int]:
+    row = conn.execute(
+        "SELECT as_of, balance FROM balance_checkpoints WHERE client_id=? AND currency=? AND as_of <= ?"
+        " ORDER BY as_of DESC LIMIT 1",
+        (client_id, currency, ts),
+    ).fetchone()
+    return (row["as_of"], int(row["balance"])) if row else (None, 0)
+
+
+_DELTA_SQL = (
+    f"SELECT {_NET} AS net FROM {{table}} WHERE client_id=? AND currency=?{{after}} AND created_at <= ?"
+)
+
+
+def _delta(conn: sqlite3.Connection, table: str, client_id: str, currency: str,
+           after: Optional[str], upto: str) -> int:
+    if after is None:
+        sql = _DELTA_SQL.format(table=table, after="")
+        params: tuple = (client_id, currency, upto)
+    else:
+        sql = _DELTA_SQL.format(table=table, after=" AND created_at > ?")
+        params = (client_id, currency, after, upto)
+    return int(conn.execute(sql, params).fetchone()["net"])
+
+
+def _balance(conn: sqlite3.Connection, client_id: str, currency: str, ts: str) -> int:
+    from .archive import history_windows, list_archives
+
+    as_of, base = _nearest(conn, client_id, currency, ts)
+    since = as_of[:7] if as_of else None
+    if any(m <= ts[:7] and (since is None or m >= since) for m in list_archives()):
+        # (as_of, ts] reaches into archived months: the hot table alone misses entries
+        return base + sum(_delta(h, "all_ledger_entries", client_id, currency, as_of, ts)
+                          for h in history_windows(since_month=since))
+    return base + _delta(conn, "ledger_entries", client_id, currency, as_of, ts)
+
+
+def balance_at(client_id: str, currency: str, ts: str) -> int:
+    """Net ledger balance of ``client_id`` in ``currency`` as of ``ts`` (inclusive)."""
+    with db(readonly=True) as conn:
+        return _balance(conn, client_id, currency, ts)
+
+
+def write_checkpoints(as_of: str) -> int:
+    """Write a checkpoint at ``as_of`` for every (client, currency) with ledger activity."""
+    settled = (datetime.utcnow() - timedelta(seconds=_SETTLE_SECONDS)).replace(microsecond=0).isoformat() + "Z"
+    if as_of > settled:
+        raise ValueError(f"as_of {as_of} is not settled yet (must be <= {settled})")
+    written = 0
+    with db() as conn:
+        pairs = conn.execute(
+            "SELECT client_id, currency FROM balances"
+            " UNION SELECT client_id, currency FROM balance_checkpoints"
+        ).fetchall()
+        now = now_iso()
+        for row in pairs:
+            balance = _balance(conn, row["client_id"], row["currency"], as_of)
+            conn.execute(
+                "INSERT OR REPLACE INTO balance_checkpoints(client_id, currency, as_of, balance, created_at)"
+                " VALUES(?,?,?,?,?)",
+                (row["client_id"], row["currency"], as_of, balance, now),
+            )
+            written += 1
+    return written
+
+
+_LATEST_SQL = "SELECT MAX(as_of) FROM balance_checkpoints"
+# stops counting at the threshold, so the check stays cheap however far behind it is
+_ENTRIES_SINCE_SQL = "SELECT COUNT(*) FROM (SELECT 1 FROM ledger_entries WHERE created_at > ? LIMIT ?)"
+
+
+def write_due(every_rows: int = CHECKPOINT_EVERY_ROWS) -> Optional[str]:
+    """Write checkpoints if one is due; returns the ``as_of`` written, or None.
+
+    Due when the end of yesterday (UTC) has no checkpoint yet, or when at
+    least ``every_rows`` ledger entries came after the latest one (then the
+    checkpoint is taken at the latest settled instant).
+    """
+    now = datetime.utcnow()
+    daily = end_of_day(now.date() - timedelta(days=1))
+    with db(readonly=True) as conn:
+        latest = conn.execute(_LATEST_SQL).fetchone()[0]
+        if latest is None or latest < daily:
+            as_of = daily
+        elif every_rows > 0 and conn.execute(_ENTRIES_SINCE_SQL, (latest, every_rows)).fetchone()[0] >= every_rows:
+            as_of = (now - timedelta(seconds=_SETTLE_SECONDS)).replace(microsecond=0).isoformat() + "Z"
+        else:
+            return None
+    write_checkpoints(as_of)
+    return as_of
+
+
+def start_background(interval_s: float) -> threading.Thread:
+    """Run ``write_due`` every ``interval_s`` seconds on a daemon thread."""
+
+    def loop():
+        while True:
+            try:
+                write_due()
+            except Exception as e:
+                audit("checkpoint_error", "system", {"error": str(e)})
+            time.sleep(interval_s)
+
+    t = threading.Thread(target=loop, name="balance-checkpoints", daemon=True)
+    t.start()
+    return t
+
+
+def balances_at(ts: str) -> List[Dict]:
+    """``balance_at`` for every (client, currency) pair, as rows."""
+    with db(readonly=True) as conn:
+        pairs = conn.execute(
+            "SELECT client_id, currency FROM balances ORDER BY client_id, currency"
+        ).fetchall()
+        return [
+            {"client_id": r["client_id"], "currency": r["currency"],
+             "available": _balance(conn, r["client_id"], r["currency"], ts)}
+            for r in pairs
+        ]
+
+
+def statement(client_id: str, currency: str, start: str, end: str) -> Dict:
+    """Opening balance, entries in (start, end] and closing balance."""
+    from .archive import history_windows, list_archives
+
+    sql = (
+        "SELECT id, tx_id, direction, amount, created_at FROM {table}"
+        " WHERE client_id=? AND currency=? AND created_at > ? AND created_at <= ?"
+        " ORDER BY created_at, id"
+    )
+    params = (client_id, currency, start, end)
+    with db(readonly=True) as conn:
+        opening = _balance(conn, client_id, currency, start)
+        if not list_archives():
+            entries = [dict(r) for r in conn.execute(sql.format(table="ledger_entries"), params)]
+    if list_archives():
+        entries = []
+        for h in history_windows(since_month=start[:7]):
+            entries += [dict(r) for r in h.execute(sql.format(table="all_ledger_entries"), params)]
+        entries.sort(key=lambda e: (e["created_at"], e["id"]))
+    closing = opening + sum(e["amount"] if e["direction"] == "credit" else -e["amount"] for e in entries)
+    return {"client_id": client_id, "currency": currency, "start": start, "end": end,
+            "opening": opening, "closing": closing, "entries": entries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balance checkpoints")
+    sub = parser.add_subparsers(dest="cmd")
+    pw = sub.add_parser("write")
+    pw.add_argument("--as-of", default=None, help="ISO timestamp (default: end of yesterday UTC)")
+    sub.add_parser("due", help="write checkpoints if the daily or row-count trigger is due")
+    pb = sub.add_parser("balance")
+    pb.add_argument("--client", required=True)
+    pb.add_argument("--currency", default="JPY")
+    pb.add_argument("--at", required=True)
+    args = parser.parse_args()
+    if args.cmd == "write":
+        as_of = args.as_of or end_of_day(datetime.utcnow().date() - timedelta(days=1))
+        print(f"wrote {write_checkpoints(as_of)} checkpoints as of {as_of}")
+    elif args.cmd == "due":
+        as_of = write_due()
+        print(f"wrote checkpoints as of {as_of}" if as_of else "no checkpoint due")
+    elif args.cmd == "balance":
+        print(balance_at(args.client, args.currency, args.at))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,65 @@ if os.environ.get('RENDER'):
         DB_PATH = "/opt/render/project/src/fintech.db"
 else:
     DB_PATH = os.getenv("DB_PATH", os.path.abspath("./fintech.db"))
+
+# SQLite connection tuning (see db.ConnectionPool)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "65536"))
+
+# Online backups (see backups.py); interval 0 disables the background thread
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(DB_PATH), "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL_S = float(os.getenv("BACKUP_INTERVAL_S", "0"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP_S = float(os.getenv("BACKUP_STEP_SLEEP_S", "0.005"))
+# the copy reads one snapshot and should never restart; give up if it restarts more often than this
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+# Balance checkpoints: how often the web server checks whether one is due (0 = off), and how many
+# ledger entries after the latest checkpoint trigger one before the daily end-of-day checkpoint
+CHECKPOINT_INTERVAL_S = float(os.getenv("CHECKPOINT_INTERVAL_S", "600"))
+CHECKPOINT_EVERY_ROWS = int(os.getenv("CHECKPOINT_EVERY_ROWS", "100000"))
+
+# Cold storage for closed history (see archive.py)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(DB_PATH), "archive"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+# Idempotency keys (see idempotency.py): kept for Rapyd's redelivery window plus margin
+IDEMPOTENCY_TTL_DAYS = int(os.getenv("IDEMPOTENCY_TTL_DAYS", "7"))
+IDEMPOTENCY_FILTER_CAPACITY = int(os.getenv("IDEMPOTENCY_FILTER_CAPACITY", "1000000"))
+IDEMPOTENCY_FILTER_FP_RATE = float(os.getenv("IDEMPOTENCY_FILTER_FP_RATE", "0.01"))
+
+# Audit log (see audit.py). Durability "fsync" makes every group commit durable; "flush" leaves it
+# to the OS page cache. The active file rolls into a numbered segment at a size or age boundary.
+AUDIT_LOG_PATH = os.path.abspath(os.getenv("AUDIT_LOG_PATH", "./audit.log"))
+AUDIT_DURABILITY = os.getenv("AUDIT_DURABILITY", "fsync")
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+AUDIT_SEGMENT_SECONDS = int(os.getenv("AUDIT_SEGMENT_SECONDS", "86400"))
+# Closed segments are compressed in independent blocks ("zlib", "lzma", "bz2"; "none" keeps them plain)
+AUDIT_COMPRESSION = os.getenv("AUDIT_COMPRESSION", "zlib")
+AUDIT_BLOCK_BYTES = int(os.getenv("AUDIT_BLOCK_BYTES", str(256 * 1024)))
+# A Merkle checkpoint record every N audit records (0 disables them; see merkle.py)
+AUDIT_MERKLE_EVERY = int(os.getenv("AUDIT_MERKLE_EVERY", "1024"))
+
+# Webhook inbox drain worker (see inbox.py)
+INBOX_BATCH_SIZE = int(os.getenv("INBOX_BATCH_SIZE", "500"))
+INBOX_POLL_INTERVAL_S = float(os.getenv("INBOX_POLL_INTERVAL_S", "0.2"))
+INBOX_RETENTION_DAYS = int(os.getenv("INBOX_RETENTION_DAYS", "7"))
+
+# Payout side-effect outbox (see outbox.py): retries back off from OUTBOX_BACKOFF_S, doubling per attempt.
+# The lease must outlast the slowest call (Rapyd requests time out after 30s).
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_POLL_INTERVAL_S = float(os.getenv("OUTBOX_POLL_INTERVAL_S", "1.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_S = float(os.getenv("OUTBOX_BACKOFF_S", "2.0"))
+OUTBOX_LEASE_S = int(os.getenv("OUTBOX_LEASE_S", "120"))
+
+# MCP Serena (see mcp_integration.py); unset host = not configured, payouts are not notified
+MCP_SERENA_HOST = os.getenv("MCP_SERENA_HOST", "")
+
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "dev_secret")
+# Bearer token for the web server's admin endpoints (ledger export, transaction history); unset = disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 DEFAULT_CHAIN = os.getenv("DEFAULT_CHAIN", "TRC20")
 
 # Two-person approval threshold (USDT). <= threshold: single approval, > threshold: two approvals
@@ -1,32 +1,247 @@
+import functools
+import itertools
 import os
 import sqlite3
+import threading
+import time
+import weakref
 from contextlib import contextmanager
 from datetime import datetime
-from typing import Iterator
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
 
-from .config import DB_PATH
+from .config import DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_PATH
 
 
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+def _configure(conn: sqlite3.Connection) -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)};")
+    # negative cache_size is expressed in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
     conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
 
+def _connect(path: Optional[str] = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+        # transactions are driven explicitly by db() so nested blocks can join them
+        isolation_level=None,
+        check_same_thread=check_same_thread,
+    )
+    return _configure(conn)
+
+
+_txn_ids = itertools.count(1)
+
+
+class _Slot:
+    __slots__ = ("conn", "depth", "hooks", "txn", "readonly")
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.depth = 0
+        self.hooks: List[Callable[[], None]] = []
+        # identifies the open outermost transaction, unique across processes
+        self.txn: Optional[str] = None
+        self.readonly = False
+
+
+class _ThreadSlots(dict):
+    """path -> _Slot for one thread; weak-referenceable so its end can be observed."""
+
+
+class ConnectionPool:
+    """Hands out one long-lived connection per (thread, database path).
+
+    sqlite3 connections are not shared across threads, so the pool is a
+    thread-local cache: the first ``acquire`` on a thread opens and configures
+    the connection, later calls reuse it. When the thread ends its
+    thread-local slots are dropped and a finalizer closes its connections,
+    so a thread per request does not leave file descriptors behind.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: Dict[int, sqlite3.Connection] = {}
+
+    def slot(self, path: Optional[str] = None) -> _Slot:
+        path = path or DB_PATH
+        slots = getattr(self._local, "slots", None)
+        if slots is None:
+            slots = self._local.slots = _ThreadSlots()
+            # the finalizer must not hold the slots, only the connections it closes
+            slots.conns = []
+            weakref.finalize(slots, self._release, slots.conns)
+        slot = slots.get(path)
+        if slot is None:
+            # only this thread uses it, but the finalizer may close it from another one
+            conn = _connect(path, check_same_thread=False)
+            slot = slots[path] = _Slot(conn)
+            slots.conns.append(conn)
+            with self._lock:
+                self._all[id(conn)] = conn
+        return slot
+
+    def _release(self, conns: List[sqlite3.Connection]) -> None:
+        for conn in conns:
+            with self._lock:
+                self._all.pop(id(conn), None)
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def acquire(self, path: Optional[str] = None) -> sqlite3.Connection:
+        return self.slot(path).conn
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns = list(self._all.values())
+            self._all.clear()
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # closed from a different thread than the one that opened it
+                pass
+        self._local = threading.local()
+
+
+pool = ConnectionPool()
+
+
 @contextmanager
-def db() -> Iterator[sqlite3.Connection]:
-    conn = _connect()
+def db(path: Optional[str] = None, readonly: bool = False) -> Iterator[sqlite3.Connection]:
+    """Run the block in a transaction on the thread's pooled connection.
+
+    The outermost ``db()`` on a thread opens the transaction and commits it;
+    nested ``db()`` blocks join it through a SAVEPOINT, so an exception inside
+    a nested block only undoes that block's writes. ``path`` selects another
+    database file (default ``DB_PATH``); each file has its own transaction.
+
+    The transaction starts with ``BEGIN IMMEDIATE``: the write lock is taken
+    (waiting up to the busy timeout) before the first read, so a block that
+    reads and then writes cannot find its snapshot overtaken by another
+    writer (SQLITE_BUSY_SNAPSHOT). Blocks that only read pass
+    ``readonly=True`` and get a deferred transaction that never waits on
+    writers; writing inside one fails (``PRAGMA query_only``).
+    """
+    slot = pool.slot(path)
+    conn = slot.conn
+    if slot.depth == 0:
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        try:
+            conn.execute("BEGIN" if readonly else "BEGIN IMMEDIATE")
+        except BaseException:
+            if readonly:
+                conn.execute("PRAGMA query_only = OFF")
+            raise
+        slot.depth = 1
+        slot.readonly = readonly
+        slot.txn = f"{os.getpid()}.{next(_txn_ids)}"
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            slot.hooks.clear()
+            raise
+        finally:
+            slot.depth = 0
+            slot.txn = None
+            if readonly:
+                slot.readonly = False
+                conn.execute("PRAGMA query_only = OFF")
+        hooks, slot.hooks = slot.hooks, []
+        for hook in hooks:
+            hook()
+        return
+    name = f"sp_{slot.depth}"
+    marker = len(slot.hooks)
+    conn.execute(f"SAVEPOINT {name}")
+    slot.depth += 1
     try:
         yield conn
-        conn.commit()
+        conn.execute(f"RELEASE {name}")
+    except BaseException:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        del slot.hooks[marker:]
+        raise
     finally:
-        conn.close()
+        slot.depth -= 1
 
 
-def init_db() -> None:
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+@contextmanager
+def unit_of_work() -> Iterator[sqlite3.Connection]:
+    """Group everything one request writes into a single commit.
+
+    Ledger rows, balance upserts, alerts and simulator writes made through
+    ``db()`` inside the block join this transaction, and audit records are
+    appended only once it has committed.
+    """
     with db() as conn:
+        yield conn
+
+
+def in_transaction(path: Optional[str] = None) -> bool:
+    return pool.slot(path).depth > 0
+
+
+def current_transaction(path: Optional[str] = None) -> Optional[str]:
+    """Id of the thread's open transaction on ``path`` (None outside one)."""
+    return pool.slot(path).txn
+
+
+def on_commit(hook: Callable[[], None], path: Optional[str] = None) -> None:
+    """Run ``hook`` after the thread's transaction on ``path`` commits (immediately if none).
+
+    Hooks registered inside a block that rolls back are discarded.
+    """
+    slot = pool.slot(path)
+    if slot.depth == 0:
+        hook()
+    else:
+        slot.hooks.append(hook)
+
+
+_BUSY = (sqlite3.SQLITE_BUSY, getattr(sqlite3, "SQLITE_BUSY_SNAPSHOT", 517))
+F = TypeVar("F", bound=Callable)
+
+
+def transactional(fn: F, attempts: int = 5) -> F:
+    """Re-run ``fn`` from the start when its transaction fails with SQLITE_BUSY(_SNAPSHOT).
+
+    Only the outermost call retries (its transaction was rolled back as a
+    whole); inside a caller's transaction the error propagates to the caller.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if in_transaction():
+            return fn(*args, **kwargs)
+        for attempt in range(attempts):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if getattr(e, "sqlite_errorcode", None) not in _BUSY or attempt == attempts - 1:
+                    raise
+                time.sleep(0.01 * 2 ** attempt)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def init_db(path: Optional[str] = None) -> None:
+    path = path or DB_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with db(path) as conn:
         c = conn.cursor()
         # Clients and balances
         c.execute(
@@ -214,6 +429,11 @@ def init_db() -> None:
             """
         )
 
+    # indexes and later columns are versioned in migrations.py
+    from .migrations import migrate
+
+    migrate(path)
+
 
 def now_iso() -> str:
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
@@ -0,0 +1,157 @@
+"""Streaming export of ledger tables for auditors.
+
+Rows are read in pages with keyset pagination on ``(created_at, id)`` and
+written straight to the output as NDJSON or CSV, optionally gzip-compressed,
+so memory use does not depend on the number of rows. Each page is its own
+short read, which keeps WAL checkpoints moving during long exports.
+
+With ``include_archive`` the monthly archive files are exported first (oldest
+month first, each opened read-only on its own), then the hot table; each
+source is ordered by ``(created_at, id)``.
+
+    python -m src.app.export --table ledger_entries --format csv --gzip --out ledger.csv.gz
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import json
+import sqlite3
+import sys
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from .archive import each_archive
+from .db import _connect
+
+EXPORT_TABLES = ("transactions", "ledger_entries")
+PAGE_SIZE = 5000
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _page_sql(schema: str, table: str, clauses: List[str]) -> str:
+    sql = f"SELECT * FROM {schema}.{table}" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+    return sql + " ORDER BY created_at, id LIMIT ?"
+
+
+def _pages(conn: sqlite3.Connection, schema: str, table: str, filters: Dict[str, Optional[str]],
+           page_size: int) -> Iterator[List[sqlite3.Row]]:
+    where = []
+    params: list = []
+    if filters.get("client_id"):
+        where.append("client_id = ?")
+        params.append(filters["client_id"])
+    if filters.get("currency"):
+        where.append("currency = ?")
+        params.append(filters["currency"])
+    if filters.get("since"):
+        where.append("created_at >= ?")
+        params.append(filters["since"])
+    if filters.get("until"):
+        where.append("created_at < ?")
+        params.append(filters["until"])
+    last = None
+    while True:
+        clauses = list(where)
+        page_params = list(params)
+        if last is not None:
+            clauses.append("(created_at, id) > (?, ?)")
+            page_params.extend(last)
+        page_params.append(page_size)
+        rows = conn.execute(_page_sql(schema, table, clauses), page_params).fetchall()
+        if not rows:
+            return
+        yield rows
+        last = (rows[-1]["created_at"], rows[-1]["id"])
+        if len(rows) < page_size:
+            return
+
+
+def export_table(out: BinaryIO, table: str, fmt: str = "ndjson", compress: bool = False,
+                 client_id: Optional[str] = None, currency: Optional[str] = None,
+                 since: Optional[str] = None, until: Optional[str] = None,
+                 include_archive: bool = False, page_size: int = PAGE_SIZE) -> Dict[str, float]:
+    """Write ``table`` to the binary stream ``out``; returns rows, bytes, seconds and rows/sec."""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"table must be one of {EXPORT_TABLES}")
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError("format must be ndjson or csv")
+    filters = {"client_id": client_id, "currency": currency, "since": since, "until": until}
+    started = time.perf_counter()
+    sink = gzip.GzipFile(fileobj=out, mode="wb") if compress else out
+    rows = 0
+    written = 0
+    archives = each_archive() if include_archive else iter(())
+    conn = _connect()
+    try:
+        cols = _columns(conn, "main", table)
+        header_done = False
+        # archive files one at a time (oldest first), then the hot table
+        sources = itertools.chain((arc for _, arc in archives), [conn])
+        for source in sources:
+            if not _columns(source, "main", table):
+                continue
+            for page in _pages(source, "main", table, filters, page_size):
+                buf = io.StringIO()
+                if fmt == "csv":
+                    writer = csv.writer(buf)
+                    if not header_done:
+                        writer.writerow(cols)
+                        header_done = True
+                    writer.writerows([tuple(r) for r in page])
+                else:
+                    for r in page:
+                        buf.write(json.dumps(dict(zip(cols, r)), ensure_ascii=False))
+                        buf.write("\n")
+                data = buf.getvalue().encode("utf-8")
+                sink.write(data)
+                written += len(data)
+                rows += len(page)
+        if fmt == "csv" and not header_done:
+            data = (",".join(cols) + "\r\n").encode("utf-8")
+            sink.write(data)
+            written += len(data)
+    finally:
+        conn.close()
+        if include_archive:
+            archives.close()
+        if compress:
+            sink.close()
+    seconds = time.perf_counter() - started
+    return {"rows": rows, "bytes": written, "seconds": round(seconds, 3),
+            "rows_per_sec": round(rows / seconds, 1) if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream ledger tables as NDJSON/CSV")
+    parser.add_argument("--table", choices=EXPORT_TABLES, default="ledger_entries")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--client", default=None)
+    parser.add_argument("--currency", default=None)
+    parser.add_argument("--since", default=None, help="ISO timestamp, inclusive")
+    parser.add_argument("--until", default=None, help="ISO timestamp, exclusive")
+    parser.add_argument("--include-archive", action="store_true")
+    parser.add_argument("--out", default="-", help="file path or - for stdout")
+    args = parser.parse_args()
+    out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    try:
+        stats = export_table(out, args.table, args.format, args.gzip, args.client, args.currency,
+                             args.since, args.until, args.include_archive)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(
+        f"exported {stats['rows']} rows ({stats['bytes']} bytes) in {stats['seconds']}s"
+        f" = {stats['rows_per_sec']} rows/sec",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
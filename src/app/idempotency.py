@@ -0,0 +1,183 @@
+"""Bounded idempotency store for incoming events.
+
+The ``idempotency`` table stays the source of truth. In front of it sits a
+per-process Bloom filter loaded from the table on first use and fed with
+every key this process claims. A negative answer means the event id was
+never recorded here or in the table at load time, so the SELECT probe is
+skipped; a positive answer always falls through to the exact probe.
+
+Events written by another process after the filter was loaded can still
+look "new"; ``claim`` inserts the key first in the caller's transaction
+with INSERT OR IGNORE, so such a race is caught by the primary key and
+reported as a duplicate. Duplicate detection therefore stays exact.
+
+Keys older than ``IDEMPOTENCY_TTL_DAYS`` (Rapyd's redelivery window plus
+margin) are pruned with ``prune``.
+
+    python -m src.app.idempotency prune [--ttl-days N]
+    python -m src.app.idempotency stats
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Sequence, Set, Tuple
+
+from .config import IDEMPOTENCY_FILTER_CAPACITY, IDEMPOTENCY_FILTER_FP_RATE, IDEMPOTENCY_TTL_DAYS
+from .db import db
+
+_IN_CHUNK = 500
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float) -> None:
+        self.bits = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        # Kirsch-Mitzenmacher double hashing
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for p in self._positions(key):
+            self._array[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._array[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class IdempotencyStore:
+    def __init__(self, capacity: int = IDEMPOTENCY_FILTER_CAPACITY,
+                 fp_rate: float = IDEMPOTENCY_FILTER_FP_RATE) -> None:
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self._lock = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self.metrics = {
+            "filter_negative": 0,  # probe skipped: definitely new
+            "filter_positive": 0,  # maybe seen: exact probe ran
+            "probe_hits": 0,  # exact probe found a duplicate
+            "claim_conflicts": 0,  # another writer recorded the key first
+            "claims": 0,
+            "pruned": 0,
+        }
+
+    def _load(self, conn: sqlite3.Connection) -> BloomFilter:
+        bloom = BloomFilter(self.capacity, self.fp_rate)
+        for (event_id,) in conn.execute("SELECT event_id FROM idempotency"):
+            bloom.add(event_id)
+        return bloom
+
+    def _bloom(self, conn: sqlite3.Connection) -> BloomFilter:
+        with self._lock:
+            if self._filter is None or self._filter.count > self.capacity:
+                # past capacity the false-positive rate climbs; rebuild from the (pruned) table
+                self._filter = self._load(conn)
+            return self._filter
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.metrics[name] += n
+
+    def seen(self, conn: sqlite3.Connection, event_id: str) -> bool:
+        """Exact: has ``event_id`` been processed? Skips the probe when the filter can."""
+        if event_id not in self._bloom(conn):
+            self._count("filter_negative")
+            return False
+        self._count("filter_positive")
+        row = conn.execute("SELECT 1 FROM idempotency WHERE event_id=?", (event_id,)).fetchone()
+        if row:
+            self._count("probe_hits")
+            return True
+        return False
+
+    def claim(self, conn: sqlite3.Connection, event_id: str, kind: str, processed_at: str) -> bool:
+        """Record ``event_id`` in the caller's transaction; False if it already existed."""
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO idempotency(event_id, kind, processed_at) VALUES(?,?,?)",
+            (event_id, kind, processed_at),
+        )
+        self._bloom(conn).add(event_id)
+        if cur.rowcount == 0:
+            self._count("claim_conflicts")
+            return False
+        self._count("claims")
+        return True
+
+    def seen_many(self, conn: sqlite3.Connection, event_ids: Sequence[str]) -> Set[str]:
+        """Exact subset of ``event_ids`` already processed, probing only filter positives."""
+        bloom = self._bloom(conn)
+        maybe = [e for e in event_ids if e in bloom]
+        self._count("filter_negative", len(event_ids) - len(maybe))
+        self._count("filter_positive", len(maybe))
+        found: Set[str] = set()
+        for i in range(0, len(maybe), _IN_CHUNK):
+            chunk = maybe[i:i + _IN_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            found.update(r[0] for r in conn.execute(
+                f"SELECT event_id FROM idempotency WHERE event_id IN ({marks})", chunk
+            ))
+        self._count("probe_hits", len(found))
+        return found
+
+    def claim_many(self, conn: sqlite3.Connection, rows: Sequence[Tuple[str, str, str]]) -> None:
+        """Record (event_id, kind, processed_at) rows; a key that already exists raises IntegrityError."""
+        conn.executemany("INSERT INTO idempotency(event_id, kind, processed_at) VALUES(?,?,?)", rows)
+        bloom = self._bloom(conn)
+        for event_id, _, _ in rows:
+            bloom.add(event_id)
+        self._count("claims", len(rows))
+
+    def prune(self, ttl_days: int = IDEMPOTENCY_TTL_DAYS) -> int:
+        cutoff = (datetime.utcnow() - timedelta(days=ttl_days)).replace(microsecond=0).isoformat() + "Z"
+        with db() as conn:
+            removed = conn.execute("DELETE FROM idempotency WHERE processed_at < ?", (cutoff,)).rowcount
+            with self._lock:
+                self._filter = None
+        self._count("pruned", removed)
+        return removed
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out: Dict[str, float] = dict(self.metrics)
+            out["filter_keys"] = self._filter.count if self._filter else 0
+            out["filter_bits"] = self._filter.bits if self._filter else 0
+        lookups = out["filter_negative"] + out["filter_positive"]
+        out["filter_skip_rate"] = out["filter_negative"] / lookups if lookups else 0.0
+        out["duplicate_rate"] = (out["probe_hits"] + out["claim_conflicts"]) / lookups if lookups else 0.0
+        return out
+
+
+store = IdempotencyStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Idempotency store maintenance")
+    sub = parser.add_subparsers(dest="cmd")
+    pp = sub.add_parser("prune")
+    pp.add_argument("--ttl-days", type=int, default=IDEMPOTENCY_TTL_DAYS)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+    if args.cmd == "prune":
+        print(f"pruned {store.prune(args.ttl_days)} keys older than {args.ttl_days} days")
+    elif args.cmd == "stats":
+        with db(readonly=True) as conn:
+            total = conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+            oldest = conn.execute("SELECT MIN(processed_at) FROM idempotency").fetchone()[0]
+        print(json.dumps({"keys": total, "oldest": oldest, **store.stats()}, indent=2))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Time-ordered identifiers for primary keys.
+
+IDs keep the existing ``<prefix>_`` convention followed by a 26-character
+ULID: 48 bits of millisecond timestamp and 80 random bits in Crockford
+base32. Keys generated later sort after earlier ones, so inserts land at the
+right-hand edge of the primary-key B-tree instead of splitting random pages.
+Within one millisecond the random part is incremented, which keeps IDs from
+one process strictly monotonic.
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_rand = 0
+
+
+def _encode(value: int, length: int) -> str:
+    out = []
+    for _ in range(length):
+        out.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(out))
+
+
+def ulid(now_ms: Optional[int] = None) -> str:
+    global _last_ms, _last_rand
+    ms = int(time.time() * 1000) if now_ms is None else now_ms
+    with _lock:
+        if ms <= _last_ms:
+            # same (or skewed-back) millisecond: stay on the last timestamp and bump
+            ms = _last_ms
+            rand = _last_rand + 1
+            if rand > _RANDOM_MAX:
+                ms += 1
+                rand = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # leave headroom so increments within this millisecond cannot overflow
+            rand = int.from_bytes(os.urandom(10), "big") >> 1
+        _last_ms, _last_rand = ms, rand
+    return _encode(ms, 10) + _encode(rand, 16)
+
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}_{ulid()}"
+
+
+def id_timestamp_ms(identifier: str) -> int:
+    """Millisecond timestamp embedded in an ID produced by ``new_id``."""
+    value = 0
+    for ch in identifier.rsplit("_", 1)[-1][:10]:
+        value = value * 32 + _ALPHABET.index(ch)
+    return value
@@ -0,0 +1,184 @@
+"""Durable webhook inbox.
+
+The receiver only verifies the signature and stores the raw event with one
+INSERT (``enqueue``), so a burst from Rapyd is acknowledged at insert speed.
+``drain_once`` takes pending events in arrival order and applies a whole
+batch in one transaction, deposits through ``ledger.record_deposits``. If a
+batch fails it is retried one event at a time; an event that still fails is
+marked processed with its error (dead letter) and raises an alert, so it
+cannot block the queue.
+
+Redelivered events may be stored twice; the ledger's idempotency keys make
+the second application a no-op.
+
+    python -m src.app.inbox drain [--once]
+    python -m src.app.inbox stats
+    python -m src.app.inbox prune [--days N]
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from .alerts import raise_alert
+from .audit import append as audit
+from .config import INBOX_BATCH_SIZE, INBOX_POLL_INTERVAL_S, INBOX_RETENTION_DAYS
+from .db import db, now_iso, unit_of_work
+from .ledger import record_deposits
+
+_lock = threading.Lock()
+metrics = {"enqueued": 0, "drained": 0, "batches": 0, "batch_fallbacks": 0, "dead_letters": 0,
+           "last_batch_size": 0, "last_batch_ms": 0.0}
+
+
+def _count(**updates) -> None:
+    with _lock:
+        for name, value in updates.items():
+            if name.startswith("last_"):
+                metrics[name] = value
+            else:
+                metrics[name] += value
+
+
+def enqueue(body: bytes, event: Dict) -> int:
+    """Store a verified raw event; returns its inbox sequence number."""
+    with db() as conn:
+        seq = conn.execute(
+            "INSERT INTO webhook_inbox(event_id, type, body, received_at) VALUES(?,?,?,?)",
+            (event.get("id"), event.get("type"), body.decode("utf-8"), now_iso()),
+        ).lastrowid
+    _count(enqueued=1)
+    return seq
+
+
+_PAYOUT_SENT_SQL = "UPDATE payouts SET tx_hash=?, updated_at=datetime('now') WHERE request_id=?"
+_DRAIN_SQL = "SELECT seq, event_id, type, body FROM webhook_inbox WHERE processed_at IS NULL ORDER BY seq LIMIT ?"
+
+
+def _apply(conn: sqlite3.Connection, events: List[Dict]) -> None:
+    deposits = [e for e in events if e.get("type") == "payment.completed"]
+    if deposits:
+        record_deposits(deposits)
+    for e in events:
+        if e.get("type") == "payout.sent":
+            data = e.get("data", {})
+            conn.execute(_PAYOUT_SENT_SQL, (data.get("tx_hash"), data.get("request_id")))
+
+
+def _mark(conn: sqlite3.Connection, seqs: List[int], error: Optional[str] = None) -> None:
+    now = now_iso()
+    conn.executemany(
+        "UPDATE webhook_inbox SET processed_at=?, error=? WHERE seq=?", [(now, error, s) for s in seqs]
+    )
+
+
+def drain_once(batch_size: int = INBOX_BATCH_SIZE) -> int:
+    """Apply up to ``batch_size`` pending events; returns how many were taken."""
+    with db(readonly=True) as conn:
+        rows = conn.execute(_DRAIN_SQL, (batch_size,)).fetchall()
+    if not rows:
+        return 0
+    started = time.perf_counter()
+    batch: List[Tuple[int, Dict]] = [(r["seq"], json.loads(r["body"])) for r in rows]
+    try:
+        with unit_of_work() as conn:
+            _apply(conn, [e for _, e in batch])
+            _mark(conn, [s for s, _ in batch])
+    except Exception:
+        # one bad event must not hold back the rest of the batch
+        _count(batch_fallbacks=1)
+        for seq, event in batch:
+            try:
+                with unit_of_work() as conn:
+                    _apply(conn, [event])
+                    _mark(conn, [seq])
+            except Exception as e:
+                with db() as conn:
+                    _mark(conn, [seq], f"{type(e).__name__}: {e}")
+                _count(dead_letters=1)
+                raise_alert("high", "webhook_dead_letter", f"inbox event {seq} failed: {e}",
+                             {"seq": seq, "event_id": event.get("id"), "type": event.get("type")})
+    _count(drained=len(batch), batches=1, last_batch_size=len(batch),
+           last_batch_ms=round((time.perf_counter() - started) * 1000, 2))
+    return len(batch)
+
+
+def stats() -> Dict:
+    """Inbox depth, lag of the oldest pending event (seconds) and drain counters."""
+    with db(readonly=True) as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS depth, MIN(received_at) AS oldest FROM webhook_inbox WHERE processed_at IS NULL"
+        ).fetchone()
+        dead = conn.execute("SELECT COUNT(*) FROM webhook_inbox WHERE error IS NOT NULL").fetchone()[0]
+    lag = 0.0
+    if row["oldest"]:
+        oldest = datetime.strptime(row["oldest"], "%Y-%m-%dT%H:%M:%SZ")
+        lag = max(0.0, (datetime.utcnow() - oldest).total_seconds())
+    with _lock:
+        out = dict(metrics)
+    out.update({"depth": row["depth"], "lag_s": lag, "dead_letters_total": dead})
+    return out
+
+
+def prune(days: int = INBOX_RETENTION_DAYS) -> int:
+    """Delete applied events older than ``days``; dead letters are kept for inspection."""
+    cutoff = (datetime.utcnow() - timedelta(days=days)).replace(microsecond=0).isoformat() + "Z"
+    with db() as conn:
+        return conn.execute(
+            "DELETE FROM webhook_inbox WHERE processed_at < ? AND error IS NULL", (cutoff,)
+        ).rowcount
+
+
+def start_background(interval_s: float = INBOX_POLL_INTERVAL_S,
+                     batch_size: int = INBOX_BATCH_SIZE) -> threading.Thread:
+    """Drain the inbox on a daemon thread; sleeps only when a batch comes back short."""
+
+    def loop():
+        while True:
+            try:
+                if drain_once(batch_size) < batch_size:
+                    time.sleep(interval_s)
+            except Exception as e:
+                audit("inbox_drain_error", "system", {"error": str(e)})
+                time.sleep(interval_s)
+
+    t = threading.Thread(target=loop, name="inbox-drain", daemon=True)
+    t.start()
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook inbox")
+    sub = parser.add_subparsers(dest="cmd")
+    pd = sub.add_parser("drain")
+    pd.add_argument("--once", action="store_true", help="drain what is pending and exit")
+    pd.add_argument("--batch", type=int, default=INBOX_BATCH_SIZE)
+    sub.add_parser("stats")
+    pp = sub.add_parser("prune")
+    pp.add_argument("--days", type=int, default=INBOX_RETENTION_DAYS)
+    args = parser.parse_args()
+    if args.cmd == "drain":
+        if args.once:
+            total = 0
+            while True:
+                n = drain_once(args.batch)
+                total += n
+                if n < args.batch:
+                    break
+            print(f"drained {total} events")
+        else:
+            start_background(batch_size=args.batch).join()
+    elif args.cmd == "stats":
+        print(json.dumps(stats(), indent=2))
+    elif args.cmd == "prune":
+        print(f"pruned {prune(args.days)} events")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Ledger-vs-balances integrity check.
+
+``balances.available`` must equal the net of credit and debit
+``ledger_entries`` for every (client, currency). The client space is split
+into ranges of ``range_size`` clients; each range is checked in a worker
+process inside one read transaction (a consistent snapshot), so no single
+long query holds the database. Archived entries are summed from each
+monthly archive file in turn; every connection is read-only. Only mismatches come back; they are appended
+to the CSV report and raised as ``ledger_mismatch`` alerts.
+
+Progress is kept in ``REPORTS_DIR/integrity.state.json`` after every range,
+so an interrupted run resumes with the ranges it has not finished.
+
+    python -m src.app.integrity run [--workers 4] [--range-size 1000] [--fresh]
+    python -m src.app.integrity status
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .alerts import raise_alert
+from .audit import append as audit
+from .config import DB_PATH, REPORTS_DIR
+
+_NET = "SUM(CASE direction WHEN 'credit' THEN amount ELSE -amount END)"
+
+STATE_PATH = os.path.join(REPORTS_DIR, "integrity.state.json")
+
+Range = Tuple[Optional[str], Optional[str]]
+
+
+def _ranges(db_path: str, range_size: int) -> List[Range]:
+    """Split client ids into [lo, hi) ranges of ``range_size`` clients (open at both ends)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        bounds: List[Optional[str]] = [None]
+        for i, (client_id,) in enumerate(conn.execute("SELECT id FROM clients ORDER BY id")):
+            if i and i % range_size == 0:
+                bounds.append(client_id)
+        bounds.append(None)
+    finally:
+        conn.close()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _range_sql(column: str, rng: Range) -> Tuple[str, list]:
+    lo, hi = rng
+    clauses, params = ["1"], []
+    if lo is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(lo)
+    if hi is not None:
+        clauses.append(f"{column} < ?")
+        params.append(hi)
+    return " AND ".join(clauses), params
+
+
+def check_range(db_path: str, rng: Range) -> List[Dict]:
+    """Mismatching (client, currency) pairs in one client range, hot tables read from a single snapshot."""
+    from .archive import each_archive
+
+    where, params = _range_sql("client_id", rng)
+    ledger_sql = f"SELECT client_id, currency, {_NET} FROM ledger_entries WHERE {where} GROUP BY client_id, currency"
+    net: Dict[Tuple[str, str], int] = {}
+    # archived entries still count towards the balance; one read-only file at a time
+    for _, arc in each_archive():
+        if arc.execute("SELECT 1 FROM sqlite_master WHERE name='ledger_entries'").fetchone():
+            for client_id, currency, n in arc.execute(ledger_sql, params):
+                net[(client_id, currency)] = net.get((client_id, currency), 0) + int(n)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        for client_id, currency, n in conn.execute(ledger_sql, params):
+            net[(client_id, currency)] = net.get((client_id, currency), 0) + int(n)
+        balances = {
+            (r[0], r[1]): int(r[2])
+            for r in conn.execute(f"SELECT client_id, currency, available FROM balances WHERE {where}", params)
+        }
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    mismatches = []
+    for key in sorted(set(net) | set(balances)):
+        available, ledger_net = balances.get(key, 0), net.get(key, 0)
+        if available != ledger_net:
+            mismatches.append({"client_id": key[0], "currency": key[1], "available": available,
+                               "ledger_net": ledger_net, "delta": available - ledger_net})
+    return mismatches
+
+
+def _load_state() -> Optional[Dict]:
+    if not os.path.exists(STATE_PATH):
+        return None
+    with open(STATE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(state: Dict) -> None:
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_PATH)
+
+
+def run(workers: Optional[int] = None, range_size: int = 1000, fresh: bool = False,
+        db_path: Optional[str] = None) -> Dict:
+    """Check every range not yet done in the current run; returns the final state."""
+    db_path = db_path or DB_PATH
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    state = None if fresh else _load_state()
+    if state is None or state.get("finished_at") or state.get("db_path") != db_path:
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        state = {
+            "db_path": db_path,
+            "started_at": stamp,
+            "report": os.path.join(REPORTS_DIR, f"integrity_{stamp}.csv"),
+            "ranges": _ranges(db_path, range_size),
+            "done": [],
+            "mismatches": 0,
+            "finished_at": None,
+        }
+        with open(state["report"], "w", newline="") as f:
+            csv.writer(f).writerow(["client_id", "currency", "available", "ledger_net", "delta"])
+        _save_state(state)
+    done = set(state["done"])
+    todo = [i for i in range(len(state["ranges"])) if i not in done]
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(state["report"], "a", newline="") as f:
+        writer = csv.writer(f)
+        futures = {pool.submit(check_range, db_path, tuple(state["ranges"][i])): i for i in todo}
+        for fut in as_completed(futures):
+            mismatches = fut.result()
+            for m in mismatches:
+                writer.writerow([m["client_id"], m["currency"], m["available"], m["ledger_net"], m["delta"]])
+                raise_alert(
+                    "high", "ledger_mismatch",
+                    f"balance {m['available']} != ledger {m['ledger_net']} for {m['client_id']} {m['currency']}",
+                    m,
+                )
+            f.flush()
+            state["done"].append(futures[fut])
+            state["mismatches"] += len(mismatches)
+            _save_state(state)
+    state["finished_at"] = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    _save_state(state)
+    audit("integrity_check", state["started_at"],
+          {"report": state["report"], "ranges": len(state["ranges"]), "mismatches": state["mismatches"]})
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ledger vs balances integrity check")
+    sub = parser.add_subparsers(dest="cmd")
+    pr = sub.add_parser("run")
+    pr.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    pr.add_argument("--range-size", type=int, default=1000, help="clients per range")
+    pr.add_argument("--fresh", action="store_true", help="start over instead of resuming")
+    sub.add_parser("status")
+    args = parser.parse_args()
+    if args.cmd == "run":
+        state = run(args.workers, args.range_size, args.fresh)
+        print(f"{state['report']}  ranges={len(state['ranges'])} mismatches={state['mismatches']}")
+    elif args.cmd == "status":
+        state = _load_state()
+        if state is None:
+            print("no integrity run recorded")
+        else:
+            summary = dict(state, ranges=len(state["ranges"]), done=len(state["done"]))
+            print(json.dumps(summary, indent=2))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
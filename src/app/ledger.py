@@ -1,28 +1,33 @@
 import json
-import uuid
-from typing import Dict
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from .audit import append as audit
-from .db import db, now_iso
+from .db import db, in_transaction, now_iso, transactional
+from .idempotency import store as idempotency
+from .ids import new_id
 
 
 def _record_id(kind: str) -> str:
-    return f"{kind}_{uuid.uuid4()}"
+    return new_id(kind)
 
 
+@transactional
 def record_deposit(event: Dict) -> str:
     # event: {id, type, created_at, data:{client_id, amount, currency}}
     evt_id = event["id"]
     with db() as conn:
         c = conn.cursor()
-        # idempotency
-        c.execute("SELECT event_id FROM idempotency WHERE event_id=?", (evt_id,))
-        if c.fetchone():
+        # idempotency: the front filter skips the probe for definitely-new events,
+        # and claiming the key first makes a concurrent duplicate a no-op
+        if idempotency.seen(conn, evt_id):
             return evt_id
         client_id = event["data"]["client_id"]
         amount = int(event["data"]["amount"])
         currency = event["data"]["currency"]
         now = now_iso()
+        if not idempotency.claim(conn, evt_id, event["type"], now):
+            return evt_id
         tx_id = _record_id("tx")
         c.execute(
             "INSERT INTO transactions(id, client_id, type, status, amount, currency, created_at, updated_at, metadata)"
@@ -51,10 +56,104 @@ def record_deposit(event: Dict) -> str:
             " ON CONFLICT(client_id, currency) DO UPDATE SET available = available + excluded.available",
             (client_id, currency, amount),
         )
-        c.execute(
-            "INSERT INTO idempotency(event_id, kind, processed_at) VALUES(?,?,?)",
-            (evt_id, event["type"], now),
-        )
-    audit("deposit", client_id, {"evt": evt_id, "amount": amount, "currency": currency})
+        audit("deposit", client_id, {"evt": evt_id, "amount": amount, "currency": currency})
     return tx_id
 
+
+def record_deposits(events: Sequence[Dict]) -> List[str]:
+    """Apply a batch of deposit events in one transaction.
+
+    Returns one result per input event, matching ``record_deposit``: the new
+    tx id, or the event id for an event that was already processed (or
+    appears earlier in the same batch). Balance upserts are aggregated per
+    (client, currency), and each client gets one grouped audit record
+    (entity = client id) carrying the shared batch id.
+    """
+    if not events:
+        return []
+    attempts = 1 if in_transaction() else 3
+    for attempt in range(attempts):
+        try:
+            return _record_deposits(events)
+        except sqlite3.IntegrityError:
+            # another writer claimed one of the keys after our probe; the retry sees it
+            if attempt == attempts - 1:
+                raise
+    return []
+
+
+def _record_deposits(events: Sequence[Dict]) -> List[str]:
+    results: List[str] = [e["id"] for e in events]
+    with db() as conn:
+        first: Dict[str, int] = {}
+        for i, e in enumerate(events):
+            first.setdefault(e["id"], i)
+        known = idempotency.seen_many(conn, list(first))
+        now = now_iso()
+        tx_rows: List[Tuple] = []
+        le_rows: List[Tuple] = []
+        claims: List[Tuple[str, str, str]] = []
+        totals: Dict[Tuple[str, str], int] = {}
+        audited: Dict[str, List[Dict]] = {}
+        for evt_id, i in first.items():
+            if evt_id in known:
+                continue
+            event = events[i]
+            client_id = event["data"]["client_id"]
+            amount = int(event["data"]["amount"])
+            currency = event["data"]["currency"]
+            tx_id = _record_id("tx")
+            tx_rows.append(
+                (tx_id, client_id, "deposit", "completed", amount, currency, now, now, json.dumps({"evt": evt_id}))
+            )
+            le_rows.append((_record_id("le"), tx_id, client_id, "credit", amount, currency, now))
+            claims.append((evt_id, event["type"], now))
+            totals[(client_id, currency)] = totals.get((client_id, currency), 0) + amount
+            audited.setdefault(client_id, []).append({"evt": evt_id, "amount": amount, "currency": currency})
+            results[i] = tx_id
+        if not claims:
+            return results
+        idempotency.claim_many(conn, claims)
+        c = conn.cursor()
+        c.executemany(
+            "INSERT INTO transactions(id, client_id, type, status, amount, currency, created_at, updated_at, metadata)"
+            " VALUES(?,?,?,?,?,?,?,?,?)",
+            tx_rows,
+        )
+        c.executemany(
+            "INSERT INTO ledger_entries(id, tx_id, client_id, direction, amount, currency, created_at)"
+            " VALUES(?,?,?,?,?,?,?)",
+            le_rows,
+        )
+        c.executemany(
+            "INSERT INTO balances(client_id, currency, available) VALUES(?,?,?)"
+            " ON CONFLICT(client_id, currency) DO UPDATE SET available = available + excluded.available",
+            [(client, currency, amount) for (client, currency), amount in totals.items()],
+        )
+        # one record per client, so per-client audit lookups find batch deposits too
+        batch_id = _record_id("batch")
+        for client_id, deposits in audited.items():
+            audit("deposit_batch", client_id, {"batch": batch_id, "count": len(deposits), "deposits": deposits})
+    return results
+
+
+def transaction_history(client_id: Optional[str] = None, since: Optional[str] = None,
+                        limit: int = 100) -> List[Dict]:
+    """Newest ``limit`` transactions, hot and archived, optionally for one client and from ``since`` on."""
+    from .archive import history_windows
+
+    clauses: List[str] = ["1"]
+    params: list = []
+    if client_id:
+        clauses.append("client_id = ?")
+        params.append(client_id)
+    if since:
+        clauses.append("created_at >= ?")
+        params.append(since)
+    sql = (f"SELECT * FROM all_transactions WHERE {' AND '.join(clauses)}"
+           " ORDER BY created_at DESC, id DESC LIMIT ?")
+    rows: List[Dict] = []
+    for h in history_windows(since_month=since[:7] if since else None):
+        rows += [dict(r) for r in h.execute(sql, params + [limit])]
+    rows.sort(key=lambda r: (r["created_at"], r["id"]), reverse=True)
+    return rows[:limit]
@@ -30,7 +30,7 @@ class MCPSerenaClient:
         request = urllib.request.Request(url, data=req_data, headers=headers, method=method)
 
         try:
-            with urllib.request.urlopen(request) as response:
+            with urllib.request.urlopen(request, timeout=10) as response:
                 return json.loads(response.read().decode())
         except urllib.error.HTTPError as e:
             log_event("mcp_serena_error", "system", {
@@ -78,10 +78,9 @@ mcp_client = MCPSerenaClient()
 
 def integrate_with_escrow_flow(request_id: str, action: str, metadata: Dict[str, Any]) -> bool:
     """Integrate MCP Serena with escrow flow"""
-    with db() as conn:
+    # Get request details; no transaction stays open across the HTTP calls below
+    with db(readonly=True) as conn:
         c = conn.cursor()
-
-        # Get request details
         c.execute("""
             SELECT r.*, c.wallet_id, c.name as client_name
             FROM release_requests r
@@ -90,65 +89,63 @@ def integrate_with_escrow_flow(request_id: str, action: str, metadata: Dict[str,
         """, (request_id,))
         request = c.fetchone()
 
-        if not request:
-            return False
-
-        try:
-            # Perform compliance check for large transactions
-            if action == "release_request" and request["amount_usdt"] >= 10000:
-                compliance = mcp_client.get_compliance_check(
-                    request["client_id"],
-                    request["amount_usdt"],
-                    "USDT"
-                )
-                if not compliance.get("approved", False):
-                    log_event("compliance_failed", {
-                        "request_id": request_id,
-                        "reason": compliance.get("reason", "Unknown")
-                    })
-                    return False
-
-            # Notify about transaction
-            transaction_data = {
-                "request_id": request_id,
-                "action": action,
-                "client_id": request["client_id"],
-                "client_name": request["client_name"],
-                "wallet_id": request["wallet_id"],
-                "amount": request["amount_usdt"],
-                "currency": "USDT",
-                "chain": request["chain"],
-                "address": request["address"],
-                "status": request["status"],
-                "metadata": metadata,
-                "timestamp": now_iso()
-            }
-
-            result = mcp_client.notify_transaction(transaction_data)
+    if not request:
+        return False
+
+    try:
+        # Perform compliance check for large transactions
+        if action == "release_request" and request["amount_usdt"] >= 10000:
+            compliance = mcp_client.get_compliance_check(
+                request["client_id"],
+                request["amount_usdt"],
+                "USDT"
+            )
+            if not compliance.get("approved", False):
+                log_event("compliance_failed", request_id, {
+                    "reason": compliance.get("reason", "Unknown")
+                })
+                return False
+
+        # Notify about transaction
+        transaction_data = {
+            "request_id": request_id,
+            "action": action,
+            "client_id": request["client_id"],
+            "client_name": request["client_name"],
+            "wallet_id": request["wallet_id"],
+            "amount": request["amount_usdt"],
+            "currency": "USDT",
+            "chain": request["chain"],
+            "address": request["address"],
+            "status": request["status"],
+            "metadata": metadata,
+            "timestamp": now_iso()
+        }
 
-            # Log integration event
-            log_event("mcp_integration", request_id, {
-                "action": action,
-                "result": result,
-                "timestamp": now_iso()
-            })
+        result = mcp_client.notify_transaction(transaction_data)
 
-            # Store integration record
-            c.execute("""
+        # Store integration record and log the event together
+        with db() as conn:
+            conn.execute("""
                 INSERT INTO mcp_integrations (
                     request_id, action, response, created_at
                 ) VALUES (?, ?, ?, ?)
             """, (request_id, action, json.dumps(result), now_iso()))
-
-            return True
-
-        except Exception as e:
-            log_event("mcp_integration_error", request_id, {
+            log_event("mcp_integration", request_id, {
                 "action": action,
-                "error": str(e),
+                "result": result,
                 "timestamp": now_iso()
             })
-            return False
+
+        return True
+
+    except Exception as e:
+        log_event("mcp_integration_error", request_id, {
+            "action": action,
+            "error": str(e),
+            "timestamp": now_iso()
+        })
+        return False
 
 def setup_mcp_webhooks():
     """Setup MCP Serena webhooks for escrow events"""
@@ -168,25 +165,29 @@ def setup_mcp_webhooks():
         except Exception as e:
             print(f"Failed to register webhook for {event_type}: {e}")
 
+_BALANCES_SQL = """
+    SELECT c.id, c.wallet_id,
+           COALESCE(SUM(l.amount), 0) as balance
+    FROM clients c
+    LEFT JOIN ledger_entries l ON c.id = l.client_id
+    WHERE l.currency = 'JPY'
+    GROUP BY c.id, c.wallet_id
+"""
+
+
 def sync_all_balances():
     """Sync all client balances with MCP Serena"""
-    with db() as conn:
+    with db(readonly=True) as conn:
         c = conn.cursor()
-        c.execute("""
-            SELECT c.id, c.wallet_id,
-                   COALESCE(SUM(l.amount), 0) as balance
-            FROM clients c
-            LEFT JOIN ledger_entries l ON c.id = l.client_id
-            WHERE l.currency = 'JPY'
-            GROUP BY c.id, c.wallet_id
-        """)
-
-        for row in c.fetchall():
-            try:
-                mcp_client.sync_balance(
-                    row["wallet_id"],
-                    row["balance"],
-                    "JPY"
-                )
-            except Exception as e:
-                print(f"Failed to sync balance for {row['id']}: {e}")
\ No newline at end of file
+        c.execute(_BALANCES_SQL)
+        rows = c.fetchall()
+
+    for row in rows:
+        try:
+            mcp_client.sync_balance(
+                row["wallet_id"],
+                row["balance"],
+                "JPY"
+            )
+        except Exception as e:
+            print(f"Failed to sync balance for {row['id']}: {e}")
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""Merkle checkpoints over the audit log.
+
+Every ``AUDIT_MERKLE_EVERY`` records the audit writer appends a
+``merkle_checkpoint`` record whose ``data`` holds the Merkle root (RFC 6962
+hashing: leaves are ``SHA-256(0x00 || record hash)``, nodes
+``SHA-256(0x01 || left || right)``) of the ``size`` records before it, and
+the hash of the previous checkpoint. Checkpoints themselves are not leaves;
+records written before checkpoints existed are covered by the chain only.
+
+``prove`` returns an inclusion proof for one record: its position in the
+window, the audit path (O(log n) sibling hashes) and the checkpoint it is
+committed to; ``verify_proof`` checks one without reading the log.
+``verify_since`` re-hashes only what was written after a trusted
+checkpoint, and the CLI keeps the last trusted checkpoint in
+``<audit log>.trusted``.
+
+    python -m src.app.merkle prove --entity req_... --hash <record hash>
+    python -m src.app.merkle verify [--full]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+CHECKPOINT_KIND = "merkle_checkpoint"
+CHECKPOINT_ENTITY = "merkle"
+# upper bound on a checkpoint's window, so readers never hold more hashes than this
+MAX_WINDOW = 1 << 16
+
+
+def _leaf(record_hash: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(record_hash)).digest()
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def _split(n: int) -> int:
+    # largest power of two strictly below n
+    k = 1
+    while k << 1 < n:
+        k <<= 1
+    return k
+
+
+def _mth(leaves: Sequence[bytes]) -> bytes:
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    if len(leaves) == 1:
+        return leaves[0]
+    k = _split(len(leaves))
+    return _node(_mth(leaves[:k]), _mth(leaves[k:]))
+
+
+def merkle_root(record_hashes: Sequence[str]) -> str:
+    return _mth([_leaf(h) for h in record_hashes]).hex()
+
+
+def _path(m: int, leaves: Sequence[bytes]) -> List[bytes]:
+    if len(leaves) <= 1:
+        return []
+    k = _split(len(leaves))
+    if m < k:
+        return _path(m, leaves[:k]) + [_mth(leaves[k:])]
+    return _path(m - k, leaves[k:]) + [_mth(leaves[:k])]
+
+
+def audit_path(index: int, record_hashes: Sequence[str]) -> List[str]:
+    return [p.hex() for p in _path(index, [_leaf(h) for h in record_hashes])]
+
+
+def verify_proof(record_hash: str, index: int, size: int, path: Sequence[str], root: str) -> bool:
+    """RFC 9162 inclusion check of ``record_hash`` at ``index`` in a tree of ``size`` leaves."""
+    if index >= size:
+        return False
+    fn, sn = index, size - 1
+    r = _leaf(record_hash)
+    for p in path:
+        p = bytes.fromhex(p)
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = _node(p, r)
+            if not fn & 1:
+                while not fn & 1 and fn != 0:
+                    fn >>= 1
+                    sn >>= 1
+        else:
+            r = _node(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r.hex() == root
+
+
+def _records_after(location: Optional[Tuple[str, int]], path: Optional[str] = None) -> Iterator[Tuple[str, int, Dict]]:
+    """(file, offset, record) for every record after ``location`` (from the start if None)."""
+    from . import audit
+
+    files = audit.segments(path) + [path or audit.AUDIT_PATH]
+    # a segment may have been compressed (renamed) since ``location`` was found; its index path is stable
+    keys = [audit.index_path(f) for f in files]
+    if location is not None:
+        location = (audit.index_path(location[0]), location[1])
+        files = files[keys.index(location[0]):]
+    for f in files:
+        start = location[1] if location is not None and audit.index_path(f) == location[0] else 0
+        for offset, line in audit.iter_lines(f, start):
+            if not line.endswith(b"\n"):
+                break
+            if location is not None and (audit.index_path(f), offset) == location:
+                continue
+            yield f, offset, json.loads(line)
+
+
+def _checkpoint_location(checkpoint_hash: str, path: Optional[str] = None) -> Tuple[str, int, Dict]:
+    from . import audit
+
+    for f, offset, rec in audit.locate(CHECKPOINT_ENTITY, CHECKPOINT_KIND, path):
+        if rec["hash"] == checkpoint_hash:
+            return f, offset, rec
+    raise KeyError(f"checkpoint {checkpoint_hash} not found")
+
+
+def prove(record_hash: str, entity_id: str, path: Optional[str] = None) -> Dict:
+    """Inclusion proof of a record (found through its entity index) in its checkpoint window."""
+    from . import audit
+
+    location = None
+    for f, offset, rec in audit.locate(entity_id, None, path):
+        if rec["hash"] == record_hash:
+            location = (f, offset)
+            break
+    if location is None:
+        raise KeyError(f"record {record_hash} not found for entity {entity_id}")
+    order = {audit.index_path(f): n for n, f in enumerate(audit.segments(path) + [path or audit.AUDIT_PATH])}
+    # read from the last checkpoint before the record up to the first one after it
+    previous = None
+    for f, offset, rec in audit.locate(CHECKPOINT_ENTITY, CHECKPOINT_KIND, path):
+        if (order[audit.index_path(f)], offset) >= (order[audit.index_path(location[0])], location[1]):
+            break
+        previous = (f, offset)
+    window: deque = deque(maxlen=MAX_WINDOW)
+    for _, _, rec in _records_after(previous, path):
+        if rec["kind"] == CHECKPOINT_KIND:
+            window = list(window)[-rec["data"]["size"]:]
+            if record_hash not in window:
+                raise ValueError("record predates Merkle checkpoints")
+            index = window.index(record_hash)
+            if merkle_root(window) != rec["data"]["root"]:
+                raise ValueError(f"checkpoint {rec['hash']} does not match its records")
+            return {
+                "record": record_hash,
+                "index": index,
+                "size": len(window),
+                "path": audit_path(index, window),
+                "root": rec["data"]["root"],
+                "checkpoint": rec["hash"],
+            }
+        window.append(rec["hash"])
+    raise ValueError("record is not covered by a checkpoint yet")
+
+
+def verify_since(trusted: Optional[str] = None, path: Optional[str] = None) -> Dict:
+    """Re-hash the chain after checkpoint ``trusted`` (all of it if None) and check every later root."""
+    location = None
+    prev = None
+    if trusted is not None:
+        f, offset, _ = _checkpoint_location(trusted, path)
+        location, prev = (f, offset), trusted
+    report: Dict = {"from": trusted, "records": 0, "checkpoints": 0, "ok": True,
+                    "first_break": None, "trusted": trusted}
+    window: deque = deque(maxlen=MAX_WINDOW)
+    last_checkpoint = trusted
+    for f, offset, rec in _records_after(location, path):
+        claimed = rec.pop("hash")
+        if hashlib.sha256(json.dumps(rec, sort_keys=True).encode("utf-8")).hexdigest() != claimed:
+            report["first_break"] = {"path": f, "offset": offset, "reason": "hash mismatch"}
+        elif rec["prev"] != prev:
+            report["first_break"] = {"path": f, "offset": offset, "reason": "prev link broken"}
+        elif rec["kind"] == CHECKPOINT_KIND:
+            data = rec["data"]
+            if data["prev_checkpoint"] != last_checkpoint:
+                report["first_break"] = {"path": f, "offset": offset, "reason": "checkpoint link broken"}
+            elif len(window) < data["size"] or merkle_root(list(window)[-data["size"]:]) != data["root"]:
+                report["first_break"] = {"path": f, "offset": offset, "reason": "merkle root mismatch"}
+            else:
+                report["checkpoints"] += 1
+                report["trusted"] = last_checkpoint = claimed
+                window.clear()
+        else:
+            window.append(claimed)
+        if report["first_break"]:
+            report["ok"] = False
+            break
+        report["records"] += 1
+        prev = claimed
+    return report
+
+
+def _trusted_path(path: Optional[str] = None) -> str:
+    from . import audit
+
+    return (path or audit.AUDIT_PATH) + ".trusted"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merkle checkpoints over the audit log")
+    sub = parser.add_subparsers(dest="cmd")
+    pp = sub.add_parser("prove")
+    pp.add_argument("--entity", required=True)
+    pp.add_argument("--hash", required=True)
+    pv = sub.add_parser("verify", help="verify from the last trusted checkpoint")
+    pv.add_argument("--full", action="store_true", help="ignore the trusted checkpoint")
+    args = parser.parse_args()
+    if args.cmd == "prove":
+        proof = prove(args.hash, args.entity)
+        proof["valid"] = verify_proof(proof["record"], proof["index"], proof["size"], proof["path"], proof["root"])
+        print(json.dumps(proof, indent=2))
+    elif args.cmd == "verify":
+        state = _trusted_path()
+        trusted = None
+        if not args.full and os.path.exists(state):
+            with open(state, encoding="utf-8") as f:
+                trusted = json.load(f)["checkpoint"]
+        report = verify_since(trusted)
+        if report["ok"] and report["trusted"]:
+            with open(state, "w", encoding="utf-8") as f:
+                json.dump({"checkpoint": report["trusted"]}, f)
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0 if report["ok"] else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
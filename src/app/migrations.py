@@ -0,0 +1,388 @@
+"""Versioned schema migrations applied on top of ``init_db``'s base tables.
+
+Each migration is an ordered list of statements that must be safe on a live
+database: ``CREATE INDEX IF NOT EXISTS`` and ``ALTER TABLE ... ADD COLUMN``
+(through ``add_column``), never a table rebuild. Applied versions are
+recorded in ``schema_version``.
+"""
+
+import argparse
+import re
+import sqlite3
+import sys
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+from . import approvals, checkpoints, dashboard, export, inbox, mcp_integration, outbox, web_server
+from .db import db, now_iso
+
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+def add_column(table: str, column: str, decl: str) -> Callable[[sqlite3.Connection], None]:
+    """Migration step adding ``column`` to ``table`` unless it already exists."""
+
+    def step(conn: sqlite3.Connection) -> None:
+        cols = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in cols:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    return step
+
+
+MIGRATIONS: List[Tuple[int, str, Sequence[Step]]] = [
+    (
+        1,
+        "hot-path indexes",
+        [
+            # webhook_receiver payout.sent: UPDATE payouts ... WHERE request_id=?
+            "CREATE INDEX IF NOT EXISTS idx_payouts_request_id ON payouts(request_id)",
+            # /api/pending_deposits: WHERE status=? ORDER BY created_at DESC
+            "CREATE INDEX IF NOT EXISTS idx_bank_deposits_status_created ON bank_deposits(status, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_bank_deposits_created ON bank_deposits(created_at)",
+            # dashboard: ORDER BY created_at DESC LIMIT 50
+            "CREATE INDEX IF NOT EXISTS idx_release_requests_created ON release_requests(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_payouts_created ON payouts(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_alerts_created ON alerts(created_at)",
+            # sync_all_balances: ledger_entries joined on client_id, filtered by currency;
+            # carrying amount makes the per-client SUM index-only
+            "CREATE INDEX IF NOT EXISTS idx_ledger_entries_currency_client ON ledger_entries(currency, client_id, amount)",
+        ],
+    ),
+    (
+        2,
+        "idempotency TTL pruning index",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_idempotency_processed_at ON idempotency(processed_at)",
+        ],
+    ),
+    (
+        3,
+        "balance checkpoints",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS balance_checkpoints (
+                client_id TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                as_of TEXT NOT NULL,
+                balance INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (client_id, currency, as_of)
+            )
+            """,
+            # balance_at: entries of one client/currency after a checkpoint, index-only
+            "CREATE INDEX IF NOT EXISTS idx_ledger_entries_client_currency_created"
+            " ON ledger_entries(client_id, currency, created_at, direction, amount)",
+        ],
+    ),
+    (
+        4,
+        "export keyset indexes",
+        [
+            # export.py pages on (created_at, id); without these every page re-sorts the table
+            "CREATE INDEX IF NOT EXISTS idx_ledger_entries_created_id ON ledger_entries(created_at, id)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_created_id ON transactions(created_at, id)",
+        ],
+    ),
+    (
+        5,
+        "webhook inbox",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS webhook_inbox (
+                seq INTEGER PRIMARY KEY,
+                event_id TEXT,
+                type TEXT,
+                body TEXT NOT NULL,
+                received_at TEXT NOT NULL,
+                processed_at TEXT,
+                error TEXT
+            )
+            """,
+            # the drain reads only pending rows, in arrival order
+            "CREATE INDEX IF NOT EXISTS idx_webhook_inbox_pending ON webhook_inbox(seq) WHERE processed_at IS NULL",
+            "CREATE INDEX IF NOT EXISTS idx_webhook_inbox_processed_at ON webhook_inbox(processed_at)",
+        ],
+    ),
+    (
+        6,
+        "cache version counters",
+        [
+            # bumped with every whitelist write so other processes drop their cached copy
+            """
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO cache_versions(name, version) VALUES('addresses', 0)",
+        ],
+    ),
+    (
+        7,
+        "pending approvals keyset index",
+        [
+            # /api/pending_approvals: WHERE status='pending' ORDER BY created_at DESC, id DESC, keyset pages
+            "CREATE INDEX IF NOT EXISTS idx_release_requests_status_created"
+            " ON release_requests(status, created_at, id)",
+        ],
+    ),
+    (
+        8,
+        "payout outbox",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL,
+                claimed_until TEXT,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                dispatched_at TEXT
+            )
+            """,
+            # workers claim only pending rows, earliest due first
+            "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(next_attempt_at) WHERE status='pending'",
+        ],
+    ),
+    (
+        9,
+        "audit intents",
+        [
+            # audit records committed with the data they describe, until appended to the log
+            """
+            CREATE TABLE IF NOT EXISTS audit_intents (
+                seq INTEGER PRIMARY KEY,
+                txn TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_audit_intents_txn ON audit_intents(txn)",
+        ],
+    ),
+    (
+        10,
+        "latest checkpoint index",
+        [
+            # checkpoints.write_due: MAX(as_of) over every (client, currency)
+            "CREATE INDEX IF NOT EXISTS idx_balance_checkpoints_as_of ON balance_checkpoints(as_of)",
+        ],
+    ),
+]
+
+
+# (name, sql, params, tables allowed to be scanned in full); the SQL is the modules' own
+HOT_QUERIES: List[Tuple[str, str, tuple, Tuple[str, ...]]] = [
+    (
+        "webhook payout.sent",
+        inbox._PAYOUT_SENT_SQL,
+        ("h", "req"),
+        (),
+    ),
+    (
+        "api pending_deposits",
+        web_server._PENDING_DEPOSITS_SQL,
+        (),
+        (),
+    ),
+    (
+        "api bank_deposits",
+        web_server._BANK_DEPOSITS_SQL,
+        (),
+        (),
+    ),
+    (
+        "dashboard release_requests",
+        dashboard._RELEASES_SQL,
+        (),
+        (),
+    ),
+    (
+        "dashboard payouts",
+        dashboard._PAYOUTS_SQL,
+        (),
+        (),
+    ),
+    (
+        "dashboard alerts",
+        dashboard._ALERTS_SQL,
+        (),
+        (),
+    ),
+    (
+        "sync_all_balances",
+        mcp_integration._BALANCES_SQL,
+        (),
+        # every client is visited once; the ledger side must be a SEARCH
+        ("clients",),
+    ),
+    (
+        "balance_at delta",
+        checkpoints._DELTA_SQL.format(table="ledger_entries", after=" AND created_at > ?"),
+        ("A", "JPY", "2025-01-01", "2025-02-01"),
+        (),
+    ),
+    (
+        "checkpoint due: latest",
+        checkpoints._LATEST_SQL,
+        (),
+        (),
+    ),
+    (
+        "checkpoint due: entries since",
+        checkpoints._ENTRIES_SINCE_SQL,
+        ("2025-01-01", 100000),
+        # the LIMIT subquery; ledger_entries itself must be a SEARCH
+        ("(subquery-1)",),
+    ),
+    (
+        "export ledger_entries page",
+        export._page_sql("main", "ledger_entries", ["(created_at, id) > (?, ?)"]),
+        ("2025-01-01", "le", 5000),
+        (),
+    ),
+    (
+        "export transactions page",
+        export._page_sql("main", "transactions", ["(created_at, id) > (?, ?)"]),
+        ("2025-01-01", "tx", 5000),
+        (),
+    ),
+    (
+        "approve count",
+        approvals._COUNT_SQL,
+        ("2025-01-01", "req", "req"),
+        # n is the one-row COUNT subquery; release_approvals itself must be a SEARCH
+        ("n",),
+    ),
+    (
+        "api pending_approvals page",
+        approvals._PENDING_SQL.format(after=" AND (r.created_at, r.id) < (?, ?)"),
+        ("2025-01-01", "req", 200),
+        (),
+    ),
+    (
+        "outbox claim",
+        outbox._CLAIM_SQL,
+        ("2025-01-01", "2025-01-01", "2025-01-01"),
+        (),
+    ),
+    (
+        "inbox drain",
+        inbox._DRAIN_SQL,
+        (500,),
+        (),
+    ),
+]
+
+
+def _ensure_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        );
+        """
+    )
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    _ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) AS v FROM schema_version").fetchone()
+    return int(row["v"] or 0)
+
+
+def migrate(path: Optional[str] = None) -> List[int]:
+    """Apply pending migrations in order, each in its own transaction."""
+    applied: List[int] = []
+    with db(path) as conn:
+        version = current_version(conn)
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        with db(path) as conn:
+            # the version read above may be stale: another process can have applied it since
+            if conn.execute("SELECT 1 FROM schema_version WHERE version=?", (number,)).fetchone():
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version(version, description, applied_at) VALUES(?,?,?)",
+                (number, description, now_iso()),
+            )
+        applied.append(number)
+    return applied
+
+
+_FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+def _table_aliases(sql: str) -> dict:
+    aliases = {}
+    for table, alias in re.findall(r"(?:FROM|JOIN|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.I):
+        aliases[table] = table
+        if alias and alias.upper() not in ("SET", "WHERE", "LEFT", "JOIN", "ON", "ORDER", "GROUP", "INNER", "LIMIT"):
+            aliases[alias] = table
+    return aliases
+
+
+def check_query_plans() -> List[Tuple[str, str]]:
+    """Return (query name, plan detail) for every hot query that does a full scan.
+
+    A temp B-tree for ORDER BY also counts, since it means the sort is not
+    served by an index.
+    """
+    problems: List[Tuple[str, str]] = []
+    with db(readonly=True) as conn:
+        for name, sql, params, allowed in HOT_QUERIES:
+            aliases = _table_aliases(sql)
+            for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+                detail = row["detail"]
+                m = _FULL_SCAN.match(detail)
+                if m and aliases.get(m.group(1), m.group(1)) not in allowed:
+                    problems.append((name, detail))
+                elif "TEMP B-TREE FOR ORDER BY" in detail:
+                    problems.append((name, detail))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    sub = parser.add_subparsers(dest="cmd")
+    sub.add_parser("migrate")
+    sub.add_parser("status")
+    sub.add_parser("check", help="fail if a hot query does a full table scan")
+    args = parser.parse_args()
+    if args.cmd == "migrate":
+        applied = migrate()
+        print(f"applied: {applied}" if applied else "up to date")
+    elif args.cmd == "status":
+        with db(readonly=True) as conn:
+            version = current_version(conn)
+        latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+        print(f"schema_version={version} latest={latest}")
+    elif args.cmd == "check":
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f"FULL SCAN: {name}: {detail}")
+        if problems:
+            sys.exit(1)
+        print("ok")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
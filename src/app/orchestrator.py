@@ -1,10 +1,10 @@
 import math
-import uuid
 from datetime import datetime, timedelta
 from typing import Tuple
 
 from .audit import append as audit
 from .config import (
+    MCP_SERENA_HOST,
     SIM_FX_JPY_PER_USDT,
     SIM_NETWORK_FEE_USDT,
     RAPYD_EWALLET_ID,
@@ -14,9 +14,9 @@ from .config import (
     RAPYD_SENDER_NAME,
     RAPYD_SENDER_COUNTRY,
 )
-from .rapyd_client import rapyd_request
-from .db import db, now_iso
-from .mcp_integration import integrate_with_escrow_flow
+from .db import db, now_iso, transactional
+from .ids import new_id
+from .outbox import enqueue
 
 
 def quote_jpy_to_usdt(amount_usdt: float, max_slippage_bps: int) -> Tuple[float, str]:
@@ -36,15 +36,16 @@ def attach_quote(request_id: str, rate_jpy_per_usdt: float, expires_at: str) ->
             "UPDATE release_requests SET quote_rate=?, quote_expires_at=?, updated_at=? WHERE id=?",
             (rate_jpy_per_usdt, expires_at, now_iso(), request_id),
         )
-    audit("quote_attached", request_id, {"rate_jpy_per_usdt": rate_jpy_per_usdt, "expires": expires_at})
+        audit("quote_attached", request_id, {"rate_jpy_per_usdt": rate_jpy_per_usdt, "expires": expires_at})
 
 
+@transactional
 def execute_payout(request_id: str) -> str:
     now = now_iso()
     with db() as conn:
         c = conn.cursor()
         c.execute(
-            "SELECT client_id, amount_usdt, chain, status, quote_rate, max_slippage_bps FROM release_requests WHERE id=?",
+            "SELECT client_id, amount_usdt, chain, address, status, quote_rate, max_slippage_bps FROM release_requests WHERE id=?",
             (request_id,),
         )
         req = c.fetchone()
@@ -68,7 +69,7 @@ def execute_payout(request_id: str) -> str:
         if available < jpy_required:
             raise ValueError("insufficient JPY balance for payout")
         # Deduct internal balance (escrow release)
-        tx_id = f"tx_{uuid.uuid4()}"
+        tx_id = new_id("tx")
         c.execute(
             "INSERT INTO transactions(id, client_id, type, status, amount, currency, created_at, updated_at, metadata)"
             " VALUES(?,?,?,?,?,?,?,?,?)",
@@ -84,7 +85,7 @@ def execute_payout(request_id: str) -> str:
                 None,
             ),
         )
-        le_id = f"le_{uuid.uuid4()}"
+        le_id = new_id("le")
         c.execute(
             "INSERT INTO ledger_entries(id, tx_id, client_id, direction, amount, currency, created_at) VALUES(?,?,?,?,?,?,?)",
             (le_id, tx_id, client_id, "debit", jpy_required, "JPY", now),
@@ -99,7 +100,7 @@ def execute_payout(request_id: str) -> str:
             (jpy_required,),
         )
         # Create payout record (USDT network fee applied later in event)
-        payout_id = f"po_{uuid.uuid4()}"
+        payout_id = new_id("po")
         c.execute(
             "INSERT INTO payouts(id, request_id, status, chain, created_at, updated_at) VALUES(?,?,?,?,?,?)",
             (payout_id, request_id, "sent", req["chain"], now, now),
@@ -109,12 +110,10 @@ def execute_payout(request_id: str) -> str:
             "UPDATE release_requests SET status='completed', updated_at=? WHERE id=?",
             (now, request_id),
         )
-    # Optional: attempt real Rapyd payout if env is configured
-    try:
+        # Side effects go out through the outbox once this commits (see outbox.py)
         if RAPYD_EWALLET_ID and RAPYD_PAYOUT_METHOD_TYPE:
             # Mapping chain to blockchain tag used by Rapyd (confirm values with AM)
-            blockchain = (req["chain"] or "").lower()
-            body = {
+            enqueue(conn, "rapyd_payout", request_id, {
                 "ewallet": RAPYD_EWALLET_ID,
                 "payout_method_type": RAPYD_PAYOUT_METHOD_TYPE,
                 "amount": amount_usdt,
@@ -123,34 +122,25 @@ def execute_payout(request_id: str) -> str:
                 "beneficiary": {
                     "name": RAPYD_BENEFICIARY_NAME,
                     "country": RAPYD_BENEFICIARY_COUNTRY,
-                    "crypto_address": "",  # set in caller if known
-                    "blockchain": blockchain,
+                    "crypto_address": req["address"],
+                    "blockchain": (req["chain"] or "").lower(),
                 },
                 "sender": {
                     "name": RAPYD_SENDER_NAME,
                     "country": RAPYD_SENDER_COUNTRY,
                 },
-            }
-            # Address must be pulled from release request
-            with db() as conn:
-                c = conn.cursor()
-                c.execute("SELECT address FROM release_requests WHERE id=?", (request_id,))
-                row = c.fetchone()
-                if row:
-                    body["beneficiary"]["crypto_address"] = row["address"]
-            status, resp = rapyd_request("POST", "/v1/payouts", body)
-            audit("rapyd_payout_api", request_id, {"status": status, "resp": resp})
-    except Exception as e:
-        audit("rapyd_payout_api_error", request_id, {"error": str(e)})
-
-    # Integrate with MCP Serena
-    integrate_with_escrow_flow(request_id, "payout_completed", {
-        "payout_id": payout_id,
-        "jpy": jpy_required,
-        "usdt": amount_usdt,
-        "rate": rate,
-        "chain": req["chain"]
-    })
-
-    audit("payout_executed", request_id, {"payout_id": payout_id, "jpy": jpy_required, "usdt": amount_usdt, "rate": rate})
+            })
+        # Integrate with MCP Serena
+        if MCP_SERENA_HOST:
+            enqueue(conn, "mcp_notify", request_id, {
+                "action": "payout_completed",
+                "metadata": {
+                    "payout_id": payout_id,
+                    "jpy": jpy_required,
+                    "usdt": amount_usdt,
+                    "rate": rate,
+                    "chain": req["chain"],
+                },
+            })
+        audit("payout_executed", request_id, {"payout_id": payout_id, "jpy": jpy_required, "usdt": amount_usdt, "rate": rate})
     return payout_id
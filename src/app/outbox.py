@@ -0,0 +1,237 @@
+"""Transactional outbox for payout side effects.
+
+``execute_payout`` writes the ledger debit and the payout row together with
+one ``outbox`` row per side effect, in the same transaction: the Rapyd
+payout call (``rapyd_payout``, only when Rapyd is configured) and the MCP
+notification (``mcp_notify``). The request returns once that commits. A pool
+of worker threads then dispatches the rows.
+
+A worker claims one due row at a time with a single ``UPDATE ... RETURNING``
+and holds it for ``OUTBOX_LEASE_S``. Claims from another process, or from a
+worker that died, expire and are taken again. The row id is sent as the
+idempotency key (Rapyd ``idempotency`` header, MCP ``metadata``), so a
+retried call is not applied twice downstream. A failed call is retried with
+exponential backoff. After ``OUTBOX_MAX_ATTEMPTS`` tries, or on a 4xx from
+Rapyd, the row is marked dead with its error and an alert is raised.
+
+    python -m src.app.outbox dispatch [--once]
+    python -m src.app.outbox stats
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from .alerts import raise_alert
+from .audit import append as audit
+from .config import (
+    MCP_SERENA_HOST,
+    OUTBOX_BACKOFF_S,
+    OUTBOX_LEASE_S,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL_S,
+    OUTBOX_WORKERS,
+)
+from .db import db, now_iso, on_commit
+from .ids import new_id
+
+_lock = threading.Lock()
+_wake = threading.Event()
+metrics = {"enqueued": 0, "dispatched": 0, "retries": 0, "dead_letters": 0, "last_dispatch_ms": 0.0}
+
+
+class PermanentError(Exception):
+    """The call was rejected and retrying it cannot succeed."""
+
+
+def _count(**updates) -> None:
+    with _lock:
+        for name, value in updates.items():
+            if name.startswith("last_"):
+                metrics[name] = value
+            else:
+                metrics[name] += value
+
+
+def _ts(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+def enqueue(conn: sqlite3.Connection, kind: str, entity_id: str, payload: Dict) -> str:
+    """Add a side effect to the caller's transaction; workers wake once it commits."""
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown outbox kind {kind}")
+    ob_id = new_id("ob")
+    now = now_iso()
+    conn.execute(
+        "INSERT INTO outbox(id, kind, entity_id, payload, status, attempts, next_attempt_at, created_at)"
+        " VALUES(?,?,?,?,'pending',0,?,?)",
+        (ob_id, kind, entity_id, json.dumps(payload), now, now),
+    )
+    on_commit(_wake.set)
+    _count(enqueued=1)
+    return ob_id
+
+
+def _rapyd_payout(ob_id: str, entity_id: str, payload: Dict) -> None:
+    from .rapyd_client import rapyd_request
+
+    try:
+        status, resp = rapyd_request("POST", "/v1/payouts", payload, idempotency_key=ob_id)
+    except Exception as e:
+        audit("rapyd_payout_api_error", entity_id, {"error": str(e), "outbox_id": ob_id})
+        raise
+    audit("rapyd_payout_api", entity_id, {"status": status, "resp": resp, "outbox_id": ob_id})
+    if 400 <= status < 500:
+        raise PermanentError(f"rapyd rejected payout: HTTP {status}")
+    if status >= 500:
+        raise RuntimeError(f"rapyd payout failed: HTTP {status}")
+
+
+def _mcp_notify(ob_id: str, entity_id: str, payload: Dict) -> None:
+    from .mcp_integration import integrate_with_escrow_flow
+
+    if not MCP_SERENA_HOST:
+        # queued while MCP was configured; with nothing to call, retrying would only dead-letter it
+        return
+    metadata = dict(payload["metadata"], idempotency_key=ob_id)
+    if not integrate_with_escrow_flow(entity_id, payload["action"], metadata):
+        raise RuntimeError("MCP integration failed")
+
+
+HANDLERS: Dict[str, Callable[[str, str, Dict], None]] = {
+    "rapyd_payout": _rapyd_payout,
+    "mcp_notify": _mcp_notify,
+}
+
+_CLAIM_SQL = (
+    "UPDATE outbox SET attempts=attempts+1, claimed_until=? WHERE id=("
+    " SELECT id FROM outbox WHERE status='pending' AND next_attempt_at <= ?"
+    " AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY next_attempt_at LIMIT 1)"
+    " RETURNING id, kind, entity_id, payload, attempts"
+)
+
+
+def _claim() -> Optional[sqlite3.Row]:
+    now = datetime.utcnow()
+    with db() as conn:
+        return conn.execute(_CLAIM_SQL, (_ts(now + timedelta(seconds=OUTBOX_LEASE_S)), _ts(now), _ts(now))).fetchone()
+
+
+def _finish(row: sqlite3.Row, error: Optional[Exception]) -> None:
+    # "attempts" identifies the claim: if the lease ran out and another worker took the row, leave it alone
+    now = datetime.utcnow()
+    if error is None:
+        with db() as conn:
+            conn.execute(
+                "UPDATE outbox SET status='dispatched', dispatched_at=?, claimed_until=NULL, last_error=NULL"
+                " WHERE id=? AND attempts=?",
+                (_ts(now), row["id"], row["attempts"]),
+            )
+        _count(dispatched=1)
+        return
+    message = f"{type(error).__name__}: {error}"
+    if isinstance(error, PermanentError) or row["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+        with db() as conn:
+            conn.execute(
+                "UPDATE outbox SET status='dead', claimed_until=NULL, last_error=? WHERE id=? AND attempts=?",
+                (message, row["id"], row["attempts"]),
+            )
+        _count(dead_letters=1)
+        raise_alert("high" if row["kind"] == "rapyd_payout" else "medium", "outbox_dead_letter",
+                    f"{row['kind']} for {row['entity_id']} failed after {row['attempts']} attempts: {error}",
+                    {"outbox_id": row["id"], "kind": row["kind"], "entity_id": row["entity_id"]})
+        return
+    delay = min(OUTBOX_BACKOFF_S * 2 ** (row["attempts"] - 1), 3600)
+    with db() as conn:
+        conn.execute(
+            "UPDATE outbox SET next_attempt_at=?, claimed_until=NULL, last_error=? WHERE id=? AND attempts=?",
+            (_ts(now + timedelta(seconds=delay)), message, row["id"], row["attempts"]),
+        )
+    _count(retries=1)
+
+
+def dispatch_one() -> bool:
+    """Claim and dispatch one due row; False if none was due."""
+    row = _claim()
+    if row is None:
+        return False
+    started = time.perf_counter()
+    error: Optional[Exception] = None
+    try:
+        HANDLERS[row["kind"]](row["id"], row["entity_id"], json.loads(row["payload"]))
+    except Exception as e:
+        error = e
+    _finish(row, error)
+    _count(last_dispatch_ms=round((time.perf_counter() - started) * 1000, 2))
+    return True
+
+
+def dispatch_pending() -> int:
+    """Dispatch every row that is due now, once each; returns how many were tried."""
+    n = 0
+    while dispatch_one():
+        n += 1
+    return n
+
+
+def stats() -> Dict:
+    """Pending/dead counts, age of the oldest pending row (seconds) and dispatch counters."""
+    with db(readonly=True) as conn:
+        counts = {r["status"]: r["n"] for r in conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status")}
+        oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status='pending'").fetchone()[0]
+    lag = 0.0
+    if oldest:
+        lag = max(0.0, (datetime.utcnow() - datetime.strptime(oldest, "%Y-%m-%dT%H:%M:%SZ")).total_seconds())
+    with _lock:
+        out = dict(metrics)
+    out.update({"pending": counts.get("pending", 0), "dead_total": counts.get("dead", 0), "lag_s": lag})
+    return out
+
+
+def start_background(workers: int = OUTBOX_WORKERS,
+                     interval_s: float = OUTBOX_POLL_INTERVAL_S) -> List[threading.Thread]:
+    """Dispatch on ``workers`` daemon threads; idle workers sleep until a commit enqueues or the poll interval."""
+
+    def loop():
+        while True:
+            try:
+                if dispatch_one():
+                    continue
+            except Exception as e:
+                audit("outbox_dispatch_error", "system", {"error": str(e)})
+            _wake.wait(interval_s)
+            _wake.clear()
+
+    threads = [threading.Thread(target=loop, name=f"outbox-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payout side-effect outbox")
+    sub = parser.add_subparsers(dest="cmd")
+    pd = sub.add_parser("dispatch")
+    pd.add_argument("--once", action="store_true", help="dispatch what is due and exit")
+    pd.add_argument("--workers", type=int, default=OUTBOX_WORKERS)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+    if args.cmd == "dispatch":
+        if args.once:
+            print(f"dispatched {dispatch_pending()} rows")
+        else:
+            for t in start_background(args.workers):
+                t.join()
+    elif args.cmd == "stats":
+        print(json.dumps(stats(), indent=2))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
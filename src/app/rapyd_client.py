@@ -30,7 +30,8 @@ def _signature(method: str, path: str, body: Optional[Dict[str, Any]], salt: str
     return base64.b64encode(h.digest()).decode("utf-8")
 
 
-def rapyd_request(method: str, path: str, body: Optional[Dict[str, Any]] = None, timeout: int = 30) -> Tuple[int, Dict[str, Any]]:
+def rapyd_request(method: str, path: str, body: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                  idempotency_key: Optional[str] = None) -> Tuple[int, Dict[str, Any]]:
     if not RAPYD_ACCESS_KEY or not RAPYD_SECRET_KEY:
         raise RuntimeError("RAPYD_ACCESS_KEY / RAPYD_SECRET_KEY must be set in env")
     if not path.startswith("/"):
@@ -49,6 +50,9 @@ def rapyd_request(method: str, path: str, body: Optional[Dict[str, Any]] = None,
         "timestamp": timestamp,
         "signature": sig,
     }
+    if idempotency_key:
+        # Rapyd returns the original response for a repeated key instead of acting twice
+        headers["idempotency"] = idempotency_key
     req = urllib.request.Request(url=url, method=method.upper(), headers=headers, data=data_bytes)
     try:
         with urllib.request.urlopen(req, timeout=timeout) as resp:
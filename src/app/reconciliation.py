@@ -5,31 +5,39 @@ from datetime import datetime, date
 
 from .audit import append as audit
 from .config import REPORTS_DIR
+from .checkpoints import balances_at, end_of_day
 from .db import db
 
 
 def run_for_date(target: date) -> str:
     os.makedirs(REPORTS_DIR, exist_ok=True)
     out = os.path.join(REPORTS_DIR, f"recon_{target.isoformat()}.csv")
-    with db() as conn, open(out, "w", newline="") as f:
-        c = conn.cursor()
+    live = target >= datetime.utcnow().date()
+    internal, rapyd = {}, {}
+    if live:
+        # both totals from one read snapshot; no write lock is taken
+        with db(readonly=True) as conn:
+            c = conn.cursor()
+            c.execute("SELECT currency, SUM(available) as total FROM balances GROUP BY currency")
+            internal = {row["currency"]: int(row["total"]) for row in c.fetchall()}
+            # Rapyd simulated balances (only known live; no history is kept for them)
+            c.execute("SELECT currency, available FROM rapyd_balances")
+            rapyd = {row["currency"]: int(row["available"]) for row in c.fetchall()}
+    else:
+        # as of the end of the target day, from the nearest checkpoint
+        for row in balances_at(end_of_day(target)):
+            internal[row["currency"]] = internal.get(row["currency"], 0) + row["available"]
+    with open(out, "w", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["currency", "internal_total", "rapyd_total", "delta"])
-        # Internal balances by currency
-        c.execute(
-            "SELECT currency, SUM(available) as total FROM balances GROUP BY currency"
-        )
-        internal = {row["currency"]: int(row["total"]) for row in c.fetchall()}
-        # Rapyd simulated balances
-        c.execute("SELECT currency, available FROM rapyd_balances")
-        rapyd = {row["currency"]: int(row["available"]) for row in c.fetchall()}
-        keys = set(internal.keys()) | set(rapyd.keys())
-        for cur in sorted(keys):
+        for cur in sorted(set(internal.keys()) | set(rapyd.keys())):
             it = internal.get(cur, 0)
-            rp = rapyd.get(cur, 0)
-            delta = it - rp
-            writer.writerow([cur, it, rp, delta])
-    audit("reconciliation", target.isoformat(), {"file": out})
+            if live:
+                rp = rapyd.get(cur, 0)
+                writer.writerow([cur, it, rp, it - rp])
+            else:
+                writer.writerow([cur, it, "", ""])
+    audit("reconciliation", target.isoformat(), {"file": out, "as_of": "live" if live else end_of_day(target)})
     return out
 
 
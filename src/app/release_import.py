@@ -0,0 +1,195 @@
+"""Bulk release requests from a CSV or NDJSON batch.
+
+Payroll-style batches of hundreds of releases are read and validated in
+full first, with no transaction open, so a slow file or an open stdin pipe
+never holds the write lock. Each row has ``client_id``, ``amount_usdt``,
+``address`` and optionally ``chain`` (default ``DEFAULT_CHAIN``) and
+``max_slippage_bps`` (default 50). The batch is then quoted once, one rate
+per slippage tolerance with a shared expiry, and inserted in one short
+transaction: addresses are checked against the whitelist cache once per
+(client, chain), and requests go in with their quote already attached,
+``INSERT_CHUNK`` rows per statement.
+
+A bad row (missing field, bad number, unapproved address) is reported with
+its line number and skipped; it does not abort the batch. If a chunk insert
+fails, that chunk is retried one row at a time, so only the failing rows
+are dropped. Audit records go out after the commit.
+
+    python -m src.app.release_import releases.csv
+    python -m src.app.release_import - --format ndjson < releases.ndjson
+"""
+
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from .addresses import whitelist
+from .audit import append as audit
+from .config import DEFAULT_CHAIN, SINGLE_APPROVAL_THRESHOLD_USDT
+from .db import db, now_iso
+from .ids import new_id
+from .orchestrator import quote_jpy_to_usdt
+
+INSERT_CHUNK = 200
+
+_INSERT_SQL = (
+    "INSERT INTO release_requests(id, client_id, amount_usdt, chain, address, status, required_approvals, "
+    "approvals_count, max_slippage_bps, quote_rate, quote_expires_at, created_at, updated_at) "
+    "VALUES(?,?,?,?,?,'pending',?,0,?,?,?,?,?)"
+)
+
+
+def _records(f: TextIO, fmt: str) -> Iterator[Tuple[int, Dict]]:
+    """(line number, row) for every data row of the file."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "ndjson":
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield n, row if isinstance(row, dict) else {"_error": "not a JSON object"}
+    else:
+        raise ValueError("format must be csv or ndjson")
+
+
+def _parse(row: Dict) -> Tuple[str, float, str, str, int]:
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    client_id = str(row.get("client_id") or "").strip()
+    address = str(row.get("address") or "").strip()
+    if not client_id or not address:
+        raise ValueError("client_id and address are required")
+    chain = str(row.get("chain") or "").strip() or DEFAULT_CHAIN
+    try:
+        amount = float(row.get("amount_usdt"))
+    except (TypeError, ValueError):
+        raise ValueError("amount_usdt must be a number")
+    if not amount > 0:
+        raise ValueError("amount_usdt must be positive")
+    bps = row.get("max_slippage_bps")
+    try:
+        bps = 50 if bps in (None, "") else int(bps)
+    except (TypeError, ValueError):
+        raise ValueError("max_slippage_bps must be an integer")
+    return client_id, amount, chain, address, bps
+
+
+def _insert(chunk: List[Tuple[int, tuple]], report: Dict) -> List[tuple]:
+    """Insert a chunk in one statement; on failure retry it row by row. Returns the rows inserted."""
+    try:
+        with db() as c:
+            c.executemany(_INSERT_SQL, [params for _, params in chunk])
+        report["created"].extend({"line": n, "id": params[0]} for n, params in chunk)
+        return [params for _, params in chunk]
+    except sqlite3.Error:
+        report["chunk_fallbacks"] += 1
+    inserted = []
+    for n, params in chunk:
+        try:
+            with db() as c:
+                c.execute(_INSERT_SQL, params)
+            report["created"].append({"line": n, "id": params[0]})
+            inserted.append(params)
+        except sqlite3.Error as e:
+            report["errors"].append({"line": n, "error": str(e)})
+    return inserted
+
+
+def import_releases(records: Iterable[Tuple[int, Dict]], source: Optional[str] = None) -> Dict:
+    """Create a pending, quoted release request for every valid record.
+
+    Returns ``{"rows", "created": [{"line", "id"}], "errors": [{"line", "error"}],
+    "quotes", "seconds"}``.
+    """
+    started = time.time()
+    report: Dict = {"source": source, "rows": 0, "created": [], "errors": [], "chunk_fallbacks": 0}
+    # read and validate the whole input before touching the database
+    parsed: List[Tuple[int, str, float, str, str, int]] = []
+    for n, row in records:
+        report["rows"] += 1
+        try:
+            parsed.append((n,) + _parse(row))
+        except ValueError as e:
+            report["errors"].append({"line": n, "error": str(e)})
+    # quoted right before the insert, so the expiry runs from there
+    quotes: Dict[int, Tuple[float, str]] = {}
+    for _, _, amount, _, _, bps in parsed:
+        if bps not in quotes:
+            quotes[bps] = quote_jpy_to_usdt(amount, bps)
+    approved: Dict[Tuple[str, str], Dict[str, str]] = {}
+    inserted: List[tuple] = []
+    with db() as conn:
+        now = now_iso()
+        chunk: List[Tuple[int, tuple]] = []
+        for n, client_id, amount, chain, address, bps in parsed:
+            key = (client_id, chain)
+            if key not in approved:
+                approved[key] = whitelist.approved(conn, client_id, chain)
+            if address not in approved[key]:
+                report["errors"].append({"line": n, "error": "address not approved for this client/chain"})
+                continue
+            rate, expires = quotes[bps]
+            required = 1 if amount <= SINGLE_APPROVAL_THRESHOLD_USDT else 2
+            chunk.append((n, (new_id("req"), client_id, amount, chain, address, required, bps,
+                              rate, expires, now, now)))
+            if len(chunk) >= INSERT_CHUNK:
+                inserted += _insert(chunk, report)
+                chunk = []
+        if chunk:
+            inserted += _insert(chunk, report)
+        # queued now, written once the batch commits
+        audit("release_import", source or "batch", {
+            "rows": report["rows"],
+            "created": len(inserted),
+            "errors": len(report["errors"]),
+        })
+        for req_id, client_id, amount, chain, address, required, bps, rate, expires, _, _ in inserted:
+            audit("release_request", req_id, {
+                "client_id": client_id,
+                "amount_usdt": amount,
+                "chain": chain,
+                "address": address,
+                "required": required,
+                "max_slippage_bps": bps,
+            })
+            audit("quote_attached", req_id, {"rate_jpy_per_usdt": rate, "expires": expires})
+    report["errors"].sort(key=lambda e: e["line"])
+    report["quotes"] = {str(bps): {"rate_jpy_per_usdt": r, "expires": e} for bps, (r, e) in quotes.items()}
+    report["seconds"] = round(time.time() - started, 3)
+    return report
+
+
+def import_file(path: str, fmt: Optional[str] = None) -> Dict:
+    """Import ``path`` ("-" for stdin); the format defaults to the file extension."""
+    if fmt is None:
+        fmt = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+    if path == "-":
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+        return import_releases(_records(f, fmt), "stdin")
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return import_releases(_records(f, fmt), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk release requests from CSV/NDJSON")
+    parser.add_argument("path", help="batch file, - for stdin")
+    parser.add_argument("--format", choices=("csv", "ndjson"), default=None)
+    args = parser.parse_args()
+    report = import_file(args.path, args.format)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    raise SystemExit(1 if report["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
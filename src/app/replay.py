@@ -0,0 +1,223 @@
+"""Rebuild ``balances`` and ``rapyd_balances`` from the ledger.
+
+Disaster-recovery path for when the derived balance tables are damaged.
+``ledger_entries`` is scanned in large rowid windows, each monthly archive
+file in turn (opened read-only, scanned, closed) and then the hot table;
+SQLite sums each window per (client, currency) and the partial sums are
+folded into ``array('q')`` accumulators indexed by an interned key, so the
+Python side never touches individual entries. The derived tables are then
+rewritten in one pass.
+
+The hot scan and the rewrite run in a single write transaction, so no entry
+can land in between. Do not run it alongside ``archive run``: a copied
+month stays in the hot table too until its delete step commits.
+``audit.log`` is replayed alongside as an independent cross-check: its
+deposit and payout records are summed per currency and any difference
+from the ledger is reported.
+
+``rapyd_balances`` is rebuilt as the net ledger total per currency; deposits
+that reached Rapyd but never the ledger cannot be recovered from here, so
+compare the result with Rapyd's own statement.
+
+    python -m src.app.replay run [--dry-run] [--chunk 500000]
+    python -m src.app.replay bench [--rows 10000000]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from array import array
+from typing import Dict, Optional, Tuple
+
+from . import audit
+from .db import _connect
+
+CHUNK_ROWS = 500_000
+
+_NET = "SUM(CASE direction WHEN 'credit' THEN amount ELSE -amount END)"
+
+
+class Accumulator:
+    """Signed totals per (client, currency) in a flat int64 array."""
+
+    def __init__(self) -> None:
+        self.index: Dict[Tuple[str, str], int] = {}
+        self.totals = array("q")
+
+    def add(self, key: Tuple[str, str], amount: int) -> None:
+        slot = self.index.get(key)
+        if slot is None:
+            slot = self.index[key] = len(self.totals)
+            self.totals.append(0)
+        self.totals[slot] += amount
+
+    def items(self):
+        totals = self.totals
+        return ((key, totals[slot]) for key, slot in self.index.items())
+
+
+def _scan(conn: sqlite3.Connection, schema: str, acc: Accumulator, chunk: int) -> int:
+    lo, hi = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {schema}.ledger_entries").fetchone()
+    if lo is None:
+        return 0
+    count = 0
+    start = lo - 1
+    while start < hi:
+        end = start + chunk
+        for client_id, currency, net, n in conn.execute(
+            f"SELECT client_id, currency, {_NET}, COUNT(*) FROM {schema}.ledger_entries"
+            " WHERE rowid > ? AND rowid <= ? GROUP BY client_id, currency",
+            (start, end),
+        ):
+            acc.add((client_id, currency), net)
+            count += n
+        start = end
+    return count
+
+
+def audit_totals(path: Optional[str] = None) -> Dict[str, int]:
+    """Net deposits minus payouts per currency according to ``audit.log``."""
+    path = path or audit.AUDIT_PATH
+    totals: Dict[str, int] = {}
+    for segment in audit.segments(path) + [path]:
+        for _, line in audit.iter_lines(segment):
+            # cheap prefilter: most record kinds are irrelevant here
+            if b'"deposit' not in line and b'"payout_executed"' not in line:
+                continue
+            rec = json.loads(line)
+            kind, data = rec["kind"], rec["data"]
+            if kind == "deposit":
+                totals[data["currency"]] = totals.get(data["currency"], 0) + int(data["amount"])
+            elif kind == "deposit_batch":
+                for d in data["deposits"]:
+                    totals[d["currency"]] = totals.get(d["currency"], 0) + int(d["amount"])
+            elif kind == "payout_executed":
+                totals["JPY"] = totals.get("JPY", 0) - int(data["jpy"])
+    return totals
+
+
+def rebuild(db_path: Optional[str] = None, dry_run: bool = False, chunk: int = CHUNK_ROWS,
+            audit_path: Optional[str] = None) -> Dict:
+    """Recompute the balance tables from the ledger; with ``dry_run`` only report differences."""
+    from .archive import each_archive
+
+    started = time.perf_counter()
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN" if dry_run else "BEGIN IMMEDIATE")
+        acc = Accumulator()
+        entries = 0
+        # archives belong to the configured database only; one file is open at a time
+        for _, arc in each_archive() if db_path is None else ():
+            if arc.execute("SELECT 1 FROM sqlite_master WHERE name='ledger_entries'").fetchone():
+                arc.execute("BEGIN")
+                entries += _scan(arc, "main", acc, chunk)
+                arc.execute("COMMIT")
+        entries += _scan(conn, "main", acc, chunk)
+        scanned = time.perf_counter()
+        per_currency: Dict[str, int] = {}
+        for (_, currency), total in acc.items():
+            per_currency[currency] = per_currency.get(currency, 0) + total
+        old = {(r[0], r[1]): int(r[2]) for r in conn.execute("SELECT client_id, currency, available FROM balances")}
+        changed = [
+            {"client_id": k[0], "currency": k[1], "old": old.get(k), "new": v}
+            for k, v in acc.items() if old.get(k) != v
+        ]
+        changed += [
+            {"client_id": k[0], "currency": k[1], "old": v, "new": None}
+            for k, v in old.items() if k not in acc.index
+        ]
+        if not dry_run:
+            conn.execute("DELETE FROM balances")
+            conn.executemany(
+                "INSERT INTO balances(client_id, currency, available) VALUES(?,?,?)",
+                ((k[0], k[1], v) for k, v in acc.items()),
+            )
+            conn.execute("DELETE FROM rapyd_balances")
+            conn.executemany(
+                "INSERT INTO rapyd_balances(currency, available) VALUES(?,?)", sorted(per_currency.items())
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    finished = time.perf_counter()
+    from_audit = audit_totals(audit_path) if db_path is None or audit_path else {}
+    audit_delta = {
+        cur: per_currency.get(cur, 0) - from_audit.get(cur, 0)
+        for cur in set(per_currency) | set(from_audit)
+        if per_currency.get(cur, 0) != from_audit.get(cur, 0)
+    } if from_audit else {}
+    result = {
+        "entries": entries,
+        "pairs": len(acc.index),
+        "changed": changed,
+        "currencies": per_currency,
+        "audit_delta": audit_delta,
+        "dry_run": dry_run,
+        "scan_seconds": round(scanned - started, 3),
+        "seconds": round(finished - started, 3),
+        "entries_per_sec": round(entries / (scanned - started)) if scanned > started else 0,
+    }
+    if not dry_run and db_path is None:
+        audit.append("balances_rebuilt", "system",
+                     {"entries": entries, "pairs": len(acc.index), "changed": len(changed)})
+    return result
+
+
+def bench(rows: int, directory: Optional[str] = None) -> Dict:
+    """Build a scratch ledger of ``rows`` entries and time a full rebuild of it."""
+    from .db import init_db
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, "replay.db")
+        init_db(path)
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO clients(id, name, wallet_id, created_at) VALUES(?,?,?,?)",
+            [(f"C{i:04d}", f"bench {i}", None, "2025-01-01T00:00:00Z") for i in range(1000)],
+        )
+        conn.execute(
+            "WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)"
+            " INSERT INTO ledger_entries(id, tx_id, client_id, direction, amount, currency, created_at)"
+            " SELECT printf('le%012d', i), printf('tx%012d', i), printf('C%04d', i % 1000),"
+            " CASE WHEN i % 5 = 0 THEN 'debit' ELSE 'credit' END, 1000 + i % 97,"
+            " CASE WHEN i % 3 = 0 THEN 'USD' ELSE 'JPY' END, '2025-01-01T00:00:00Z' FROM seq",
+            (rows,),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+        result = rebuild(db_path=path)
+    result.pop("changed")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild balance tables from the ledger")
+    sub = parser.add_subparsers(dest="cmd")
+    pr = sub.add_parser("run")
+    pr.add_argument("--dry-run", action="store_true", help="report differences without writing")
+    pr.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="rowids per scan window")
+    pb = sub.add_parser("bench")
+    pb.add_argument("--rows", type=int, default=10_000_000)
+    pb.add_argument("--dir", default=None, help="scratch directory (default: system temp)")
+    args = parser.parse_args()
+    if args.cmd == "run":
+        result = rebuild(dry_run=args.dry_run, chunk=args.chunk)
+        print(json.dumps(result, indent=2))
+    elif args.cmd == "bench":
+        print(json.dumps(bench(args.rows, args.dir), indent=2))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
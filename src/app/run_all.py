@@ -1,11 +1,12 @@
 import uuid
 from datetime import date
 
-from .db import db, init_db, now_iso
+from .db import db, init_db, now_iso, unit_of_work
 from .rapyd_simulator import deposit_jpy
 from .ledger import record_deposit
 from .approvals import create_release_request, approve_release
 from .orchestrator import quote_jpy_to_usdt, attach_quote, execute_payout
+from .outbox import dispatch_pending
 from .reconciliation import run_for_date
 from .dashboard import build_dashboard
 from .i18n import t
@@ -29,8 +30,9 @@ def main():
     ensure_clients()
 
     print(t("run.step2"))
-    evt = deposit_jpy("A", 2_500_000)
-    record_deposit(evt["json"])  # webhook path is simulated inline
+    with unit_of_work():
+        evt = deposit_jpy("A", 2_500_000)
+        record_deposit(evt["json"])  # webhook path is simulated inline
 
     print(t("run.step3"))
     req_id = create_release_request(
@@ -49,6 +51,7 @@ def main():
 
     print(t("run.step5"))
     payout_id = execute_payout(req_id)
+    dispatch_pending()
 
     print(t("run.step6"))
     recon_path = run_for_date(date.today())
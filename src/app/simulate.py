@@ -5,9 +5,10 @@ import uuid
 
 from . import rapyd_simulator
 from .approvals import approve_release, create_release_request
-from .db import db, init_db, now_iso
+from .db import db, init_db, now_iso, unit_of_work
 from .ledger import record_deposit
 from .orchestrator import attach_quote, execute_payout, quote_jpy_to_usdt
+from .outbox import dispatch_pending
 from .alerts import high_amount_check_jpy
 from .i18n import t
 
@@ -33,17 +34,20 @@ def cmd_init():
 def cmd_deposit(client: str, amount: int):
     if amount <= 0:
         raise SystemExit("amount must be positive (JPY)")
-    high_amount_check_jpy(amount)
-    evt = rapyd_simulator.deposit_jpy(client, amount)
-    # In a real deployment, the webhook receiver would verify signature; here we trust simulator
-    record_deposit(evt["json"])  # process event
+    # alert, simulated Rapyd balance, ledger rows and audit intent commit together
+    with unit_of_work():
+        high_amount_check_jpy(amount)
+        evt = rapyd_simulator.deposit_jpy(client, amount)
+        # In a real deployment, the webhook receiver would verify signature; here we trust simulator
+        record_deposit(evt["json"])  # process event
     print(t("cli.deposit.ok", client=client, amount=amount))
 
 
 def cmd_release(client: str, amount_usdt: float, chain: str, address: str, max_slippage_bps: int):
-    req_id = create_release_request(client, amount_usdt, chain, address, max_slippage_bps)
-    rate, exp = quote_jpy_to_usdt(amount_usdt, max_slippage_bps)
-    attach_quote(req_id, rate, exp)
+    with unit_of_work():
+        req_id = create_release_request(client, amount_usdt, chain, address, max_slippage_bps)
+        rate, exp = quote_jpy_to_usdt(amount_usdt, max_slippage_bps)
+        attach_quote(req_id, rate, exp)
     print(t("cli.release.created", req_id=req_id, rate=rate, exp=exp))
 
 
@@ -54,6 +58,8 @@ def cmd_approve(request_id: str, approver: str):
 
 def cmd_payout(request_id: str):
     payout_id = execute_payout(request_id)
+    # no worker pool in the CLI: send the payout's side effects now
+    dispatch_pending()
     # simulate a payout.sent webhook
     from .config import SIM_NETWORK_FEE_USDT
     with db() as conn:
@@ -63,7 +69,7 @@ def cmd_payout(request_id: str):
 
 
 def cmd_status():
-    with db() as conn:
+    with db(readonly=True) as conn:
         c = conn.cursor()
         print(t("cli.status.balances"))
         for row in c.execute("SELECT client_id, currency, available FROM balances ORDER BY client_id, currency"):
@@ -9,21 +9,36 @@ import os
 import sqlite3
 import uuid
 from datetime import datetime, timedelta
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, quote, urlparse
 import urllib.request
 import hashlib
 import hmac
 
-from .db import db, init_db, now_iso
-from .ledger import record_deposit
+from .db import db, init_db, now_iso, unit_of_work
+from .ledger import record_deposit, transaction_history
 from .rapyd_simulator import deposit_jpy
 from .orchestrator import quote_jpy_to_usdt, attach_quote, execute_payout
-from .approvals import create_release_request, approve_release
-from .config import SIM_FX_JPY_PER_USDT, SIM_NETWORK_FEE_USDT, WEBHOOK_SECRET
+from .approvals import create_release_request, approve_one, approve_many, pending_approvals, PENDING_PAGE_SIZE
+from .config import ADMIN_TOKEN, SIM_FX_JPY_PER_USDT, SIM_NETWORK_FEE_USDT, WEBHOOK_SECRET
 from .dashboard import build_dashboard
 from .new_deposits import get_new_deposits_html
 
+# 一覧APIのクエリ（migrations.HOT_QUERIES でプランを検査）
+_PENDING_DEPOSITS_SQL = """
+    SELECT id, sender_name, amount, status, created_at, sender_bank
+    FROM bank_deposits
+    WHERE status = 'pending'
+    ORDER BY created_at DESC
+    LIMIT 10
+"""
+_BANK_DEPOSITS_SQL = """
+    SELECT id, sender_name, sender_bank, amount, purpose,
+           status, tron_address, processed_at, created_at, updated_at
+    FROM bank_deposits
+    ORDER BY created_at DESC
+"""
+
 # 現在の為替レート（実際のAPIから取得する場合はここを変更）
 def get_current_rates():
     """リアルタイム為替レート取得（デモ用）"""
@@ -65,9 +80,10 @@ class EscrowWebHandler(BaseHTTPRequestHandler):
         elif path == "/approvals":
             self.serve_approvals_page()
         elif path == "/api/pending_approvals":
-            self.get_pending_approvals()
+            self.get_pending_approvals(parse_qs(parsed.query))
         elif path == "/api/transaction_history":
-            self.get_transaction_history()
+            if self.require_admin():
+                self.get_transaction_history(parse_qs(parsed.query))
         elif path == "/errors":
             self.serve_error_log_page()
         elif path == "/api/errors":
@@ -76,6 +92,17 @@ class EscrowWebHandler(BaseHTTPRequestHandler):
             self.serve_demo_page()
         elif path == "/api/bank_deposits":
             self.get_bank_deposits()
+        elif path == "/api/metrics/idempotency":
+            self.get_idempotency_metrics()
+        elif path == "/api/metrics/inbox":
+            self.get_inbox_metrics()
+        elif path == "/api/metrics/address_cache":
+            self.get_address_cache_metrics()
+        elif path == "/api/metrics/outbox":
+            self.get_outbox_metrics()
+        elif path == "/api/export":
+            if self.require_admin():
+                self.get_export(parse_qs(parsed.query))
         else:
             self.send_error(404, "Page not found")
 
@@ -98,6 +125,8 @@ class EscrowWebHandler(BaseHTTPRequestHandler):
             self.convert_to_usdt(data)
         elif path == "/api/approve":
             self.approve_transaction(data)
+        elif path == "/api/approve_many":
+            self.approve_many_transactions(data)
         elif path == "/api/reject":
             self.reject_transaction(data)
         elif path == "/api/demo/deposit":
@@ -1480,9 +1509,26 @@ Sandbox環境で動作中
         self.wfile.write(html.encode('utf-8'))
 
     # API エンドポイント
+    def require_admin(self):
+        """管理者APIの認証（Authorization: Bearer <ADMIN_TOKEN>）。失敗時は401/403を返してFalse"""
+        if not ADMIN_TOKEN:
+            status, error = 403, "admin endpoints are disabled (set ADMIN_TOKEN)"
+        else:
+            scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+                return True
+            status, error = 401, "invalid or missing admin token"
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if status == 401:
+            self.send_header('WWW-Authenticate', 'Bearer')
+        self.end_headers()
+        self.wfile.write(json.dumps({"error": error}).encode())
+        return False
+
     def get_deposits(self):
         """入金一覧取得API - bank_depositsの統計情報"""
-        with db() as conn:
+        with db(readonly=True) as conn:
             c = conn.cursor()
             # bank_depositsテーブルから総残高を取得
             c.execute("""
@@ -1508,7 +1554,7 @@ Sandbox環境で動作中
 
     def get_pending_deposits(self):
         """未処理入金取得API - bank_depositsテーブルから取得"""
-        with db() as conn:
+        with db(readonly=True) as conn:
             c = conn.cursor()
             # bank_depositsテーブルから未処理の入金を取得
             c.execute("""
@@ -1516,13 +1562,7 @@ Sandbox環境で動作中
             """)
             count = c.fetchone()[0]
 
-            c.execute("""
-                SELECT id, sender_name, amount, status, created_at, sender_bank
-                FROM bank_deposits
-                WHERE status = 'pending'
-                ORDER BY created_at DESC
-                LIMIT 10
-            """)
+            c.execute(_PENDING_DEPOSITS_SQL)
 
             deposits = []
             for row in c.fetchall():
@@ -1555,43 +1595,115 @@ Sandbox環境で動作中
         self.end_headers()
         self.wfile.write(json.dumps(rates).encode())
 
-    def get_pending_approvals(self):
-        """承認待ち取得API"""
-        with db() as conn:
-            c = conn.cursor()
-            c.execute("""
-                SELECT id, client_id, amount_usdt, chain, address,
-                       status, required_approvals, approvals_count
-                FROM release_requests
-                WHERE status = 'pending'
-                ORDER BY created_at DESC
-            """)
+    def get_pending_approvals(self, query):
+        """承認待ち取得API（キーセットページング、ETagで未変更なら304）"""
+        try:
+            limit = int((query.get('limit') or [PENDING_PAGE_SIZE])[0])
+            if not 0 < limit <= 1000:
+                raise ValueError("limit must be 1-1000")
+            approvals, cursor = pending_approvals(limit, (query.get('after') or [None])[0])
+        except ValueError as e:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+
+        body = json.dumps(approvals).encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        # 10秒ごとのポーリングで変化がなければ本文を返さない
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if cursor:
+            self.send_header('Link', f'</api/pending_approvals?limit={limit}&after={quote(cursor)}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(body)
 
-            approvals = []
-            for row in c.fetchall():
-                # 承認者リスト取得
-                c.execute("""
-                    SELECT approver FROM approvals
-                    WHERE request_id = ?
-                """, (row[0],))
-                approvers = [r[0] for r in c.fetchall()]
+    def get_transaction_history(self, query):
+        """取引履歴API（アーカイブ済みの月も含む、新しい順）"""
+        try:
+            limit = int((query.get('limit') or [100])[0])
+            if not 0 < limit <= 1000:
+                raise ValueError("limit must be 1-1000")
+        except ValueError as e:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+        history = transaction_history((query.get('client_id') or [None])[0],
+                                      (query.get('since') or [None])[0], limit)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(history, ensure_ascii=False).encode())
 
-                approvals.append({
-                    "id": row[0],
-                    "client_id": row[1],
-                    "amount_usdt": row[2],
-                    "chain": row[3],
-                    "address": row[4],
-                    "status": row[5],
-                    "required_approvals": row[6],
-                    "approvals_count": row[7],
-                    "approvers": approvers
-                })
+    def get_idempotency_metrics(self):
+        """冪等性フィルタのヒット率API"""
+        from .idempotency import store
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(store.stats()).encode())
+
+    def get_inbox_metrics(self):
+        """Webhook受信箱の滞留件数・遅延API"""
+        from .inbox import stats
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(stats()).encode())
+
+    def get_address_cache_metrics(self):
+        """出金先ホワイトリストキャッシュのヒット率API"""
+        from .addresses import whitelist
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(whitelist.stats()).encode())
 
+    def get_outbox_metrics(self):
+        """出金後処理アウトボックスの滞留・リトライAPI"""
+        from .outbox import stats
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.end_headers()
-        self.wfile.write(json.dumps(approvals).encode())
+        self.wfile.write(json.dumps(stats()).encode())
+
+    def get_export(self, query):
+        """台帳エクスポートAPI（キーセットページングでストリーミング）"""
+        from .export import EXPORT_TABLES, export_table
+
+        def opt(name):
+            return (query.get(name) or [None])[0]
+
+        table = opt('table') or 'ledger_entries'
+        fmt = opt('format') or 'ndjson'
+        compress = opt('gzip') in ('1', 'true')
+        if table not in EXPORT_TABLES or fmt not in ('ndjson', 'csv'):
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "invalid table or format"}).encode())
+            return
+        filename = f"{table}.{fmt}" + ('.gz' if compress else '')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/gzip' if compress else
+                         ('application/x-ndjson' if fmt == 'ndjson' else 'text/csv; charset=utf-8'))
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        # 件数が事前に分からないため Content-Length なしで接続終了まで送る
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        stats = export_table(self.wfile, table, fmt, compress, opt('client'), opt('currency'),
+                             opt('since'), opt('until'), opt('archive') in ('1', 'true'))
+        print(f"📤 export {table}: {stats['rows']}件 {stats['rows_per_sec']} rows/sec")
 
     def get_error_logs(self):
         """エラーログ取得API"""
@@ -1628,18 +1740,19 @@ Sandbox環境で動作中
             # USDTに変換
             usdt_amount = jpy_amount / rate
 
-            # リリースリクエスト作成
-            request_id = create_release_request(
-                client_id=client_id,
-                amount_usdt=usdt_amount,
-                chain=chain,
-                address=address,
-                max_slippage_bps=50
-            )
+            with unit_of_work():
+                # リリースリクエスト作成
+                request_id = create_release_request(
+                    client_id=client_id,
+                    amount_usdt=usdt_amount,
+                    chain=chain,
+                    address=address,
+                    max_slippage_bps=50
+                )
 
-            # レート添付
-            attach_quote(request_id, rate,
-                        (datetime.utcnow() + timedelta(minutes=5)).isoformat() + "Z")
+                # レート添付
+                attach_quote(request_id, rate,
+                            (datetime.utcnow() + timedelta(minutes=5)).isoformat() + "Z")
 
             result = {
                 "success": True,
@@ -1663,34 +1776,63 @@ Sandbox環境で動作中
         approver = data.get('approver')
 
         try:
-            approve_release(request_id, approver)
+            approval = approve_one(request_id, approver)
 
-            # 承認状況確認
-            with db() as conn:
-                c = conn.cursor()
-                c.execute("""
-                    SELECT approvals_count, required_approvals, status
-                    FROM release_requests WHERE id = ?
-                """, (request_id,))
-                row = c.fetchone()
-
-                if row[0] >= row[1]:
-                    # 完全承認されたら実行
-                    payout_id = execute_payout(request_id)
-                    result = {
-                        "success": True,
-                        "fully_approved": True,
-                        "payout_id": payout_id,
-                        "approvals_count": row[0],
-                        "required_approvals": row[1]
-                    }
-                else:
-                    result = {
-                        "success": True,
-                        "fully_approved": False,
-                        "approvals_count": row[0],
-                        "required_approvals": row[1]
-                    }
+            # 完全承認済みなら支払いを実行（承認のコミット後）。前回の支払いが失敗して approved のまま
+            # 残った依頼も、再度の承認で支払いを再試行する（execute_payout は status を見て二重払いしない）
+            if approval["status"] == "approved":
+                payout_id = execute_payout(request_id)
+                result = {
+                    "success": True,
+                    "fully_approved": True,
+                    "payout_id": payout_id,
+                    "approvals_count": approval["approvals_count"],
+                    "required_approvals": approval["required_approvals"]
+                }
+            else:
+                result = {
+                    "success": True,
+                    "fully_approved": False,
+                    "approvals_count": approval["approvals_count"],
+                    "required_approvals": approval["required_approvals"]
+                }
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": str(e)
+            }
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(result).encode())
+
+    def approve_many_transactions(self, data):
+        """一括承認API（承認は1トランザクション、結果はリクエストごと）"""
+        request_ids = data.get('request_ids') or []
+        approver = data.get('approver')
+
+        if not approver or not isinstance(request_ids, list):
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"success": False, "error": "approver and request_ids are required"}).encode())
+            return
+
+        try:
+            results = approve_many(request_ids, approver)
+            # 完全承認済みのものは支払いを実行（コミット後）。approved のまま残った依頼は再試行になる
+            for r in results:
+                if r.get("status") == "approved":
+                    try:
+                        r["payout_id"] = execute_payout(r["request_id"])
+                    except Exception as e:
+                        r["payout_error"] = str(e)
+            result = {
+                "success": True,
+                "results": results,
+                "approved": sum(1 for r in results if r["outcome"] == "approved"),
+            }
         except Exception as e:
             result = {
                 "success": False,
@@ -1737,8 +1879,9 @@ Sandbox環境で動作中
                 client_id = data.get('client_id')
                 amount = data.get('amount')
 
-                evt = deposit_jpy(client_id, amount)
-                record_deposit(evt["json"])
+                with unit_of_work():
+                    evt = deposit_jpy(client_id, amount)
+                    record_deposit(evt["json"])
 
                 result = {
                     "success": True,
@@ -1773,14 +1916,9 @@ Sandbox環境で動作中
 
     def get_bank_deposits(self):
         """銀行入金データ取得API"""
-        with db() as conn:
+        with db(readonly=True) as conn:
             c = conn.cursor()
-            c.execute("""
-                SELECT id, sender_name, sender_bank, amount, purpose,
-                       status, tron_address, processed_at, created_at, updated_at
-                FROM bank_deposits
-                ORDER BY created_at DESC
-            """)
+            c.execute(_BANK_DEPOSITS_SQL)
 
             deposits = []
             for row in c.fetchall():
@@ -1890,7 +2028,8 @@ Sandbox環境で動作中
 def run_server(port=8080):
     """Webサーバー起動"""
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, EscrowWebHandler)
+    # エクスポートなど長いレスポンスが他のリクエストを止めないよう、リクエストごとにスレッドで処理
+    httpd = ThreadingHTTPServer(server_address, EscrowWebHandler)
     print(f'🚀 エスクロー管理システム起動')
     print(f'📍 アクセスURL: http://localhost:{port}')
     print(f'   - メインダッシュボード: http://localhost:{port}/')
@@ -1915,6 +2054,37 @@ if __name__ == "__main__":
         print(f"✅ データベースを初期化しました: {DB_PATH}")
     else:
         print(f"✅ データベースが見つかりました: {DB_PATH}")
+        # 既存DBにも未適用のマイグレーションを適用
+        from .migrations import migrate
+        applied = migrate()
+        if applied:
+            print(f"🔧 マイグレーション適用: {applied}")
+
+    # 前回プロセスがコミット後に書き損ねた監査レコードを追記
+    from .audit import recover_intents
+    recovered = recover_intents()
+    if recovered:
+        print(f"🧾 監査レコード復旧: {recovered}件")
+
+    # 定期オンラインバックアップ（BACKUP_INTERVAL_S > 0 の場合のみ）
+    from .config import BACKUP_INTERVAL_S
+    if BACKUP_INTERVAL_S > 0:
+        from .backups import start_background
+        start_background(BACKUP_INTERVAL_S)
+        print(f"💾 オンラインバックアップ: {BACKUP_INTERVAL_S:.0f}秒ごと")
+
+    # 残高チェックポイント（日次、またはCHECKPOINT_EVERY_ROWS件ごと）。balance_at の全履歴走査を避ける
+    from .config import CHECKPOINT_INTERVAL_S
+    if CHECKPOINT_INTERVAL_S > 0:
+        from .checkpoints import start_background as start_checkpoints
+        start_checkpoints(CHECKPOINT_INTERVAL_S)
+        print(f"📌 残高チェックポイント確認: {CHECKPOINT_INTERVAL_S:.0f}秒ごと")
+
+    # 出金後のRapyd送金・MCP通知はアウトボックス経由でバックグラウンド送信
+    from .outbox import start_background as start_outbox
+    from .config import OUTBOX_WORKERS
+    start_outbox(OUTBOX_WORKERS)
+    print(f"📤 アウトボックス送信ワーカー: {OUTBOX_WORKERS}")
 
     # Renderの環境変数PORTを優先的に使用
     port = int(os.environ.get('PORT', sys.argv[1] if len(sys.argv) > 1 else 10000))
@@ -4,8 +4,7 @@ import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
 from .config import WEBHOOK_SECRET
-from .ledger import record_deposit
-from .db import db
+from .inbox import enqueue, start_background
 from .rapyd_client import verify_webhook as rapyd_verify
 
 
@@ -36,23 +35,22 @@ class Handler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(b"invalid json")
             return
-        etype = evt.get("type")
-        if etype == "payment.completed":
-            record_deposit(evt)
-        elif etype == "payout.sent":
-            data = evt.get("data", {})
-            with db() as conn:
-                c = conn.cursor()
-                c.execute(
-                    "UPDATE payouts SET tx_hash=?, updated_at=datetime('now') WHERE request_id=?",
-                    (data.get("tx_hash"), data.get("request_id")),
-                )
+        # applied later by the inbox drain worker; acknowledging only needs the insert
+        enqueue(body, evt)
         self.send_response(200)
         self.end_headers()
         self.wfile.write(b"ok")
 
 
 def run(host: str = "127.0.0.1", port: int = 8080):
+    from .migrations import migrate
+
+    migrate()
+    # audit records a previous process committed but did not get to append
+    from .audit import recover_intents
+
+    recover_intents()
+    start_background()
     httpd = HTTPServer((host, port), Handler)
     print(f"listening on http://{host}:{port}")
     httpd.serve_forever()
@@ -0,0 +1,20 @@
+"""Point the app at a scratch database, audit log and directories for this test process.
+
+Config is read when ``src.app`` is first imported, so test modules import
+this before anything from the app.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+TMP = tempfile.mkdtemp(prefix="fintech-test-")
+os.environ.update({
+    "DB_PATH": os.path.join(TMP, "fintech.db"),
+    "AUDIT_LOG_PATH": os.path.join(TMP, "audit.log"),
+    "BACKUP_DIR": os.path.join(TMP, "backups"),
+    "REPORTS_DIR": os.path.join(TMP, "reports"),
+    "ARCHIVE_DIR": os.path.join(TMP, "archive"),
+})
+atexit.register(shutil.rmtree, TMP, True)
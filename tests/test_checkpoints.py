@@ -0,0 +1,61 @@
+"""Point-in-time balances and statements across archived months.
+
+    python -m unittest tests.test_checkpoints
+"""
+
+import unittest
+
+from tests import scratch  # noqa: F401  (must come before the app imports)
+from src.app import archive, checkpoints
+from src.app.db import db, init_db
+
+CLIENT = "ARC"
+# (ledger entry time, amount); a checkpoint sits between the first and the rest
+ENTRIES = [
+    ("2024-12-20T00:00:00Z", 100),
+    ("2025-01-10T00:00:00Z", 100),
+    ("2025-01-20T00:00:00Z", 100),
+    ("2025-01-25T00:00:00Z", 100),
+]
+
+
+class ArchivedBalanceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+        with db() as conn:
+            conn.execute("INSERT INTO clients(id, name, created_at) VALUES(?, 'archived', ?)",
+                         (CLIENT, ENTRIES[0][0]))
+            for i, (ts, amount) in enumerate(ENTRIES):
+                conn.execute(
+                    "INSERT INTO transactions(id, client_id, type, status, amount, currency, created_at, updated_at)"
+                    " VALUES(?,?,'deposit','completed',?,'JPY',?,?)",
+                    (f"tx_arc{i}", CLIENT, amount, ts, ts),
+                )
+                conn.execute(
+                    "INSERT INTO ledger_entries(id, tx_id, client_id, direction, amount, currency, created_at)"
+                    " VALUES(?,?,?,'credit',?,'JPY',?)",
+                    (f"le_arc{i}", f"tx_arc{i}", CLIENT, amount, ts),
+                )
+            conn.execute("INSERT INTO balances(client_id, currency, available) VALUES(?, 'JPY', ?)",
+                         (CLIENT, sum(a for _, a in ENTRIES)))
+        checkpoints.write_checkpoints("2024-12-31T23:59:59Z")
+        archive.run("2025-02-01T00:00:00Z")
+        with db(readonly=True) as conn:
+            hot = conn.execute("SELECT COUNT(*) FROM ledger_entries WHERE client_id=?", (CLIENT,)).fetchone()[0]
+        assert hot == 0, "the entries should all have moved to the archive"
+
+    def test_balance_before_cutoff_counts_archived_entries(self):
+        self.assertEqual(checkpoints.balance_at(CLIENT, "JPY", "2024-12-25T00:00:00Z"), 100)
+        self.assertEqual(checkpoints.balance_at(CLIENT, "JPY", "2025-01-12T00:00:00Z"), 200)
+        self.assertEqual(checkpoints.balance_at(CLIENT, "JPY", "2025-01-30T00:00:00Z"), 400)
+        self.assertEqual(checkpoints.balance_at(CLIENT, "JPY", "2025-03-01T00:00:00Z"), 400)
+
+    def test_statement_before_cutoff(self):
+        s = checkpoints.statement(CLIENT, "JPY", "2025-01-01T00:00:00Z", "2025-01-31T23:59:59Z")
+        self.assertEqual((s["opening"], s["closing"]), (100, 400))
+        self.assertEqual([e["id"] for e in s["entries"]], ["le_arc1", "le_arc2", "le_arc3"])
+
+
+if __name__ == "__main__":
+    unittest.main()